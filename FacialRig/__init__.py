@@ -1 +1,6 @@
-from .face_ui import FaceUI
+def __getattr__(name):
+    # The UI is only imported when it's used, so worker processes can import the package without Qt
+    if name == 'FaceUI':
+        from .face_ui import FaceUI
+        return FaceUI
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -2,22 +2,115 @@ from maya.api import OpenMaya
 from maya import cmds, mel
 
 from .unplug_attr import Unplugged
+from .tables import Table
+from . import journal, mesh, nodes, profiling, remap
 
-import json
-from pathlib import Path
-
-
-with open(str(Path(__file__).parent / 'blendshapes.json'), 'r') as f:
-    blendshapes = json.loads(f.read())
+import numpy
 
 
 class BlendShapeData:
     NAME = 'core_blendshapes'
-    BASE = blendshapes['base']
-    SHAPES = blendshapes['shapes']
-    CORRECTIVES = blendshapes['correctives']
-    BLENDSHAPES = blendshapes['blendshapes']
-    MASKS = blendshapes['masks']
+    BASE = Table('blendshapes', 'base')
+    SHAPES = Table('blendshapes', 'shapes')
+    CORRECTIVES = Table('blendshapes', 'correctives')
+    BLENDSHAPES = Table('blendshapes', 'blendshapes')
+    MASKS = Table('blendshapes', 'masks')
+
+
+def get_mask_sources():
+    """Maps every mask to the scene shapes that are painted through it, following blendshapes.json
+
+    Returns:
+        dict: mask name as key and the list of source shape names (shapes or correctives) as value
+    """
+    sources = dict()
+    for shape in BlendShapeData.BLENDSHAPES.values():
+        (values,) = shape.values()
+        mask, main_shape, first_target, sec_target, flip = values
+
+        name = BlendShapeData.CORRECTIVES[main_shape] if sec_target else BlendShapeData.SHAPES[main_shape]
+        mask_sources = sources.setdefault(BlendShapeData.MASKS[mask], list())
+        if name not in mask_sources:
+            mask_sources.append(name)
+    return sources
+
+
+def generate_masks(base_mesh, masks=None, blend=0.02, threshold=0.01, feather=3):
+    """Seeds masks from the delta magnitudes of the shapes each mask is used with.
+    The magnitudes of every source shape are computed in one vectorized pass, then for each mask:
+        - the magnitudes of its shapes are combined and normalised to 0.0 - 1.0.
+        - left masks keep the positive X side, fading across the centre line.
+        - right masks are the left ones copied through the symmetry map.
+        - inner/outer masks split the region with a lateral ramp.
+        - the result is feathered along the mesh edges.
+
+    Args:
+        base_mesh (str): Neutral head mesh the masks are painted on
+        masks (list, optional): Mask names to generate. All masks if None.
+        blend (float, optional): Width of the centre line fade, relative to the head width
+        threshold (float, optional): Magnitudes under this ratio of the region peak are ignored
+        feather (int, optional): Smoothing iterations applied to every mask
+
+    Returns:
+        dict: mask name as key and {vertex id: value} as value, same layout as the painted masks
+    """
+    sources = get_mask_sources()
+    requested = masks or list(sources.keys())
+    # Right masks are generated from their left counterpart
+    masks = list(dict.fromkeys(f'l_{mask[2:]}' if mask.startswith('r_') else mask for mask in requested))
+
+    shape_names = sorted({name for mask in masks for name in sources[mask]})
+    shape_names = [name for name in shape_names if cmds.objExists(name)]
+    if not shape_names:
+        return dict()
+
+    base_points = mesh.get_points(base_mesh)
+    edges = mesh.get_edges(base_mesh)
+    symmetry = mesh.get_symmetry_map(base_points)
+
+    targets = numpy.stack([remap.get_points(base_mesh, name) for name in shape_names])
+    magnitudes = numpy.linalg.norm(targets - base_points[None], axis=2)
+    magnitudes = dict(zip(shape_names, magnitudes))
+
+    x = base_points[:, 0]
+    width = max(numpy.ptp(x), 1e-6)
+    left_side = numpy.clip(0.5 + x / (blend * width), 0.0, 1.0)
+
+    result = dict()
+    for mask in masks:
+        side, *region = mask.split('_')
+        available = [magnitudes[name] for name in sources[mask] if name in magnitudes]
+        if not available:
+            continue
+
+        values = numpy.max(available, axis=0)
+        peak = values.max()
+        if peak == 0.0:
+            continue
+
+        values[values < peak * threshold] = 0.0
+        values = numpy.clip(values / numpy.percentile(values[values > 0.0], 95), 0.0, 1.0)
+
+        if side == 'l':
+            values *= left_side
+
+            if region[-1] in ['inner', 'outer']:
+                active = values > 0.0
+                lateral = numpy.abs(x) - numpy.abs(x[active]).min()
+                lateral = numpy.clip(lateral / max(numpy.ptp(numpy.abs(x[active])), 1e-6), 0.0, 1.0)
+                lateral = lateral * lateral * (3.0 - 2.0 * lateral)
+                values *= lateral if region[-1] == 'outer' else 1.0 - lateral
+
+        values = numpy.clip(mesh.smooth_weights(values, edges, feather), 0.0, 1.0)
+        values[values < 1e-3] = 0.0
+        values = values.round(4)
+
+        result[mask] = dict(enumerate(values.tolist()))
+        if side == 'l':
+            mirrored = '_'.join(['r'] + region)
+            result[mirrored] = dict(enumerate(values[symmetry].tolist()))
+
+    return {mask: values for mask, values in result.items() if mask in requested}
 
 
 def get_blendshape(mesh):
@@ -29,25 +122,94 @@ def get_blendshape(mesh):
     Returns:
         str: Returns the blendshape node if there's any connected to the mesh
     """
-    dag = OpenMaya.MSelectionList().add(mesh).getDagPath(0)
-    obj = OpenMaya.MFnMesh(dag).object()
+    blend_obj = nodes.get_linked(mesh, 'blendShape', find_blendshape)
+    return OpenMaya.MFnDependencyNode(blend_obj).name() if blend_obj else None
+
+
+def find_blendshape(mesh):
+    obj = OpenMaya.MFnMesh(nodes.get_dag(mesh)).object()
 
-    blend_node = None
     dag_iter = OpenMaya.MItDependencyGraph(obj,
                                            OpenMaya.MItDependencyGraph.kDownstream,
                                            OpenMaya.MItDependencyGraph.kPlugLevel)
     while not dag_iter.isDone():
         current_item = dag_iter.currentNode()
         if current_item.hasFn(OpenMaya.MFn.kBlendShape):
-            blend_node = OpenMaya.MFnDependencyNode(current_item).name()
-            break
+            return current_item
         dag_iter.next()
-    return blend_node
+    return None
+
+
+def get_target_plugs(blend_node, shape_index):
+    """Points and components plugs of the in-between 6000, the full weight, of a target"""
+    blend_fn = OpenMaya.MFnDependencyNode(nodes.get_node(blend_node))
+
+    group_plug = nodes.get_plug(blend_node, 'inputTarget').elementByLogicalIndex(0).child(0)
+    item_plug = group_plug.elementByLogicalIndex(shape_index).child(0).elementByLogicalIndex(6000)
+
+    return (item_plug.child(blend_fn.attribute('inputPointsTarget')),
+            item_plug.child(blend_fn.attribute('inputComponentsTarget')))
+
+
+def get_target_deltas(blend_node, shape_index, count):
+    """Reads the stored deltas of a target
+
+    Args:
+        blend_node (str): BlendShape node
+        shape_index (int): Target index
+        count (int): Vertex count of the deformed mesh
+
+    Returns:
+        numpy.ndarray: (vertices, 3) deltas, zero where the target doesn't store any
+    """
+    points_plug, components_plug = get_target_plugs(blend_node, shape_index)
+    result = numpy.zeros((count, 3))
+
+    points_obj = points_plug.asMObject()
+    components_obj = components_plug.asMObject()
+    if points_obj.isNull() or components_obj.isNull():
+        return result
+
+    deltas = numpy.array(OpenMaya.MFnPointArrayData(points_obj).array())[:, :3]
+    components_fn = OpenMaya.MFnComponentListData(components_obj)
+    vertices = numpy.concatenate([
+        numpy.array(OpenMaya.MFnSingleIndexedComponent(components_fn.get(i)).getElements(), dtype=int)
+        for i in range(components_fn.length())])
+
+    result[vertices] = deltas
+    return result
+
+
+def set_target_deltas(blend_node, shape_index, deltas, tolerance=1e-6):
+    """Writes the deltas of a target, only the vertices moving more than the tolerance are stored
+
+    Args:
+        blend_node (str): BlendShape node
+        shape_index (int): Target index, created if it doesn't exist yet
+        deltas (numpy.ndarray): (vertices, 3) deltas
+        tolerance (float, optional): Shorter deltas are dropped
+    """
+    points_plug, components_plug = get_target_plugs(blend_node, shape_index)
+    vertices = numpy.flatnonzero(numpy.linalg.norm(deltas, axis=1) > tolerance)
+
+    component_fn = OpenMaya.MFnSingleIndexedComponent()
+    component_obj = component_fn.create(OpenMaya.MFn.kMeshVertComponent)
+    component_fn.addElements(vertices.tolist())
+
+    components_data = OpenMaya.MFnComponentListData()
+    components_obj = components_data.create()
+    components_data.add(component_obj)
+
+    points_data = OpenMaya.MFnPointArrayData()
+    points_obj = points_data.create(OpenMaya.MPointArray(deltas[vertices].tolist()))
+
+    points_plug.setMObject(points_obj)
+    components_plug.setMObject(components_obj)
 
 
 class BlendShape:
     def __init__(self, main_mesh, masks, global_scale=1.0):
-        main_mesh = OpenMaya.MSelectionList().add(main_mesh).getDagPath(0)
+        main_mesh = nodes.get_dag(main_mesh)
         self.main_mesh = OpenMaya.MFnMesh(main_mesh)
 
         self.current_scale = global_scale
@@ -57,6 +219,8 @@ class BlendShape:
         self.masks_data = masks
         self.shapes = dict()
         self.correctives = dict()
+        # Sparse deltas of the primary targets by alias, shared by every corrective of a build
+        self.delta_cache = dict()
 
     @staticmethod
     def flip_symmetry(mesh, global_scale=1.0):
@@ -96,57 +260,79 @@ class BlendShape:
         cmds.makeIdentity(mesh, a=True, t=True)
         cmds.xform(ztp=True)
 
-    @staticmethod
-    def get_vertices_offset(base_mesh, target_mesh):
-        # base_mesh and target_mesh should match vertex IDs
-
-        base_mesh = OpenMaya.MSelectionList().add(base_mesh).getDependNode(0)
-        target_mesh = OpenMaya.MSelectionList().add(target_mesh).getDependNode(0)
-
-        offset_vtx = dict()
-
-        base_vtx_iter = OpenMaya.MItMeshVertex(base_mesh)
-        target_vtx_iter = OpenMaya.MItMeshVertex(target_mesh)
+    def get_target_offset(self, target):
+        """Offset from a target mesh to the main mesh, computed once per target for the whole build.
+        Both meshes must match vertex IDs, see remap.apply
 
-        while not base_vtx_iter.isDone() and not target_vtx_iter.isDone():
-            offset = base_vtx_iter.position() - target_vtx_iter.position()
-            if not all(value == 0 for value in offset):
-                offset_vtx[base_vtx_iter.index()] = offset
-            base_vtx_iter.next()
-            target_vtx_iter.next()
+        Args:
+            target (str): Target alias, the target mesh in the scene has the same name
 
-        return offset_vtx
-
-    @staticmethod
-    def subtract_offset(corrective_mesh, offset):
-        dag_obj = OpenMaya.MSelectionList().add(corrective_mesh).getDagPath(0)
-        mfn_mesh = OpenMaya.MFnMesh(dag_obj)
-
-        for vtx, vector in offset.items():
-            result = mfn_mesh.getPoint(vtx) + vector
-            mfn_mesh.setPoint(vtx, result)
+        Returns:
+            tuple: (n,) vertex ids and (n, 3) offsets of the vertices the target moves
+        """
+        if target not in self.delta_cache:
+            offset = mesh.get_points(self.main_mesh) - mesh.get_points(target)
+            vertices = numpy.flatnonzero(numpy.any(offset != 0.0, axis=1))
+            self.delta_cache[target] = (vertices, offset[vertices])
+        return self.delta_cache[target]
 
     def get_mask_plug(self, shape_index):
-        blend_node = OpenMaya.MSelectionList().add(self.blend_node).getDependNode(0)
-        blend_node = OpenMaya.MFnDependencyNode(blend_node)
-
-        first_plug = blend_node.findPlug('inputTarget', False)
+        first_plug = nodes.get_plug(self.blend_node, 'inputTarget')
         target_plug = first_plug.elementByLogicalIndex(0)
         group_plug = target_plug.child(0)
 
         shape_plug = group_plug.elementByLogicalIndex(shape_index)
         return shape_plug.child(1)
 
-    def set_mask(self, name, shape_index):
+    def get_mask_values(self, name):
+        values = numpy.zeros(self.main_mesh.numVertices)
+        for vtx, value in self.masks_data[name].items():
+            values[int(vtx)] = float(value)
+        return values
+
+    def set_mask(self, name, shape_index, sparse=False):
+        """Writes a mask as the target weights of a target
+
+        Args:
+            name (str): Mask name
+            shape_index (int): Target index in the blendShape node
+            sparse (bool, optional): The target only stores deltas where the mask isn't zero,
+                the zero weights are removed instead of written. Unset target weights default to 1.0.
+        """
         plug = self.get_mask_plug(shape_index)
+        existing = set(plug.getExistingArrayAttributeIndices()) if sparse else set()
+
+        modifier = OpenMaya.MDGModifier()
         for vtx, value in self.masks_data[name].items():
-            plug.elementByLogicalIndex(int(vtx)).setDouble(float(value))
+            if sparse and not float(value):
+                if int(vtx) in existing:
+                    modifier.removeMultiInstance(plug.elementByLogicalIndex(int(vtx)), True)
+                continue
+            modifier.newPlugValueDouble(plug.elementByLogicalIndex(int(vtx)), float(value))
+        journal.run(modifier)
 
-    def set_combination_shape(self, name, shape_index, driver_targets):
-        blend_node = OpenMaya.MSelectionList().add(self.blend_node).getDependNode(0)
-        blend_node = OpenMaya.MFnDependencyNode(blend_node)
+    def set_sparse_target(self, name, shape_index, tolerance=1e-6):
+        """Rewrites the stored deltas of a target keeping only the vertices its mask doesn't zero out
+
+        Args:
+            name (str): Mask name applied to the target
+            shape_index (int): Target index in the blendShape node
+            tolerance (float, optional): Deltas shorter than this are dropped as well
+
+        Returns:
+            bool: False if the target doesn't store its deltas yet, eg. still connected to a mesh, it's left as is
+        """
+        points_plug, components_plug = get_target_plugs(self.blend_node, shape_index)
+        if points_plug.asMObject().isNull() or components_plug.asMObject().isNull():
+            return False
 
-        blend_plug = blend_node.findPlug('weight', False)
+        deltas = get_target_deltas(self.blend_node, shape_index, self.main_mesh.numVertices)
+        deltas[self.get_mask_values(name) == 0.0] = 0.0
+        set_target_deltas(self.blend_node, shape_index, deltas, tolerance)
+        return True
+
+    def set_combination_shape(self, name, shape_index, driver_targets):
+        blend_plug = nodes.get_plug(self.blend_node, 'weight')
         shape_plug = blend_plug.elementByLogicalIndex(shape_index)
 
         if shape_plug.isDestination:
@@ -157,18 +343,52 @@ class BlendShape:
         first_target_plug = blend_plug.elementByLogicalIndex(first_target)
         sec_target_plug = blend_plug.elementByLogicalIndex(sec_target)
 
+        corrective_fn = mesh.get_mesh_fn(name)
+        points = mesh.get_points(corrective_fn)
         for target in [first_target_plug, sec_target_plug]:
-            self.subtract_offset(name, self.get_vertices_offset(self.main_mesh.name(), target.partialName(useAlias=True)))
+            vertices, offset = self.get_target_offset(target.partialName(useAlias=True))
+            points[vertices] += offset
+        mesh.set_points(corrective_fn, points)
 
         cmds.blendShape(self.blend_node, edit=True, t=[self.main_mesh.name(), shape_index, name, 1.0])
+        self.add_combination(name, shape_index, driver_targets)
+
+    def add_combination(self, name, shape_index, driver_targets):
+        """Drives a corrective target with the product of its two driver targets through a combinationShape node
+
+        Args:
+            name (str): Corrective name, the combinationShape is named after it
+            shape_index (int): Corrective target index in the blendShape node
+            driver_targets (tuple): Target indices of the two driver targets
+        """
+        blend_plug = nodes.get_plug(self.blend_node, 'weight')
+        first_target, sec_target = driver_targets
         cmds.combinationShape(bs=self.blend_node, cti=shape_index, cm=0, dti=[first_target, sec_target])
 
-        self.correctives[name] = [first_target_plug.partialName(useAlias=True), sec_target_plug.partialName(useAlias=True)]
+        self.correctives[name] = [blend_plug.elementByLogicalIndex(first_target).partialName(useAlias=True),
+                                  blend_plug.elementByLogicalIndex(sec_target).partialName(useAlias=True)]
 
-        comb_node = shape_plug.source().node()
+        comb_node = blend_plug.elementByLogicalIndex(shape_index).source().node()
         OpenMaya.MDGModifier().renameNode(comb_node, f'{name}_comb').doIt()
 
-    def create(self):
+    def report(self):
+        weight_plug = nodes.get_plug(self.blend_node, 'weight')
+        weight_plugs = [weight_plug.elementByPhysicalIndex(i) for i in range(weight_plug.numElements())]
+
+        data = profiling.blendshape_footprint(self.blend_node)
+        data['evaluation'] = profiling.evaluation_time(self.main_mesh.name(), weight_plugs)
+        return data
+
+    def create(self, sparse=False, report=False):
+        """Adds every target of blendshapes.json to the main mesh and applies their masks
+
+        Args:
+            sparse (bool, optional): Stores only the deltas of the vertices each mask doesn't zero out
+            report (bool, optional): Displays the node memory footprint and evaluation cost
+                before and after the sparse targets are written
+        """
+        self.delta_cache.clear()
+
         # If the mesh shape is locked, it won't work
         if not self.blend_node:
             self.blend_node = cmds.blendShape(self.main_mesh.name(), n=BlendShapeData.NAME)[0]
@@ -190,6 +410,9 @@ class BlendShape:
             if flip:
                 self.flip_symmetry(target_mesh, self.current_scale)
 
+            # Gathered after the flip, the flip follows the target's own topology
+            remap.apply(self.main_mesh, target_mesh, base_name)
+
             if not sec_target:
                 cmds.blendShape(self.blend_node, edit=True, t=[self.main_mesh.name(), index, target_mesh, 1.0])
 
@@ -211,22 +434,49 @@ class BlendShape:
 
         cmds.delete(temp_shapes)
 
+        if not sparse:
+            return
+
+        # Every target and mask is still fully written, the baseline of the comparison
+        before = self.report() if report else None
+
+        skipped = list()
+        for index, shape in BlendShapeData.BLENDSHAPES.items():
+            (values,) = shape.values()
+            mask = BlendShapeData.MASKS[values[0]]
+            if self.set_sparse_target(mask, int(index)):
+                self.set_mask(mask, int(index), sparse=True)
+            else:
+                skipped.extend(shape.keys())
+
+        if skipped:
+            print('The following targets don\'t store their deltas yet and were kept whole:')
+            print(skipped)
+
+        if report:
+            profiling.display_comparison('Sparse blendshape targets', before, self.report())
+
     def duplicate_n_apply_masks(self):
-        blend_node = OpenMaya.MSelectionList().add(self.blend_node).getDependNode(0)
-        blend_node = OpenMaya.MFnDependencyNode(blend_node)
+        blend_node = OpenMaya.MFnDependencyNode(nodes.get_node(self.blend_node))
 
-        plug = blend_node.findPlug('weight', False)
+        plug = nodes.get_plug(self.blend_node, 'weight')
 
         data = dict()
-        
-        for j in range(plug.numElements()):
-            shape = plug.elementByPhysicalIndex(j).partialName(useAlias=True)
-            index = plug.elementByPhysicalIndex(j).logicalIndex()
-
-            with Unplugged(blend_node.name(), index, plug):
-                plug.elementByPhysicalIndex(j).setFloat(1)
-                data[shape] = self.main_mesh.getPoints()
-                plug.elementByPhysicalIndex(j).setFloat(0)
+        weights = [plug.elementByPhysicalIndex(j) for j in range(plug.numElements())]
+
+        # Every weight is unplugged at once, then each target is sampled on its own
+        with Unplugged(blend_node.name(), list(range(len(weights))), plug):
+            values = [weight.asFloat() for weight in weights]
+            for weight in weights:
+                weight.setFloat(0)
+
+            for weight in weights:
+                weight.setFloat(1)
+                data[weight.partialName(useAlias=True)] = self.main_mesh.getPoints()
+                weight.setFloat(0)
+
+            for weight, value in zip(weights, values):
+                weight.setFloat(value)
 
         main_mesh = OpenMaya.MFnTransform(self.main_mesh.parent(0))
         main_mesh.findPlug('visibility', False).setBool(True)
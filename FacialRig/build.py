@@ -0,0 +1,213 @@
+from maya.api import OpenMaya
+from maya import cmds
+
+import json
+import time
+import types
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide2 import QtCore
+
+from . import cache, journal
+
+
+class Stage:
+    def __init__(self, name, function, compute=False):
+        """A step of the build
+
+        Args:
+            name (str): Displayed name, also the key of its timing history
+            function (callable): Called without arguments. Scene stages can be generators,
+                every yield ends a slice and can give the done ratio of the stage.
+                Returning False stops the build, the scene is only rolled back if an earlier stage changed it.
+            compute (bool, optional): Runs on a worker thread, so it must not touch the scene
+        """
+        self.name = name
+        self.function = function
+        self.compute = compute
+
+
+def run_blocking(stages):
+    """Runs the stages one after the other on the calling thread
+
+    Returns:
+        bool: False if a stage stopped the build
+    """
+    for stage in stages:
+        result = stage.function()
+        if isinstance(result, types.GeneratorType):
+            for _ in result:
+                pass
+        elif result is False:
+            return False
+    return True
+
+
+def load_timings():
+    path = cache.get_cache_dir() / 'build_timings.json'
+    return json.loads(path.read_text()) if path.exists() else dict()
+
+
+def save_timings(timings):
+    path = cache.get_cache_dir() / 'build_timings.json'
+    path.write_text(json.dumps({**load_timings(), **timings}))
+
+
+class Build(QtCore.QObject):
+    """Runs the stages from the Qt event loop so Maya stays responsive.
+    A scene stage slice runs on every timer tick, compute stages run on a worker thread while the timer polls them.
+    The whole build is one undo chunk, the API edits are journaled and the nodes created by the API are tracked,
+    a cancelled or failed build reverts the edits, undoes the chunk and deletes the nodes, leaving the scene as it was.
+    The caller blocks the user input while it runs, so the chunk only holds the build."""
+
+    progress = QtCore.Signal(int, str)
+    finished = QtCore.Signal(bool)
+
+    def __init__(self, stages, parent=None):
+        super(Build, self).__init__(parent)
+        self.stages = stages
+        self.index = 0
+        self.generator = None
+        self.future = None
+        self.cancelled = False
+        self.rolled_back = False
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.step)
+
+        self.history = load_timings()
+        self.timings = dict()
+        self.stage_start = 0.0
+        self.ratio = 0.0
+
+        self.created_nodes = list()
+        self.callback_id = None
+
+    def start(self):
+        cmds.undoInfo(openChunk=True, chunkName='FacialRig build')
+        # The chunk starts with a command restoring the selection,
+        # so the rollback never undoes what was done before the build
+        selection = cmds.ls(selection=True)
+        if selection:
+            cmds.select(selection, replace=True, noExpand=True)
+        else:
+            cmds.select(clear=True)
+        journal.start()
+        self.callback_id = OpenMaya.MDGMessage.addNodeAddedCallback(self.node_added, 'dependNode')
+        self.stage_start = time.perf_counter()
+        self.timer.start(0)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def node_added(self, node, client_data):
+        self.created_nodes.append(OpenMaya.MObjectHandle(node))
+
+    def get_estimate(self, stage):
+        return max(self.history.get(stage.name, 1.0), 1e-3)
+
+    def report(self):
+        stage = self.stages[self.index]
+        elapsed = time.perf_counter() - self.stage_start
+        estimate = self.get_estimate(stage)
+        if self.ratio > 0.0:
+            estimate = elapsed / self.ratio
+        remaining = max(estimate - elapsed, 0.0)
+
+        total = sum(self.get_estimate(each) for each in self.stages)
+        done = sum(self.get_estimate(each) for each in self.stages[:self.index])
+        done += self.get_estimate(stage) * (self.ratio if self.ratio > 0.0 else min(elapsed / estimate, 0.99))
+
+        self.progress.emit(int(100 * done / total),
+                           f'{stage.name} ({self.index + 1}/{len(self.stages)}) - {remaining:.0f}s left')
+
+    def next_stage(self):
+        stage = self.stages[self.index]
+        self.timings[stage.name] = time.perf_counter() - self.stage_start
+
+        self.index += 1
+        self.generator = None
+        self.future = None
+        self.ratio = 0.0
+        self.stage_start = time.perf_counter()
+
+        if self.index == len(self.stages):
+            self.stop(True)
+
+    def step(self):
+        # A running compute stage can't be interrupted, the cancel happens once it's done
+        if self.cancelled and not (self.future and not self.future.done()):
+            self.stop(False)
+            return
+
+        stage = self.stages[self.index]
+        try:
+            if self.future:
+                if self.future.done():
+                    if self.future.result() is False:
+                        self.stop(False, rollback=self.index > 0)
+                        return
+                    self.next_stage()
+                    return
+
+            elif self.generator:
+                try:
+                    ratio = next(self.generator)
+                    if ratio is not None:
+                        self.ratio = float(ratio)
+                except StopIteration:
+                    self.next_stage()
+                    return
+
+            elif stage.compute:
+                self.future = self.executor.submit(stage.function)
+
+            else:
+                result = stage.function()
+                if isinstance(result, types.GeneratorType):
+                    self.generator = result
+                elif result is False:
+                    # Stopping at the first stage, the validation, leaves nothing to roll back
+                    self.stop(False, rollback=self.index > 0)
+                    return
+                else:
+                    self.next_stage()
+                    return
+        except Exception:
+            traceback.print_exc()
+            OpenMaya.MGlobal.displayError(f'The build failed during {stage.name}, the scene was restored')
+            self.stop(False)
+            return
+
+        self.report()
+
+    def stop(self, completed, rollback=True):
+        self.timer.stop()
+        self.executor.shutdown(wait=False)
+        OpenMaya.MMessage.removeCallback(self.callback_id)
+        cmds.undoInfo(closeChunk=True)
+        steps = journal.stop()
+
+        if completed:
+            save_timings(self.timings)
+        elif rollback:
+            self.rollback(steps)
+            self.rolled_back = True
+
+        text = 'Finished' if completed else 'Cancelled' if self.rolled_back else 'Stopped'
+        self.progress.emit(100 if completed else 0, text)
+        self.finished.emit(completed)
+
+    def rollback(self, steps):
+        # The API edits go first, the chunk undo then finds the scene as its commands left it
+        journal.revert(steps)
+        if cmds.undoInfo(q=True, state=True):
+            cmds.undo()
+
+        # Nodes made by the API aren't in the undo queue
+        nodes = [OpenMaya.MFnDependencyNode(handle.object()).name() for handle in self.created_nodes if handle.isValid()]
+        nodes = [node for node in nodes if cmds.objExists(node)]
+        if nodes:
+            cmds.delete(nodes)
@@ -0,0 +1,77 @@
+import os
+import json
+import struct
+import numpy
+from pathlib import Path
+
+
+MAGIC = b'FRIGBNDL'
+VERSION = 1
+ALIGNMENT = 64
+# Magic, version and the byte size of the table of contents
+HEADER = struct.Struct('<8sIQ')
+
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write(file_path, arrays, meta=None):
+    """Writes a bundle: a header, a JSON table of contents and every array as an aligned raw chunk.
+    The file is replaced only once it's complete.
+
+    Args:
+        file_path (str, pathlib.Path): Bundle file
+        arrays (dict): array name as key and numpy.ndarray as value
+        meta (dict, optional): JSON serializable data stored in the table of contents
+    """
+    arrays = {name: numpy.ascontiguousarray(array) for name, array in arrays.items()}
+
+    chunks = dict()
+    offset = 0
+    for name, array in arrays.items():
+        chunks[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset = align(offset + array.nbytes)
+
+    toc = json.dumps({'arrays': chunks, 'meta': meta or dict()}).encode('utf-8')
+    data_start = align(HEADER.size + len(toc))
+
+    file_path = Path(file_path)
+    temp_path = file_path.with_suffix('.tmp')
+    with open(str(temp_path), 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(toc)))
+        f.write(toc)
+        for name, array in arrays.items():
+            f.seek(data_start + chunks[name]['offset'])
+            f.write(array.tobytes())
+    os.replace(str(temp_path), str(file_path))
+
+
+def read(file_path):
+    """Maps a bundle in memory, the arrays are only read from disk when they're accessed
+
+    Args:
+        file_path (str, pathlib.Path): Bundle file
+
+    Returns:
+        tuple: dict of read only numpy.ndarray by name and the meta data dict
+    """
+    with open(str(file_path), 'rb') as f:
+        magic, version, toc_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f'{file_path} isn\'t a FacialRig bundle')
+        if version > VERSION:
+            raise ValueError(f'{file_path} was written by a newer version ({version}) than supported ({VERSION})')
+        toc = json.loads(f.read(toc_size).decode('utf-8'))
+
+    data_start = align(HEADER.size + toc_size)
+    buffer = numpy.memmap(str(file_path), dtype=numpy.uint8, mode='r')
+
+    arrays = dict()
+    for name, chunk in toc['arrays'].items():
+        dtype = numpy.dtype(chunk['dtype'])
+        size = int(numpy.prod(chunk['shape'])) * dtype.itemsize
+        start = data_start + chunk['offset']
+        arrays[name] = buffer[start:start + size].view(dtype).reshape(chunk['shape'])
+    return arrays, toc['meta']
+
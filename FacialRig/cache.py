@@ -0,0 +1,52 @@
+from maya import cmds
+
+import os
+import numpy
+from pathlib import Path
+
+
+def get_cache_dir():
+    """Folder next to the scene holding the outputs of the build stages, eg. scene.ma -> scene_facialrig
+
+    Returns:
+        pathlib.Path: The cache folder, created if needed
+    """
+    scene = cmds.file(q=True, sceneName=True)
+    if scene:
+        scene = Path(scene)
+        path = scene.parent / f'{scene.stem}_facialrig'
+    else:
+        path = Path(cmds.internalVar(userAppDir=True)) / 'FacialRig' / 'untitled'
+
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def save(stage, **data):
+    """Stores the arrays of a stage, the previous ones are replaced only once the new file is complete
+
+    Args:
+        stage (str): Name of the stage, used as file name
+        **data: numpy.ndarray or array like values
+    """
+    path = get_cache_dir() / f'{stage}.npz'
+    temp_path = path.with_suffix('.tmp.npz')
+    numpy.savez(str(temp_path), **data)
+    os.replace(str(temp_path), str(path))
+
+
+def load(stage):
+    """Reads the arrays of a stage
+
+    Args:
+        stage (str): Name of the stage
+
+    Returns:
+        dict: array name as key and numpy.ndarray as value, None if the stage was never saved
+    """
+    path = get_cache_dir() / f'{stage}.npz'
+    if not path.exists():
+        return None
+
+    with numpy.load(str(path), allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
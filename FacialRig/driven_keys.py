@@ -1,14 +1,6 @@
 from maya import cmds
 
-import json
-from pathlib import Path
-
-
-with open(str(Path(__file__).parent / 'driven_keys.json'), 'r') as f:
-    driven_keys = json.loads(f.read())
-
-with open(str(Path(__file__).parent / 'driven_keys_joints.json'), 'r') as f:
-    driven_keys_joints = json.loads(f.read())
+from .tables import Table
 
 
 def get():
@@ -16,8 +8,15 @@ def get():
 
 
 def load_driven_keys(data, global_scale=1.0):
+    for _ in iter_driven_keys(data, global_scale):
+        pass
+
+
+def iter_driven_keys(data, global_scale=1.0):
+    """Same as load_driven_keys, yielding the done ratio before every driver so a build can be sliced"""
 
-    for ctr, pose_data in data.items():
+    for i, (ctr, pose_data) in enumerate(data.items()):
+        yield i / max(len(data), 1)
         if not pose_data:
             continue
 
@@ -40,6 +39,6 @@ def load_driven_keys(data, global_scale=1.0):
 
 
 class DrivenKeysData:
-    POSES = driven_keys['poses']
-    SHAPES = driven_keys['shapes']
-    JOINTS = driven_keys_joints
+    POSES = Table('driven_keys', 'poses')
+    SHAPES = Table('driven_keys', 'shapes')
+    JOINTS = Table('driven_keys_joints')
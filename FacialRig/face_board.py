@@ -1,119 +1,126 @@
+from maya.api import OpenMaya
 from maya import cmds
 
-import json
-from pathlib import Path
-
-
-with open(str(Path(__file__).parent / 'face_board.json'), 'r') as f:
-    board_shape = json.loads(f.read())
-
-
-def create_shape(name, shape, degree=1, global_scale=1.0):
-    shape = [[value * global_scale for value in row] for row in shape]
-
-    transform = cmds.curve(n=name, d=degree, p=shape)
-    cmds.rename(
-        cmds.listRelatives(transform, s=True, f=True), "{}Shape".format(transform)
-    )
-    return transform
-
-
-def set_color(node, color):
-    node_shape = cmds.listRelatives(node, s=True, f=True)[0]
-
-    color_type = True if isinstance(color, list) else False
-
-    cmds.setAttr(f'{node_shape}.overrideEnabled', 1)
-    cmds.setAttr(f'{node_shape}.overrideRGBColors', color_type)
-    if color_type:
-        for a, b in zip(('R', 'G', 'B'), color):
-            cmds.setAttr(f'{node_shape}.overrideColor{a}', b)
+import math
+import functools
+
+from . import tables
+
+
+# Radius of the CVs of a cmds.circle of radius 1, they sit every 45 degrees
+CIRCLE_CV_RADIUS = 1.108194
+
+LOCKABLE = ["translateX", "translateY", "translateZ", "rotateX", "rotateY", "rotateZ",
+            "scaleX", "scaleY", "scaleZ", "visibility"]
+
+LONG_NAMES = {"tx": "translateX", "ty": "translateY", "tz": "translateZ",
+              "rx": "rotateX", "ry": "rotateY", "rz": "rotateZ",
+              "sx": "scaleX", "sy": "scaleY", "sz": "scaleZ"}
+
+
+def to_centimeters(value, unit):
+    """Distance in the given OpenMaya.MDistance unit converted to the internal unit the API takes"""
+    return OpenMaya.MDistance(value, unit).asCentimeters()
+
+
+def get_curve_data(points, degree=1, global_scale=1.0, unit=OpenMaya.MDistance.kCentimeters):
+    """CVs and knots of an open curve going through the given points like cmds.curve builds it,
+    the points are in the given unit like cmds.curve takes them in the UI unit"""
+    cvs = OpenMaya.MPointArray([[to_centimeters(value * global_scale, unit) for value in row] for row in points])
+    if degree == 1:
+        knots = list(range(len(points)))
+    else:
+        spans = len(points) - degree
+        knots = [0] * (degree - 1) + list(range(spans + 1)) + [spans] * (degree - 1)
+    return cvs, OpenMaya.MDoubleArray(knots), degree, OpenMaya.MFnNurbsCurve.kOpen
+
+
+def get_circle_data(radius):
+    """CVs and knots of the periodic curve cmds.circle builds on the XY plane"""
+    angles = [math.radians(-45.0 * (i + 1)) for i in range(8)]
+    points = [[CIRCLE_CV_RADIUS * radius * math.cos(a), CIRCLE_CV_RADIUS * radius * math.sin(a), 0.0] for a in angles]
+    # Periodic curves repeat their first degree CVs
+    cvs = OpenMaya.MPointArray(points + points[:3])
+    return cvs, OpenMaya.MDoubleArray(range(-2, 11)), 3, OpenMaya.MFnNurbsCurve.kPeriodic
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(global_scale=1.0, unit=OpenMaya.MDistance.kCentimeters):
+    """Board curves and control settings computed once, shared by every board built with the same scale and unit.
+    The board table is in UI units, the curves and translations are converted to centimeters for the API.
+
+    Args:
+        global_scale (float, optional): Scene unit scale
+        unit (int, optional): OpenMaya.MDistance unit of the scene, the UI unit
+
+    Returns:
+        dict: 'curves' with the curve data by name and 'controls' with the settings of every control
+    """
+    board_shape = tables.load('face_board')
+
+    curves = {'outline': get_curve_data(board_shape["outline_board_shape"], global_scale=global_scale, unit=unit),
+              'face': get_curve_data(board_shape["face_board_shape"], 3, global_scale=global_scale, unit=unit)}
+    for key, points in board_shape["shapes"].items():
+        curves[key] = get_curve_data(points, unit=unit)
+
+    controls = list()
+    for name, attr in board_shape["controls"].items():
+        if not attr:
+            continue
+
+        scale = [1.0, 1.0, 1.0]
+        ratio = 0.2
+        if attr["shape"] == 0:
+            scale = [2.0, 2.0, 2.0]
+            ratio = 0.1
+
+        if ratio not in curves:
+            curves[ratio] = get_circle_data(to_centimeters(ratio, unit))
+
+        locked = set(LOCKABLE) - {LONG_NAMES.get(each, each) for each in attr["unlocked"]}
+        controls.append({'name': name,
+                         'shape': str(attr["shape"]),
+                         'circle': ratio,
+                         'translate': [to_centimeters(value * global_scale, unit) for value in attr["translate"]],
+                         'rotate': [math.radians(value) for value in attr["rotate"]],
+                         'scale': [value * global_scale for value in scale],
+                         'txLimits': attr["txLimits"],
+                         'tyLimits': attr["tyLimits"],
+                         'locked': [each for each in LOCKABLE if each in locked]})
+    return {'curves': curves, 'controls': controls}
+
+
+def set_override(node, color=None, display_type=None):
+    """Drawing overrides of a shape set through its plugs, color is an index or a RGB list"""
+    node_fn = OpenMaya.MFnDependencyNode(node)
+    node_fn.findPlug('overrideEnabled', False).setBool(True)
+    if display_type is not None:
+        node_fn.findPlug('overrideDisplayType', False).setInt(display_type)
+    if color is None:
         return
 
-    cmds.setAttr(f'{node_shape}.overrideColor', color)
-
-
-def set_transformations(node, translation=None, rotation=None, scale=None, global_scale=1.0):
-    if translation:
-        cmds.xform(node, t=[value * global_scale for value in translation])
-    if rotation:
-        cmds.xform(node, ro=rotation)
-    if scale:
-        cmds.xform(node, s=[value * global_scale for value in scale])
-
-
-def set_limits(node, txLimits=None, tyLimits=None):
-    if txLimits:
-        cmds.transformLimits(node, tx=txLimits)
-        cmds.transformLimits(node, etx=(True, True))
-    if tyLimits:
-        cmds.transformLimits(node, ty=tyLimits)
-        cmds.transformLimits(node, ety=(True, True))
-
-
-def lock_n_hide(node, avoid):
-    if not isinstance(avoid, list):
-        avoid = [avoid]
-
-    avoid_attributes = {
-        "tx": ["tx", "translateX"],
-        "translateX": ["tx", "translateX"],
-        "ty": ["ty", "translateY"],
-        "translateY": ["ty", "translateY"],
-        "tz": ["tz", "translateZ"],
-        "translateZ": ["tz", "translateZ"],
-        "rx": ["rx", "rotateX"],
-        "rotateX": ["rx", "rotateX"],
-        "ry": ["ry", "rotateY"],
-        "rotateY": ["ry", "rotateY"],
-        "rz": ["rz", "rotateZ"],
-        "rotateZ": ["rz", "rotateZ"],
-        "sx": ["sx", "scaleX"],
-        "scaleX": ["sx", "scaleX"],
-        "sy": ["sy", "scaleY"],
-        "scaleY": ["sy", "scaleY"],
-        "sz": ["sz", "scaleZ"],
-        "scaleZ": ["sz", "scaleZ"],
-    }
-
-    attributes = [
-        "tx",
-        "ty",
-        "tz",
-        "rx",
-        "ry",
-        "rz",
-        "sx",
-        "sy",
-        "sz",
-        "translateX",
-        "translateY",
-        "translateZ",
-        "rotateX",
-        "rotateY",
-        "rotateZ",
-        "scaleX",
-        "scaleY",
-        "scaleZ",
-        "visibility",
-    ]
-
-    attrs_to_avoid = list()
-    for attr in avoid:
-        attrs_to_avoid.extend(
-            item for item in avoid_attributes[attr] if item not in attrs_to_avoid
-        )
-
-    attributes = [item for item in attributes if item not in attrs_to_avoid]
-
-    for attr in attributes:
-        cmds.setAttr(f"{node}.{attr}", k=False, l=True, cb=False)
+    rgb = isinstance(color, list)
+    node_fn.findPlug('overrideRGBColors', False).setBool(rgb)
+    if not rgb:
+        node_fn.findPlug('overrideColor', False).setInt(color)
+        return
+    for channel, value in zip(('R', 'G', 'B'), color):
+        node_fn.findPlug(f'overrideColor{channel}', False).setFloat(value)
 
 
 class FaceBoard:
-    def __init__(self, head_joint=None, global_scale=1.0):
+    def __init__(self, head_joint=None, global_scale=1.0, namespace=None):
+        """Board of the facial controls
+
+        Args:
+            head_joint (str, optional): Joint the board follows
+            global_scale (float, optional): Scene unit scale
+            namespace (str, optional): Namespace of the board nodes, so every character can get its
+                own board built from the same template
+        """
+        self.namespace = namespace
         self.suffix = "ctr"
-        self.base_board = "FaceBoard"
+        self.base_board = self.get_name("FaceBoard")
         # self.root_joint = "Root_Jnt_Exp"
         self.head_joint = head_joint
         self.face_joint = "Face_jnt"
@@ -121,60 +128,86 @@ class FaceBoard:
         self.current_scale = global_scale
         self.controls = dict()
 
-    def create_controls(self):
-        base_board = create_shape(f"face_board_{self.suffix}", board_shape["outline_board_shape"], global_scale=self.current_scale)
-        face_board = create_shape(f"face_board_{self.suffix}_crv", board_shape["face_board_shape"], 3, global_scale=self.current_scale)
-
-        set_color(base_board, 17)
-        cmds.setAttr(f"{face_board}.overrideEnabled", 1)
-        cmds.setAttr(f"{face_board}.overrideDisplayType", 2)
-
-        controls_group = list()
-        for name, attr in board_shape["controls"].items():
-            if not attr:
-                continue
-
-            scale = [1.0, 1.0, 1.0]
-            ratio = 0.2
-            if attr["shape"] == 0:
-                scale = [2.0, 2.0, 2.0]
-                ratio = 0.1
-
-            transform = cmds.group(n=f"{name}_{self.suffix}_grp", em=True)
-            outer_shape = create_shape(f"{name}_{self.suffix}_crv", board_shape["shapes"][str(attr["shape"])])
-            inner_shape = cmds.circle(
-                n=f"{name}_{self.suffix}", r=ratio, nr=(0, 0, 1), ch=False)[0]
-
-            cmds.parent([outer_shape, inner_shape], transform)
-
-            set_transformations(transform, attr["translate"], attr["rotate"], scale, global_scale=self.current_scale)
-            set_limits(inner_shape, attr["txLimits"], attr["tyLimits"])
-            lock_n_hide(inner_shape, attr["unlocked"])
-
-            set_color(inner_shape, 17)
-            cmds.setAttr(f"{outer_shape}.overrideEnabled", 1)
-            cmds.setAttr(f"{outer_shape}.overrideDisplayType", 2)
-
-            controls_group.append(transform)
-            
-            self.controls[inner_shape] = dict()
-            if attr["txLimits"]:
-                self.controls[inner_shape]['txLimits'] = attr["txLimits"]
-
-            if attr["tyLimits"]:
-                self.controls[inner_shape]['tyLimits'] = attr["tyLimits"]
-        
-        cmds.parent(controls_group + [face_board], base_board)
-
-        root_group = cmds.group(base_board, n=self.base_board)
+    def get_name(self, name):
+        return f"{self.namespace}:{name}" if self.namespace else name
 
-        if not cmds.objExists(self.head_joint):
+    def create_controls(self):
+        """Builds the whole board from the cached template, the transforms come from one MDagModifier
+        and the curve shapes, transformations, limits, colors and locks are set through the API"""
+        unit = OpenMaya.MDistance.uiUnit()
+        template = get_template(self.current_scale, unit)
+        if self.namespace and not cmds.namespace(exists=self.namespace):
+            cmds.namespace(add=self.namespace)
+
+        modifier = OpenMaya.MDagModifier()
+
+        def create_transform(name, parent=OpenMaya.MObject.kNullObj):
+            node = modifier.createNode("transform", parent)
+            modifier.renameNode(node, self.get_name(name))
+            return node
+
+        root_group = create_transform("FaceBoard")
+        base_board = create_transform(f"face_board_{self.suffix}", root_group)
+        face_board = create_transform(f"face_board_{self.suffix}_crv", base_board)
+
+        controls = list()
+        for data in template['controls']:
+            transform = create_transform(f"{data['name']}_{self.suffix}_grp", base_board)
+            controls.append([data, transform,
+                             create_transform(f"{data['name']}_{self.suffix}_crv", transform),
+                             create_transform(f"{data['name']}_{self.suffix}", transform)])
+        modifier.doIt()
+
+        def create_curve(transform, key):
+            cvs, knots, degree, form = template['curves'][key]
+            shape = OpenMaya.MFnNurbsCurve().create(cvs, knots, degree, form, False, False, transform)
+            OpenMaya.MFnDependencyNode(shape).setName(f"{OpenMaya.MFnDependencyNode(transform).name()}Shape")
+            return shape
+
+        set_override(create_curve(base_board, 'outline'), 17)
+        set_override(create_curve(face_board, 'face'), display_type=2)
+
+        for data, transform, outer_shape, inner_shape in controls:
+            set_override(create_curve(outer_shape, data['shape']), display_type=2)
+            set_override(create_curve(inner_shape, data['circle']), 17)
+
+            transform_fn = OpenMaya.MFnTransform(transform)
+            transform_fn.setTranslation(OpenMaya.MVector(data['translate']), OpenMaya.MSpace.kTransform)
+            transform_fn.setRotation(OpenMaya.MEulerRotation(*data['rotate']), OpenMaya.MSpace.kTransform)
+            transform_fn.setScale(data['scale'])
+
+            inner_fn = OpenMaya.MFnTransform(inner_shape)
+            for axis, limits in [('X', data['txLimits']), ('Y', data['tyLimits'])]:
+                if not limits:
+                    continue
+                for side, value in zip(('Min', 'Max'), limits):
+                    limit = getattr(OpenMaya.MFnTransform, f'kTranslate{side}{axis}')
+                    # The limits stay in UI units in self.controls, like the ROM and driven keys using them
+                    inner_fn.setLimit(limit, to_centimeters(value, unit))
+                    inner_fn.enableLimit(limit, True)
+
+            for attr in data['locked']:
+                plug = inner_fn.findPlug(attr, False)
+                plug.isKeyable = False
+                plug.isChannelBox = False
+                plug.isLocked = True
+
+            name = inner_fn.name()
+            self.controls[name] = dict()
+            if data['txLimits']:
+                self.controls[name]['txLimits'] = data['txLimits']
+
+            if data['tyLimits']:
+                self.controls[name]['tyLimits'] = data['tyLimits']
+
+        if not self.head_joint or not cmds.objExists(self.head_joint):
             return
 
         offset = [value * self.current_scale for value in [20.0, 4.0, 0.0]]
         pos = cmds.xform(self.head_joint, q=True, ws=True, t=True)
         pos = [x + y for x, y in zip(pos, offset)]
-        
-        cmds.xform(root_group, ws=True, s=[0.6, 0.6, 0.6])
+
+        base_board = OpenMaya.MFnDependencyNode(base_board).name()
+        cmds.xform(self.base_board, ws=True, s=[0.6, 0.6, 0.6])
         cmds.xform(base_board, ws=True, t=pos)
         cmds.parentConstraint(self.head_joint, base_board, mo=True, weight=1)
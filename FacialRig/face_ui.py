@@ -2,12 +2,11 @@ from maya.api import OpenMaya, OpenMayaAnim
 from maya import OpenMayaUI, cmds, mel
 
 from .face_board import FaceBoard
-from .blendshapes import BlendShape, BlendShapeData
-from .driven_keys import DrivenKeysData, load_driven_keys
-from . import lib
-
-import MayaData
+from .blendshapes import BlendShape, BlendShapeData, generate_masks, get_target_deltas, set_target_deltas
+from .driven_keys import DrivenKeysData, iter_driven_keys, load_driven_keys
+from . import build, bundle, cache, journal, keys, lib, lod, nodes, profiling, report, rom, session, skin, stream, validate
 
+import copy
 import math
 import json
 import numpy
@@ -45,7 +44,19 @@ class FaceUI(QtWidgets.QDialog):
     UI_INSTANCE = None
     COLOR_SET_NAME = 'FaceRigColorSet'
     FILE_FILTER = 'Json (*.json)'
-    MAYA_DIALOG = QtWidgets.QDialog(maya_main_window())
+    BUNDLE_FILTER = 'FacialRig bundle (*.frbundle)'
+    ANIMATION_FILTER = 'FacialRig animation (*.franim)'
+    # What a build sets, put back as it was when a build is rolled back
+    BUILD_STATE = ['data', 'face_board', 'anim_data', 'comb_data', 'rom_owners', 'face_driven_keys',
+                   '_rom_cache', '_comb_nodes', 'current_frame']
+    MAYA_DIALOG = None
+
+    @classmethod
+    def maya_dialog(cls):
+        # Created on first use, importing the module doesn't touch the Maya main window
+        if not cls.MAYA_DIALOG:
+            cls.MAYA_DIALOG = QtWidgets.QDialog(maya_main_window())
+        return cls.MAYA_DIALOG
 
     @classmethod
     def show_ui(cls):
@@ -58,8 +69,9 @@ class FaceUI(QtWidgets.QDialog):
             cls.UI_INSTANCE.raise_()
             cls.UI_INSTANCE.activateWindow()
 
-    def __init__(self, parent=maya_main_window()):
-        super(FaceUI, self).__init__(parent)
+    def __init__(self, parent=None):
+        # Resolved here, a default argument would reach the Maya main window when the module is imported
+        super(FaceUI, self).__init__(parent or maya_main_window())
 
         self.setWindowTitle("Face Rig")
         self.setWindowFlags(self.windowFlags() ^ QtCore.Qt.WindowContextHelpButtonHint)
@@ -67,17 +79,19 @@ class FaceUI(QtWidgets.QDialog):
         self.data = None
         self.face_board = None
         self.base_head = None
-        self.head_skeleton = None
-        self.head_skin = None
-        self.teeth_skin = None
+        self._teeth_skin = None
         self.masks = dict()
 
         self.global_scale = None
 
         self._rom_cache = list()
+        self._comb_nodes = list()
+        self.current_build = None
+        self.build_state = dict()
 
         self.anim_data = dict()
         self.comb_data = dict()
+        self.rom_owners = dict()
         self.face_driven_keys = dict()
         self.current_frame = 1
         self.edit_mode = False
@@ -92,10 +106,51 @@ class FaceUI(QtWidgets.QDialog):
         self.main_layout()
         self.create_connections()
 
+        # Crash safety, only the masks changed since the last autosave are written
+        self.session = session.SessionStore()
+        self.restore_session()
+        self.autosave_timer = QtCore.QTimer(self)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.autosave_timer.start(5000)
+
+    @property
+    def teeth_skin(self):
+        """Weights and influence names of the teeth, None if there's no skinned teeth mesh"""
+        teeth = self.teeth_field.text()
+        if self._teeth_skin is None and teeth and cmds.objExists(teeth) and skin.get_skin_cluster(teeth):
+            self._teeth_skin = skin.get_weights(teeth)
+        return self._teeth_skin
+
     def closeEvent(self, event):
         if self.edit_mode:
             self.edit_mask_button.setStyleSheet("")
             self.toggle_mask_mode()
+        self.session.flush(self.masks, self.get_session_meta())
+
+    def get_session_meta(self):
+        fields = [self.head_field, self.face_field, self.r_eye_field, self.l_eye_field, self.jaw_field, self.teeth_field]
+        return {'base_head': self.base_head, 'fields': [field.text() for field in fields]}
+
+    def autosave(self):
+        self.session.save(self.masks, self.get_session_meta())
+
+    def restore_session(self):
+        meta, masks = self.session.restore()
+        if not meta:
+            return
+
+        fields = [self.head_field, self.face_field, self.r_eye_field, self.l_eye_field, self.jaw_field, self.teeth_field]
+        for field, text in zip(fields, meta['fields']):
+            field.setText(text)
+
+        self.masks.update(masks)
+        for mask_widget in [self.masks_widget.item(i) for i in range(self.masks_widget.count())]:
+            if mask_widget.text() in self.masks:
+                self.highlight_item(mask_widget)
+
+        if meta['base_head'] and cmds.objExists(meta['base_head']):
+            self.base_head = meta['base_head']
+        OpenMaya.MGlobal.displayInfo(f'FaceUI session restored, {len(masks)} masks')
 
     def set_masks_layout(self):
         self.masks_layout = QtWidgets.QVBoxLayout()
@@ -138,6 +193,7 @@ class FaceUI(QtWidgets.QDialog):
         slider_layout.addWidget(self.flood_button)
 
         self.mirror_button = QtWidgets.QPushButton('MIRROR')
+        self.auto_mask_button = QtWidgets.QPushButton('AUTO MASKS')
         self.import_button = QtWidgets.QPushButton('IMPORT')
         self.export_button = QtWidgets.QPushButton('EXPORT')
         import_layout.addWidget(self.import_button)
@@ -160,6 +216,7 @@ class FaceUI(QtWidgets.QDialog):
         self.masks_layout.addLayout(weights_layout)
         self.masks_layout.addLayout(slider_layout)
         self.masks_layout.addWidget(self.mirror_button)
+        self.masks_layout.addWidget(self.auto_mask_button)
         self.masks_layout.addLayout(import_layout)
 
     def set_shapes_layout(self):
@@ -197,13 +254,21 @@ class FaceUI(QtWidgets.QDialog):
                   [QtWidgets.QLabel('LEFT EYE JOINT'), QtWidgets.QLineEdit('Eye_L_jnt')],
                   [QtWidgets.QLabel('JAW JOINT'), QtWidgets.QLineEdit('Jaw_jnt')],
                   [QtWidgets.QLabel('TEETH MESH'), QtWidgets.QLineEdit('Teeth_Base')],
-                  [QtWidgets.QLabel('NUMBER OF FACE JOINTS'), QtWidgets.QSpinBox()]]
-
-        self.head_field, self.face_field, self.r_eye_field, self.l_eye_field, self.jaw_field, self.teeth_field, self.n_joints = [n[-1] for n in fields]
+                  [QtWidgets.QLabel('NUMBER OF FACE JOINTS'), QtWidgets.QSpinBox()],
+                  [QtWidgets.QLabel('REGION BORDER RING'), QtWidgets.QSpinBox()],
+                  [QtWidgets.QLabel('MAX INFLUENCES'), QtWidgets.QSpinBox()],
+                  [QtWidgets.QLabel('WEIGHT BITS'), QtWidgets.QSpinBox()]]
+
+        self.head_field, self.face_field, self.r_eye_field, self.l_eye_field, self.jaw_field, self.teeth_field, self.n_joints, self.border_ring, self.max_influences, self.weight_bits = [n[-1] for n in fields]
+        self.n_joints.setValue(81)
+        self.border_ring.setValue(2)
+        self.max_influences.setRange(1, 8)
+        self.max_influences.setValue(4)
+        self.weight_bits.setRange(8, 16)
+        self.weight_bits.setSingleStep(8)
+        self.weight_bits.setValue(8)
 
         for widgets in fields:
-            if isinstance(widgets[-1], QtWidgets.QSpinBox):
-                widgets[-1].setValue(81)
             base_layout = QtWidgets.QHBoxLayout()
             widgets[-1].setMinimumHeight(20)
             widgets[-1].setFont(self.default_font)
@@ -211,14 +276,70 @@ class FaceUI(QtWidgets.QDialog):
             base_layout.addWidget(widgets[-1])
             self.buttons.addLayout(base_layout)
 
+        self.sparse_box = QtWidgets.QCheckBox('SPARSE TARGETS')
+        self.region_box = QtWidgets.QCheckBox('REGION SOLVE')
+        # Every face region gets its own solve, only the NUMPY SOLVER ones run in parallel processes,
+        # DemBones needs the Maya session so its regions are solved one after the other
+        self.regions_box = QtWidgets.QCheckBox('SOLVE BY REGION')
+        self.numpy_box = QtWidgets.QCheckBox('NUMPY SOLVER')
+        self.warm_box = QtWidgets.QCheckBox('WARM START')
+        self.warm_box.setChecked(True)
+        self.compact_box = QtWidgets.QCheckBox('COMPACT ROM')
+        self.report_box = QtWidgets.QCheckBox('ACCURACY REPORT')
+        self.light_box = QtWidgets.QCheckBox('LIGHT CORRECTIVES')
+        self.bundle_box = QtWidgets.QCheckBox('WRITE BUNDLE')
+        self.bundle_box.setChecked(True)
+        self.reduce_box = QtWidgets.QCheckBox('REDUCE KEYS')
+        self.quantize_box = QtWidgets.QCheckBox('QUANTIZE EXPORT')
+        self.quantize_box.setChecked(True)
+        self.buttons.addWidget(self.sparse_box)
+        self.buttons.addWidget(self.region_box)
+        self.buttons.addWidget(self.regions_box)
+        self.buttons.addWidget(self.numpy_box)
+        self.buttons.addWidget(self.warm_box)
+        self.buttons.addWidget(self.compact_box)
+        self.buttons.addWidget(self.report_box)
+        self.buttons.addWidget(self.light_box)
+        self.buttons.addWidget(self.bundle_box)
+        self.buttons.addWidget(self.reduce_box)
+        self.buttons.addWidget(self.quantize_box)
+
         self.rig_button = QtWidgets.QPushButton('CREATE RIG')
         self.rig_button.setMinimumSize(150, 60)
 
         self.rom_button = QtWidgets.QPushButton('CREATE ROM')
         self.rom_button.setMinimumSize(150, 60)
 
+        self.optimize_button = QtWidgets.QPushButton('OPTIMIZE SKIN')
+        self.optimize_button.setMinimumSize(150, 30)
+
+        self.lod_button = QtWidgets.QPushButton('CREATE LODS')
+        self.lod_button.setMinimumSize(150, 30)
+
+        self.benchmark_button = QtWidgets.QPushButton('BENCHMARK CORRECTIVES')
+        self.benchmark_button.setMinimumSize(150, 30)
+
+        self.rebuild_button = QtWidgets.QPushButton('REBUILD FROM BUNDLE')
+        self.rebuild_button.setMinimumSize(150, 30)
+
+        self.export_anim_button = QtWidgets.QPushButton('EXPORT ANIMATION')
+        self.export_anim_button.setMinimumSize(150, 30)
+
         self.buttons.addWidget(self.rig_button)
         self.buttons.addWidget(self.rom_button)
+        self.buttons.addWidget(self.optimize_button)
+        self.buttons.addWidget(self.lod_button)
+        self.buttons.addWidget(self.benchmark_button)
+        self.buttons.addWidget(self.rebuild_button)
+        self.buttons.addWidget(self.export_anim_button)
+
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_label = QtWidgets.QLabel()
+        self.progress_dialog = None
+
+        self.buttons.addWidget(self.progress_bar)
+        self.buttons.addWidget(self.progress_label)
 
     def main_layout(self):
         main_layout = QtWidgets.QHBoxLayout(self)
@@ -231,11 +352,21 @@ class FaceUI(QtWidgets.QDialog):
     def create_connections(self):
         self.rig_button.clicked.connect(self.generate_rig)
         self.rom_button.clicked.connect(self.generate_rom)
+        self.optimize_button.clicked.connect(self.optimize_skin)
+        self.lod_button.clicked.connect(self.create_lods)
+        self.benchmark_button.clicked.connect(self.benchmark_correctives)
+        self.rebuild_button.clicked.connect(self.rebuild_from_bundle)
+        self.export_anim_button.clicked.connect(self.export_animation)
+
+        for field in [self.head_field, self.face_field, self.r_eye_field, self.l_eye_field, self.jaw_field,
+                      self.teeth_field]:
+            field.textChanged.connect(lambda text: self.session.mark())
 
         self.load_mesh_button.clicked.connect(self.set_base_head)
         self.edit_mask_button.clicked.connect(self.toggle_mask_mode)
         self.flood_button.clicked.connect(self.set_vtx_value)
         self.mirror_button.clicked.connect(self.mirror_mask)
+        self.auto_mask_button.clicked.connect(self.auto_mask)
         self.import_button.clicked.connect(self.import_mask)
         self.export_button.clicked.connect(self.export_mask)
         self.masks_widget.itemSelectionChanged.connect(self.load_mask)
@@ -252,35 +383,6 @@ class FaceUI(QtWidgets.QDialog):
             return
         list_item_widget.setBackground(green)
 
-    @staticmethod
-    def check_existence(list_widget, base_head):
-        missing_shapes = list()
-        not_matching = list()
-        for row in range(list_widget.count()):
-            shape_item = list_widget.item(row)
-            if not cmds.objExists(shape_item.text()):
-                missing_shapes.append(shape_item.text())
-                FaceUI.highlight_item(shape_item, False)
-                continue
-            FaceUI.highlight_item(shape_item)
-
-            unmatched = FaceUI.check_vtx_count(base_head, shape_item)
-            if unmatched:
-                not_matching.append(unmatched)
-        return missing_shapes, not_matching
-
-    @staticmethod
-    def check_vtx_count(main_mesh, list_widget):
-        main_mesh = OpenMaya.MSelectionList().add(main_mesh).getDagPath(0)
-        sec_mesh = OpenMaya.MSelectionList().add(list_widget.text()).getDagPath(0)
-
-        main_count = OpenMaya.MFnMesh(main_mesh).numVertices
-        sec_count = OpenMaya.MFnMesh(sec_mesh).numVertices
-
-        if main_count != sec_count:
-            FaceUI.highlight_item(list_widget, False)
-            return list_widget.text()
-
     @staticmethod
     def lerp(start, end, t):
         return (1.0 - t) * start + t * end
@@ -301,12 +403,217 @@ class FaceUI(QtWidgets.QDialog):
             return 1.0, FaceUI.lerp(0.5, 0.0, t), 0.0
 
     def generate_rom(self):
-        self.create_blendshapes()
-        self.create_controls(True)
+        self.start_build([build.Stage('Blendshapes', self.create_blendshapes)] + self.get_build_stages(True))
 
     def generate_rig(self):
-        self.create_blendshapes()
-        self.create_controls()
+        if self.face_board:
+            print('The rig is already built')
+            return
+        self.start_build([build.Stage('Blendshapes', self.create_blendshapes)] + self.get_build_stages())
+
+    def optimize_skin(self):
+        # The deformation error is measured over the playback range, a ROM should be keyed beforehand
+        face_mesh = 'Face_Base'
+        if not cmds.objExists(face_mesh) or not skin.get_skin_cluster(face_mesh):
+            print(f'{face_mesh} isn\'t skinned, create the rig first')
+            return
+
+        skin.optimize(face_mesh, self.max_influences.value(), self.weight_bits.value())
+
+    def write_bundle(self, face_mesh):
+        """Stores what the rig is built from in a single file next to the scene: masks, sparse target deltas,
+        the ROM schedule, the decomposition, the driven keys and the final skin weights"""
+        count = OpenMaya.MFnMesh(nodes.get_dag(self.base_head)).numVertices
+        face_joint = self.face_field.text()
+
+        mask_names = sorted(self.masks)
+        mask_arrays = lib.get_mask_arrays(self.masks, count)
+        arrays = {'masks': numpy.array([mask_arrays[name] for name in mask_names], dtype=numpy.float32).reshape(-1, count)}
+
+        weight_plug = nodes.get_plug(self.data.blend_node, 'weight')
+        targets, vertices, deltas, offsets = list(), list(), list(), [0]
+        for j in range(weight_plug.numElements()):
+            plug = weight_plug.elementByPhysicalIndex(j)
+            target = get_target_deltas(self.data.blend_node, plug.logicalIndex(), count)
+            moving = numpy.flatnonzero(numpy.any(target != 0.0, axis=1))
+
+            targets.append([plug.logicalIndex(), plug.partialName(useAlias=True)])
+            vertices.append(moving)
+            deltas.append(target[moving])
+            offsets.append(offsets[-1] + len(moving))
+
+        arrays['target_vertices'] = numpy.concatenate(vertices + [numpy.zeros(0)]).astype(numpy.int32)
+        arrays['target_deltas'] = numpy.concatenate(deltas + [numpy.zeros((0, 3))]).astype(numpy.float32)
+        arrays['target_offsets'] = numpy.array(offsets, dtype=numpy.int64)
+
+        weights, influences = skin.get_weights(face_mesh)
+        arrays['skin_indptr'], arrays['skin_indices'], arrays['skin_values'] = skin.to_csr(weights)
+
+        meta = {'vertex_count': count,
+                'face_mesh': face_mesh,
+                'face_joint': face_joint,
+                'head_joint': self.head_field.text(),
+                'light': self.light_box.isChecked(),
+                'mask_names': mask_names,
+                'targets': targets,
+                'influences': influences,
+                'anim_data': [[frame, drivers] for frame, drivers in self.anim_data.items()],
+                'comb_data': [[frame, data] for frame, data in self.comb_data.items()],
+                'curve_attributes': sorted({driven.split('.')[1]
+                                            for poses in self.face_driven_keys.values()
+                                            for driven_list in poses.values()
+                                            for driven in driven_list if driven.split('.')[0] == face_joint}),
+                # Driver values are floats, they can't be JSON keys
+                'driven_keys': [[driver, value, driven_list]
+                                for driver, poses in self.face_driven_keys.items()
+                                for value, driven_list in poses.items()]}
+
+        dembones = cache.load('dembones')
+        if dembones:
+            arrays['dembones_weights'] = dembones['weights']
+            arrays['dembones_transforms'] = dembones['transforms']
+            meta['dembones_influences'] = dembones['influences'].tolist()
+
+        file_path = cache.get_cache_dir() / 'rig.frbundle'
+        bundle.write(file_path, arrays, meta)
+        OpenMaya.MGlobal.displayInfo(f'Rig bundle written to {file_path}')
+
+    def rebuild_from_bundle(self, file_path=None):
+        # Everything computed by a full build comes from the bundle, the decomposition is skipped
+        if not self.base_head:
+            print('The base head mesh is missing')
+            return
+
+        if self.face_board:
+            print('The rig is already built')
+            return
+
+        if not file_path:
+            file_path, selected_filter = QtWidgets.QFileDialog.getOpenFileName(
+                self.maya_dialog(), 'Rebuild From Bundle', str(cache.get_cache_dir()), self.BUNDLE_FILTER)
+            if not file_path:
+                return
+
+        arrays, meta = bundle.read(file_path)
+        count = meta['vertex_count']
+        self.global_scale = SceneScale()
+
+        self.masks = {name: {int(vtx): float(values[vtx]) for vtx in numpy.flatnonzero(values)}
+                      for name, values in zip(meta['mask_names'], arrays['masks'])}
+        for name in self.masks:
+            self.session.mark(name)
+
+        self.data = BlendShape(self.base_head, self.masks, self.global_scale.factor)
+        if not self.data.blend_node:
+            self.data.blend_node = cmds.blendShape(self.base_head, n=BlendShapeData.NAME)[0]
+
+        target_masks = rom.get_target_masks()
+        offsets = arrays['target_offsets']
+        for i, (index, alias) in enumerate(meta['targets']):
+            deltas = numpy.zeros((count, 3))
+            deltas[arrays['target_vertices'][offsets[i]:offsets[i + 1]]] = arrays['target_deltas'][offsets[i]:offsets[i + 1]]
+
+            # Deltas outside of the mask are dropped, the mask only needs its non zero values
+            mask = target_masks.get(alias)
+            if mask in self.masks:
+                deltas[self.data.get_mask_values(mask) == 0.0] = 0.0
+            set_target_deltas(self.data.blend_node, index, deltas)
+            cmds.aliasAttr(alias, f'{self.data.blend_node}.w[{index}]')
+            if mask in self.masks:
+                self.data.set_mask(mask, index, sparse=True)
+
+        for index, shape in BlendShapeData.BLENDSHAPES.items():
+            (shape_name,) = shape.keys()
+            (values,) = shape.values()
+            mask, main_shape, first_target, sec_target, flip = values
+            self.data.shapes[shape_name] = int(index)
+            if not sec_target:
+                continue
+
+            # The corrective deltas come from the bundle, only its combination is made again
+            self.data.add_combination(shape_name, int(index), (first_target, sec_target))
+
+        self.face_board = FaceBoard(meta['head_joint'], self.global_scale.factor)
+        self.face_board.create_controls()
+        load_driven_keys(DrivenKeysData.POSES, self.global_scale.factor)
+
+        face_joint = meta['face_joint']
+        for name in meta['curve_attributes']:
+            if not cmds.attributeQuery(name, node=face_joint, exists=True):
+                cmds.addAttr(face_joint, longName=name, attributeType='float', minValue=0.0, maxValue=1.0, k=True)
+
+        self.anim_data = {int(frame): drivers for frame, drivers in meta['anim_data']}
+        self.comb_data = {int(frame): data for frame, data in meta['comb_data']}
+        self.create_comb_data(meta['light'])
+
+        self.face_driven_keys = dict()
+        for driver, value, driven_list in meta['driven_keys']:
+            self.face_driven_keys.setdefault(driver, dict())[value] = driven_list
+        load_driven_keys(self.face_driven_keys, self.global_scale.factor)
+        load_driven_keys(DrivenKeysData.JOINTS, self.global_scale.factor)
+
+        skin.load_weights(meta['face_mesh'], (arrays['skin_indptr'], arrays['skin_indices'], arrays['skin_values']),
+                          meta['influences'])
+
+        if 'dembones_weights' in arrays:
+            cache.save('dembones', weights=arrays['dembones_weights'], transforms=arrays['dembones_transforms'],
+                       influences=numpy.array(meta['dembones_influences']))
+
+        cmds.select(cl=True)
+        OpenMaya.MGlobal.displayInfo(f'Rig rebuilt from {file_path}')
+
+    def create_lods(self):
+        # The selected meshes are the decimated versions of the face, placed over it
+        face_mesh = 'Face_Base'
+        lod_meshes = cmds.ls(sl=True, type='transform')
+        if not lod_meshes:
+            print('Select the LOD meshes first')
+            return
+
+        if not cmds.objExists(face_mesh) or not skin.get_skin_cluster(face_mesh):
+            print(f'{face_mesh} isn\'t skinned, create the rig first')
+            return
+
+        lod.build(face_mesh, lod_meshes, self.masks, self.base_head)
+
+    def get_export_channels(self):
+        """Plugs and joints sampled by export_animation: the board controls, the blendshape weights
+        and the face joint hierarchy, parents first"""
+        plugs = [f'{ctr}.{attr}' for ctr, limits in self.face_board.controls.items()
+                 for attr in ['tx', 'ty'] if f'{attr}Limits' in limits]
+        if cmds.objExists(BlendShapeData.NAME):
+            aliases = cmds.listAttr(f'{BlendShapeData.NAME}.w', m=True) or list()
+            plugs += [f'{BlendShapeData.NAME}.{alias}' for alias in aliases]
+
+        face_joint = self.face_field.text()
+        joints = [face_joint] + list(reversed(cmds.listRelatives(face_joint, ad=True, type='joint') or list()))
+        return plugs, joints
+
+    def export_animation(self):
+        if not self.face_board or not cmds.ls(list(self.face_board.controls.keys())):
+            print('The face board needs to be created first')
+            return
+
+        file_path, selected_filter = QtWidgets.QFileDialog.getSaveFileName(
+            self.maya_dialog(), 'Export Animation', QtCore.QDir.homePath(), self.ANIMATION_FILTER)
+        if not file_path:
+            return
+
+        plugs, joints = self.get_export_channels()
+        channels = plugs + [f'{joint}.{attr}' for joint in joints for attr in lib.TRANSFORM_CHANNELS]
+        start, end = int(cmds.playbackOptions(q=True, min=True)), int(cmds.playbackOptions(q=True, max=True))
+        frames = list(range(start, end + 1))
+
+        meta = {'start': start, 'fps': mel.eval('currentTimeUnitToFPS'), 'joints': joints}
+        chunks = lib.iter_samples(plugs, joints, frames, stream.CHUNK_SIZE)
+        with profiling.timed('Export animation'):
+            for written in stream.write(file_path, channels, chunks, quantize=self.quantize_box.isChecked(), meta=meta):
+                self.update_progress(int(100 * written / len(frames)), f'Export: {written}/{len(frames)} frames')
+                QtCore.QCoreApplication.processEvents(QtCore.QEventLoop.ExcludeUserInputEvents)
+
+        reader = stream.Reader(file_path)
+        OpenMaya.MGlobal.displayInfo(f'Exported {len(reader)} frames of {len(channels)} channels to {file_path}, '
+                                     f'max error {reader.error:.6f}')
 
     def toggle_mask_mode(self):
         if not self.base_head:
@@ -343,11 +650,10 @@ class FaceUI(QtWidgets.QDialog):
             print('Please select a mesh type object')
             return
 
+        # The skins are only read when a stage needs them
         self.base_head = base_head.partialPathName()
-        self.head_skin = MayaData.skin.get(self.base_head)
-        self.head_skeleton = MayaData.skeleton.get(list(self.head_skin.keys())[0])
-        if self.teeth_field.text():
-            self.teeth_skin = MayaData.skin.get(self.teeth_field.text())
+        self._teeth_skin = None
+        self.session.mark()
 
         self.edit_mode = False
         self.toggle_mask_mode()
@@ -356,7 +662,7 @@ class FaceUI(QtWidgets.QDialog):
         if not self.base_head:
             return
 
-        base_head = OpenMaya.MSelectionList().add(self.base_head).getDagPath(0)
+        base_head = nodes.get_dag(self.base_head)
         sel_list = OpenMaya.MGlobal.getActiveSelectionList()
         try:
             path, comp = sel_list.getComponent(0)
@@ -399,10 +705,10 @@ class FaceUI(QtWidgets.QDialog):
 
         for vtx in selected_vertices:
             self.masks[mask.text()][vtx] = value
+        self.session.mark(mask.text())
 
     def load_mask(self):
-        sel_list = OpenMaya.MSelectionList().add(self.base_head)
-        mesh_mfn = OpenMaya.MFnMesh(sel_list.getDagPath(0))
+        mesh_mfn = OpenMaya.MFnMesh(nodes.get_dag(self.base_head))
 
         if self.COLOR_SET_NAME in mesh_mfn.getColorSetNames():
             mesh_mfn.deleteColorSet(self.COLOR_SET_NAME)
@@ -424,7 +730,7 @@ class FaceUI(QtWidgets.QDialog):
         mesh_mfn.setVertexColors(color_array, list(map(int, self.masks[mask.text()].keys())))
 
     def mirror_mask(self):
-        mesh_mfn = OpenMaya.MSelectionList().add(self.base_head).getDagPath(0)
+        mesh_mfn = nodes.get_dag(self.base_head)
         mesh_mfn = OpenMaya.MFnMesh(mesh_mfn)
 
         mask_items = [self.masks_widget.item(i) for i in range(self.masks_widget.count())]
@@ -459,18 +765,46 @@ class FaceUI(QtWidgets.QDialog):
                 new_values[closest] = value
 
             self.masks[target] = new_values
+            self.session.mark(target)
             mask_widget = [mask for mask in mask_items if target == mask.text()]
             if not mask_widget:
                 continue
             self.highlight_item(mask_widget[0])
         cmds.delete(temp_node)
 
+    def auto_mask(self):
+        if not self.base_head:
+            print('The base head mesh is missing')
+            return
+
+        # Painted or imported masks are kept, only the empty ones get a baseline
+        missing = [mask for mask in BlendShapeData.MASKS if mask not in self.masks]
+        if not missing:
+            return
+
+        generated = generate_masks(self.base_head, missing)
+
+        mask_items = [self.masks_widget.item(i) for i in range(self.masks_widget.count())]
+        for mask_widget in mask_items:
+            if mask_widget.text() not in generated:
+                continue
+            self.masks[mask_widget.text()] = generated[mask_widget.text()]
+            self.session.mark(mask_widget.text())
+            self.highlight_item(mask_widget)
+
+        not_generated = [mask for mask in missing if mask not in generated]
+        if not_generated:
+            print('The following masks couldn\'t be generated, their shapes weren\'t found in the scene:')
+            print(not_generated)
+
+        self.load_mask()
+
     def import_mask(self):
         if not self.base_head:
             print('The base head mesh is missing')
             return
 
-        file_paths, selected_filter = QtWidgets.QFileDialog.getOpenFileNames(self.MAYA_DIALOG, 'Import Masks', '',
+        file_paths, selected_filter = QtWidgets.QFileDialog.getOpenFileNames(self.maya_dialog(), 'Import Masks', '',
                                                                              self.FILE_FILTER)
         if not file_paths:
             return
@@ -488,16 +822,17 @@ class FaceUI(QtWidgets.QDialog):
 
             with open(str(file), 'r') as f:
                 self.masks[file.stem] = json.loads(f.read())
+            self.session.mark(file.stem)
 
     def export_mask(self):
-        dir_path = QtWidgets.QFileDialog.getExistingDirectory(self.MAYA_DIALOG, 'Export Masks', QtCore.QDir.homePath())
+        dir_path = QtWidgets.QFileDialog.getExistingDirectory(self.maya_dialog(), 'Export Masks', QtCore.QDir.homePath())
         if not dir_path:
             return
 
         for mask in self.masks:
             file_path = Path(dir_path) / f'{mask}.json'
             with open(file_path, 'w') as f:
-                f.write(json.dumps(self.masks[mask], indent=4))
+                f.write(json.dumps(self.masks[mask], separators=(',', ':')))
 
     def update_values_box(self, value):
         self.values_box.setValue(value / 100.0)
@@ -511,7 +846,7 @@ class FaceUI(QtWidgets.QDialog):
 
         if not self.base_head:
             print('The base head mesh is missing')
-            return
+            return False
 
         # Check if all masks have data
         missing_masks = list()
@@ -526,31 +861,27 @@ class FaceUI(QtWidgets.QDialog):
         if missing_masks:
             print(f'The following masks don\'t contain any data:')
             print(missing_masks)
-            return
+            return False
 
-        missing_shapes = list()
-        not_matching = list()
+        shape_items = [widget.item(row) for widget in [self.shapes_widget, self.corrective_widget]
+                       for row in range(widget.count())]
+        joints = [field.text() for field in [self.head_field, self.face_field, self.r_eye_field, self.l_eye_field,
+                                             self.jaw_field]]
+        problems = validate.run(self.base_head, [item.text() for item in shape_items], joints)
 
-        for shapes in [self.shapes_widget, self.corrective_widget]:
-            a, b = self.check_existence(shapes, self.base_head)
-            missing_shapes.extend(a)
-            not_matching.extend(b)
+        failed_shapes = {name.split(' ')[0] for problem, names in problems.items() if problem != 'missing_joints'
+                         for name in names}
+        for shape_item in shape_items:
+            self.highlight_item(shape_item, shape_item.text() not in failed_shapes)
 
-        if missing_shapes:
-            print(f'The following shapes weren\'t found in the scene:')
-            print(missing_shapes)
-            return
-
-        if not_matching:
-            print(f'The following shapes don\'t match the vtx count:')
-            print(not_matching)
-            return
+        if validate.report(problems):
+            return False
 
         if self.edit_mode:
             self.toggle_mask_mode()
 
         self.data = BlendShape(self.base_head, self.masks, self.global_scale.factor)
-        self.data.create()
+        self.data.create(self.sparse_box.isChecked(), self.sparse_box.isChecked())
 
     def create_curve_attributes(self):
 
@@ -563,27 +894,37 @@ class FaceUI(QtWidgets.QDialog):
             if frame not in self.anim_data:
                 continue
 
-            driver_data = self.anim_data[frame]
-            ctr_name = driver_data['node']
-            attr = driver_data['attribute']
+            for driver_data in self.anim_data[frame]:
+                ctr_name = driver_data['node']
+                attr = driver_data['attribute']
 
-            value = driver_data['value']
+                value = driver_data['value']
 
-            direction = 'positive' if value > 0.0 else 'negative'
-            name = f"{ctr_name}_{direction_map[attr][direction]}"
-            cmds.addAttr(self.face_field.text(), longName=name, attributeType='float', minValue=0.0, maxValue=1.0, k=True)
+                direction = 'positive' if value > 0.0 else 'negative'
+                name = f"{ctr_name}_{direction_map[attr][direction]}"
+                cmds.addAttr(self.face_field.text(), longName=name, attributeType='float', minValue=0.0, maxValue=1.0, k=True)
 
-            driven = f"{self.face_field.text()}.{name}"
-            data.setdefault(f'{ctr_name}.{attr}', {}).setdefault(value, {})[driven] = 1.0
+                driven = f"{self.face_field.text()}.{name}"
+                data.setdefault(f'{ctr_name}.{attr}', {}).setdefault(value, {})[driven] = 1.0
 
         return data
 
-    def create_comb_data(self):
+    def create_comb_data(self, light=False):
+        """Drives the corrective attributes of the face joint from the product of their two clamped controls
+
+        Args:
+            light (bool, optional): One combinationShape node per corrective and clamps shared
+                by every corrective using the same control plug and limit, three per clamp node,
+                instead of two clamps and a multiplyDivide per corrective
+        """
+        if light:
+            self.create_light_comb_data()
+            return
 
         for frame, data in self.comb_data.items():
-            cmds.addAttr(self.face_field.text(), ln=data['attribute'], at='float', dv=0.0, k=True)
-            attr_plug = OpenMaya.MSelectionList().add(self.face_field.text()).getDependNode(0)
-            attr_plug = OpenMaya.MFnTransform(attr_plug).findPlug(data['attribute'], False)
+            if not cmds.attributeQuery(data['attribute'], node=self.face_field.text(), exists=True):
+                cmds.addAttr(self.face_field.text(), ln=data['attribute'], at='float', dv=0.0, k=True)
+            attr_plug = nodes.get_plug(self.face_field.text(), data['attribute'])
 
             mod = OpenMaya.MDGModifier()
             clamp_output = list()
@@ -591,10 +932,10 @@ class FaceUI(QtWidgets.QDialog):
                 ctr, limit = each
                 ctr_name, ctr_attr = ctr.split('.')
 
-                ctr_node = OpenMaya.MSelectionList().add(ctr_name).getDependNode(0)
-                ctr_plug = OpenMaya.MFnTransform(ctr_node).findPlug(ctr_attr, False)
+                ctr_plug = nodes.get_plug(ctr_name, ctr_attr)
 
                 clamp_node = mod.createNode('clamp')
+                self._comb_nodes.append(clamp_node)
                 clamp_mfn = OpenMaya.MFnDependencyNode(clamp_node)
                 if limit < 0:
                     min_plug = clamp_mfn.findPlug('minR', False)
@@ -615,28 +956,103 @@ class FaceUI(QtWidgets.QDialog):
             multiply_output = multiply_mfn.findPlug('outputX', False)
 
             self._rom_cache.append(multiply_node)
+            self._comb_nodes.append(multiply_node)
 
             clamp_a, clamp_b = clamp_output
             mod.connect(clamp_a, plug_a)
             mod.connect(clamp_b, plug_b)
             mod.connect(multiply_output, attr_plug)
-            mod.doIt()
+            journal.run(mod)
 
-    def key_control(self, node, attribute, neutral_value, target_value):
+    def create_light_comb_data(self):
+        face_joint = self.face_field.text()
 
-        lib.set_key(node, attribute, neutral_value, self.current_frame)
+        mod = OpenMaya.MDGModifier()
+        clamps = dict()
+        free_channels = dict()
+        for frame, data in self.comb_data.items():
+            if not cmds.attributeQuery(data['attribute'], node=self.face_field.text(), exists=True):
+                cmds.addAttr(self.face_field.text(), ln=data['attribute'], at='float', dv=0.0, k=True)
+            attr_plug = nodes.get_plug(face_joint, data['attribute'])
+
+            comb_node = mod.createNode('combinationShape')
+            self._rom_cache.append(comb_node)
+            self._comb_nodes.append(comb_node)
+            comb_mfn = OpenMaya.MFnDependencyNode(comb_node)
+            comb_mfn.findPlug('combinationMethod', False).setInt(0)
+            input_plug = comb_mfn.findPlug('inputWeight', False)
+
+            for i, (ctr, limit) in enumerate(data['nodes']):
+                ctr_name, ctr_attr = ctr.split('.')
+
+                if (ctr, limit) not in clamps:
+                    # Every clamp node holds three control plugs of the same control
+                    if not free_channels.get(ctr_name):
+                        clamp_node = mod.createNode('clamp')
+                        self._comb_nodes.append(clamp_node)
+                        free_channels[ctr_name] = [(clamp_node, channel) for channel in 'RGB']
+
+                    clamp_node, channel = free_channels[ctr_name].pop(0)
+                    clamp_mfn = OpenMaya.MFnDependencyNode(clamp_node)
+                    clamp_mfn.findPlug(f'min{channel}' if limit < 0 else f'max{channel}', False).setFloat(limit)
+
+                    mod.connect(nodes.get_plug(ctr_name, ctr_attr), clamp_mfn.findPlug(f'input{channel}', False))
+                    clamps[(ctr, limit)] = clamp_mfn.findPlug(f'output{channel}', False)
+
+                mod.connect(clamps[(ctr, limit)], input_plug.elementByLogicalIndex(i))
+
+            mod.connect(comb_mfn.findPlug('outputWeight', False), attr_plug)
+        journal.run(mod)
+
+    def delete_comb_data(self):
+        comb_nodes = [OpenMaya.MFnDependencyNode(node).name() for node in self._comb_nodes
+                      if OpenMaya.MObjectHandle(node).isValid()]
+        self._rom_cache = [node for node in self._rom_cache if node not in self._comb_nodes]
+        self._comb_nodes = list()
+        if comb_nodes:
+            cmds.delete(comb_nodes)
+
+    def benchmark_correctives(self, loops=3):
+        # Rebuilds the corrective network in place with both modes, the selected one is left in the scene
+        if not self.comb_data:
+            print('There\'s no corrective network, create the rig first')
+            return
+
+        fps = dict()
+        for light in [False, True]:
+            self.delete_comb_data()
+            self.create_comb_data(light)
+            fps[light] = profiling.playback_fps(loops=loops)
+
+        self.delete_comb_data()
+        self.create_comb_data(self.light_box.isChecked())
+        profiling.display_comparison('Corrective network playback', {'fps': fps[False]}, {'fps': fps[True]})
+
+    def key_controls(self, poses):
+        # Every pose of the group goes from neutral to its target and back on the same frames
+        for node, attribute, neutral_value, target_value in poses:
+            lib.set_key(node, attribute, neutral_value, self.current_frame)
         self.current_frame += 1
 
-        self.anim_data[self.current_frame] = {'node': node, 'attribute': attribute, 'value': target_value}
-        lib.set_key(node, attribute, target_value, self.current_frame)
+        self.anim_data[self.current_frame] = list()
+        for node, attribute, neutral_value, target_value in poses:
+            self.anim_data[self.current_frame].append({'node': node, 'attribute': attribute, 'value': target_value})
+            lib.set_key(node, attribute, target_value, self.current_frame)
         self.current_frame += 1
 
-        lib.set_key(node, attribute, neutral_value, self.current_frame)
+        for node, attribute, neutral_value, target_value in poses:
+            lib.set_key(node, attribute, neutral_value, self.current_frame)
+
+    def create_rom(self, compact=False):
+        for _ in self.iter_rom(compact):
+            pass
 
-    def create_rom(self):
+    def iter_rom(self, compact=False):
+        """Same as create_rom, yielding the done ratio between the pose groups so a build can be sliced"""
         self.current_frame = 1
         self.anim_data = dict()
         self.comb_data = dict()
+        self.rom_owners = dict()
         # Creates animation for each blendshape face control (excluding tongue)
         OpenMaya.MTime.setUIUnit(OpenMaya.MTime.kNTSCFrame)
 
@@ -649,6 +1065,7 @@ class FaceUI(QtWidgets.QDialog):
         excluded = ['fidget_ctr', 'head_ctr', 'lipSeal_ctr', 'tongue_ctr', 'tongue_curl_ctr',
                     'tongue_forward_ctr']
 
+        poses = list()
         for ctr, limits in self.face_board.controls.items():
             if ctr in excluded:
                 continue
@@ -657,21 +1074,32 @@ class FaceUI(QtWidgets.QDialog):
                 if limits['txLimits'][0] != 0.0:
                     neutral_value = cmds.getAttr(f'{ctr}.tx')
 
-                    self.key_control(ctr, 'tx', neutral_value, limits['txLimits'][0])
-                    self.key_control(ctr, 'tx', neutral_value, limits['txLimits'][1])
+                    poses.append([ctr, 'tx', neutral_value, limits['txLimits'][0]])
+                    poses.append([ctr, 'tx', neutral_value, limits['txLimits'][1]])
 
                 else:
-                    self.key_control(ctr, 'tx', limits['txLimits'][0], limits['txLimits'][1])
+                    poses.append([ctr, 'tx', limits['txLimits'][0], limits['txLimits'][1]])
 
             if 'tyLimits' in limits:
                 if limits['tyLimits'][0] != 0.0:
                     neutral_value = cmds.getAttr(f'{ctr}.ty')
 
-                    self.key_control(ctr, 'ty', neutral_value, limits['tyLimits'][0])
-                    self.key_control(ctr, 'ty', neutral_value, limits['tyLimits'][1])
+                    poses.append([ctr, 'ty', neutral_value, limits['tyLimits'][0]])
+                    poses.append([ctr, 'ty', neutral_value, limits['tyLimits'][1]])
 
                 else:
-                    self.key_control(ctr, 'ty', limits['tyLimits'][0], limits['tyLimits'][1])
+                    poses.append([ctr, 'ty', limits['tyLimits'][0], limits['tyLimits'][1]])
+
+        groups = [[pose] for pose in poses]
+        if compact:
+            # Controls moving separate vertices are posed together, the analysis splits them back by region
+            vertex_count = OpenMaya.MFnMesh(nodes.get_dag(self.base_head)).numVertices
+            groups, self.rom_owners = rom.schedule(poses, lib.get_mask_arrays(self.masks, vertex_count))
+            OpenMaya.MGlobal.displayInfo(f'Compact ROM: {len(poses)} poses on {len(groups)} frames')
+
+        for i, group in enumerate(groups):
+            yield i / len(groups)
+            self.key_controls(group)
 
         for cor_name, cor_shapes in self.data.correctives.items():
             first, second = [DrivenKeysData.SHAPES[each] for each in cor_shapes]
@@ -695,8 +1123,8 @@ class FaceUI(QtWidgets.QDialog):
         cmds.delete([OpenMaya.MFnDependencyNode(i).name() for i in self._rom_cache])
 
         last_frame = max(self.anim_data.keys())
-        last_shape = self.anim_data[last_frame]
-        lib.set_key(last_shape['node'], last_shape['attribute'], 0, last_frame + 1)
+        for last_shape in self.anim_data[last_frame]:
+            lib.set_key(last_shape['node'], last_shape['attribute'], 0, last_frame + 1)
 
         for frame, data in self.comb_data.items():
             first, second = data['nodes']
@@ -713,63 +1141,100 @@ class FaceUI(QtWidgets.QDialog):
             lib.set_key(self.face_field.text(), data['attribute'], 1, frame)
             lib.set_key(self.face_field.text(), data['attribute'], 0, frame + 1)
 
-        for ctr in self.face_board.controls.keys():
-            [cmds.keyTangent(f'{ctr}.{attr}', edit=True, itt='linear', ott='linear') for attr in ['tx', 'ty']]
+        cmds.keyTangent([f'{ctr}.{attr}' for ctr in self.face_board.controls.keys() for attr in ['tx', 'ty']],
+                        edit=True, itt='linear', ott='linear')
 
-        cmds.bakeResults(self.face_field.text(), hi='below', t=(0, self.current_frame), sm=True, pok=True)
-        for i in cmds.listRelatives(self.face_field.text(), ad=1) + [self.face_field.text()]:
-            cmds.delete(i, sc=True)
+        # Only the channels the ROM drives are baked, the rest of the hierarchy isn't sampled
+        baked, static = lib.bake_channels(self.get_rom_channels(), list(range(0, self.current_frame + 1)))
+        OpenMaya.MGlobal.displayInfo(f'ROM baked: {baked} animated channels, {static} static channels')
         cmds.delete(self.face_board.base_board)
 
-    def create_controls(self, keep_rom=False):
+    def get_rom_channels(self):
+        """Channels of the face joint hierarchy driven through the ROM: the driven keys and the corrective attributes"""
+        face_joint = self.face_field.text()
+        hierarchy = set(cmds.listRelatives(face_joint, ad=True) or list()) | {face_joint}
+
+        channels = {f'{face_joint}.{data["attribute"]}' for data in self.comb_data.values()}
+        for data in [self.face_driven_keys, DrivenKeysData.JOINTS]:
+            for pose_data in data.values():
+                for driven_list in pose_data.values():
+                    channels.update(driven for driven in driven_list if driven.split('.')[0] in hierarchy)
+        return sorted(channels)
+
+    def get_rig_curves(self):
+        """Anim curves the build made: the driven keys of every table and the curves baked by clean_rom"""
+        channels = set(self.get_rom_channels())
+        for data in [DrivenKeysData.POSES, self.face_driven_keys, DrivenKeysData.JOINTS]:
+            for pose_data in data.values():
+                for driven_list in pose_data.values():
+                    channels.update(driven_list)
+
+        curves = list()
+        for channel in cmds.ls(sorted(channels)):
+            node, attr = channel.split('.', 1)
+            for driver in lib.get_driver_nodes(nodes.get_plug(node, attr)):
+                if driver.hasFn(OpenMaya.MFn.kAnimCurve) and driver not in curves:
+                    curves.append(driver)
+        return curves
+
+    def check_controls(self):
         if self.face_board:
-            return
+            return False
 
         if not self.data:
             print('Couldn\'t find blendshapes')
-            return
+            return False
 
         if not self.base_head:
             print('A base blendshape head needs to be generated before applying it')
-            return
-
-        joints_list = OpenMaya.MSelectionList().add(self.jaw_field.text())
-
-        jaw_joint = OpenMaya.MFnTransform(joints_list.getDependNode(0))
-        jaw_joints = [jaw_joint.child(index) for index in range(jaw_joint.childCount())]
-
-        joints_list.add(self.face_field.text())
-        face_joint = OpenMaya.MFnTransform(joints_list.getDependNode(1))
-        facial_joints = [face_joint.child(index) for index in range(face_joint.childCount()) if face_joint.child(index) not in jaw_joints]
-
-        # TODO: Find a way to load facial joints - Mediapipe?
-        # TODO: Make it more obvious face_mesh will be the final output
-
-        face_mesh = 'Face_Base'  # TODO: temporarily hard coded
+            return False
 
         if self.teeth_skin:
             print('loading teeth skin')
+        return True
 
+    def create_face_board(self):
         self.face_board = FaceBoard(self.head_field.text(), self.global_scale.factor)
-
         self.face_board.create_controls()
 
-        load_driven_keys(DrivenKeysData.POSES, self.global_scale.factor)
-
-        # It can happen that rom won't work at all or will give really strange results, delete Maya prefs
-        self.create_rom()
+        yield from iter_driven_keys(DrivenKeysData.POSES, self.global_scale.factor)
 
-        # TODO: Work on editing the drivenkeys manually
-        lib.run_dembones(self.base_head, face_mesh, self.current_frame)
+    def decompose(self, face_mesh):
+        warm_start = self.warm_box.isChecked()
+        if self.regions_box.isChecked():
+            lib.run_dembones_regions(self.base_head, face_mesh, self.current_frame, self.masks,
+                                     self.border_ring.value(), warm_start)
+        else:
+            region = None
+            if self.region_box.isChecked():
+                region = lib.get_mask_coverage(self.masks, OpenMaya.MFnMesh(
+                    nodes.get_dag(self.base_head)).numVertices)
+            lib.run_dembones(self.base_head, face_mesh, self.current_frame, region, self.border_ring.value(), warm_start)
+
+    def create_correctives(self, state):
+        state['curves_anim_data'] = self.create_curve_attributes()
+        self.create_comb_data(self.light_box.isChecked())
+
+    def read_joint_curves(self, face_mesh, state):
+        """Reads the keys of the facial joint curves through the ROM and deletes the curves.
+        The driven keys are derived from the read keys by get_face_driven_keys, outside of the scene."""
+        jaw_joint = OpenMaya.MFnTransform(nodes.get_node(self.jaw_field.text()))
+        jaw_joints = [jaw_joint.child(index) for index in range(jaw_joint.childCount())]
 
-        joints_anim_data = dict()
-        curves_anim_data = self.create_curve_attributes()
+        face_joint = OpenMaya.MFnTransform(nodes.get_node(self.face_field.text()))
+        facial_joints = [face_joint.child(index) for index in range(face_joint.childCount()) if face_joint.child(index) not in jaw_joints]
 
-        self.create_comb_data()
+        state['joint_weights'] = dict()
+        if self.rom_owners:
+            weights, influences = skin.get_weights(face_mesh)
+            state['joint_weights'] = dict(zip(influences, weights.T))
 
-        # Check what joints are being changed when a specific control is changed
+        # Driven channel, its neutral value and its (frame, value) keys
+        state['joint_keys'] = list()
         mod = OpenMaya.MDagModifier()
-        for jnt in facial_joints:
+        for i, jnt in enumerate(facial_joints):
+            yield i / len(facial_joints)
+
             jnt_mfn = OpenMaya.MFnTransform(jnt)
             for attr in ['tx', 'ty', 'tz', 'rx', 'ry', 'rz']:
                 attr_plug = jnt_mfn.findPlug(attr, False)
@@ -783,6 +1248,7 @@ class FaceUI(QtWidgets.QDialog):
                 if attr in ['rx', 'ry', 'rz']:
                     neutral_value = math.degrees(neutral_value)
 
+                keys = list()
                 for frame in range(self.current_frame):
                     m_frame = OpenMaya.MTime(frame, OpenMaya.MTime.uiUnit())
                     index = anim_mfn.find(m_frame)
@@ -791,40 +1257,51 @@ class FaceUI(QtWidgets.QDialog):
                     pose_value = anim_mfn.value(index)
                     if attr in ['rx', 'ry', 'rz']:
                         pose_value = math.degrees(pose_value)
-                    driven = f"{jnt_mfn.partialPathName()}.{attr}"
+                    keys.append((frame, pose_value))
 
-                    difference = round(pose_value - neutral_value, 5)
-                    if -1e-3 <= difference <= 1e-3:
-                        continue
-                    if frame in self.anim_data:
-                        driver_data = self.anim_data[frame]
-                        driver = f"{driver_data['node']}.{driver_data['attribute']}"
-                        value = driver_data['value']
-                    elif frame in self.comb_data:
-                        comb_attr = self.comb_data[frame]['attribute']
-
-                        for i in self.comb_data[frame]['nodes']:
-                            ctr, val = i
-                            if ctr in joints_anim_data and \
-                                    val in joints_anim_data[ctr] and \
-                                    driven in joints_anim_data[ctr][val]:
-                                difference -= joints_anim_data[ctr][val][driven]
-
-                        driver = f"{self.face_field.text()}.{comb_attr}"
-                        value = 1
-                    else:
-                        continue
+                state['joint_keys'].append((f"{jnt_mfn.partialPathName()}.{attr}", neutral_value, keys))
+                mod.deleteNode(attr_plug.source().node())
+        journal.run(mod)
 
-                    if driver not in joints_anim_data:
-                        joints_anim_data[driver] = dict()
-                    if value not in joints_anim_data[driver]:
-                        joints_anim_data[driver][value] = dict()
+    def get_face_driven_keys(self, state, face_joint):
+        """Checks what joints are being changed when a specific control is changed.
+        It only reads the keys of read_joint_curves, so it doesn't touch the scene."""
+        joints_anim_data = dict()
+        for driven, neutral_value, keys in state['joint_keys']:
+            for frame, pose_value in keys:
+                difference = round(pose_value - neutral_value, 5)
+                if -1e-3 <= difference <= 1e-3:
+                    continue
+                if frame in self.anim_data:
+                    driver_data = rom.get_owner(self.anim_data[frame], self.rom_owners,
+                                                state['joint_weights'].get(driven.split('.')[0]))
+                    if not driver_data:
+                        continue
+                    driver = f"{driver_data['node']}.{driver_data['attribute']}"
+                    value = driver_data['value']
+                elif frame in self.comb_data:
+                    comb_attr = self.comb_data[frame]['attribute']
+
+                    for i in self.comb_data[frame]['nodes']:
+                        ctr, val = i
+                        if ctr in joints_anim_data and \
+                                val in joints_anim_data[ctr] and \
+                                driven in joints_anim_data[ctr][val]:
+                            difference -= joints_anim_data[ctr][val][driven]
+
+                    driver = f"{face_joint}.{comb_attr}"
+                    value = 1
+                else:
+                    continue
 
-                    joints_anim_data[driver][value].update({driven: difference})
+                if driver not in joints_anim_data:
+                    joints_anim_data[driver] = dict()
+                if value not in joints_anim_data[driver]:
+                    joints_anim_data[driver][value] = dict()
 
-                mod.deleteNode(attr_plug.source().node())
-        mod.doIt()
+                joints_anim_data[driver][value].update({driven: difference})
 
+        curves_anim_data = state['curves_anim_data']
         for attr_key in set(joints_anim_data.keys()).union(curves_anim_data.keys()):
             self.face_driven_keys[attr_key] = dict()
             for inner_key in set(joints_anim_data.get(attr_key, {}).keys()).union(
@@ -833,22 +1310,152 @@ class FaceUI(QtWidgets.QDialog):
                 curve_data = curves_anim_data.get(attr_key, {}).get(inner_key, {})
                 self.face_driven_keys[attr_key][inner_key] = {**joint_data, **curve_data}
 
-        load_driven_keys(self.face_driven_keys, self.global_scale.factor)
-        load_driven_keys(DrivenKeysData.JOINTS, self.global_scale.factor)
-
-        if keep_rom:
-            self.clean_rom()
-            return
+    def load_face_driven_keys(self):
+        for ratio in iter_driven_keys(self.face_driven_keys, self.global_scale.factor):
+            yield ratio / 2.0
+        for ratio in iter_driven_keys(DrivenKeysData.JOINTS, self.global_scale.factor):
+            yield 0.5 + ratio / 2.0
 
+    def read_skins(self, face_mesh, state):
         for ctr in list(self.face_board.controls.keys()) + [self.face_field.text()]:
             lib.delete_all_keys(ctr)
 
+        state['skins'] = skin.get_weights(self.base_head) + skin.get_weights(face_mesh)
+
+    def write_skin(self, face_mesh, state):
         # Merge the first mesh with the output one onto a copied mesh
-        merged_skin = lib.merge_skin(self.base_head, face_mesh, self.face_field.text())
-        MayaData.skin.load(merged_skin, face_mesh)
+        skin.load_weights(face_mesh, *state['merged'])
+
+        if self.bundle_box.isChecked():
+            self.write_bundle(face_mesh)
 
         cmds.select(cl=True)
 
         for i in range(10):
             OpenMaya.MGlobal.displayInfo('--------------------')
         OpenMaya.MGlobal.displayInfo('--Process finished--')
+
+    def get_build_stages(self, keep_rom=False):
+        """Steps of create_controls. The scene stages yield between their slices
+        and the compute stages only work on NumPy and Python data, so a Build can run them on a worker thread.
+        The options are read when the stages are made, the scene when they run.
+
+        Args:
+            keep_rom (bool, optional): Keeps the ROM animation instead of merging the skin
+
+        Returns:
+            list: build.Stage
+        """
+        # TODO: Find a way to load facial joints - Mediapipe?
+        # TODO: Make it more obvious face_mesh will be the final output
+        face_mesh = 'Face_Base'  # TODO: temporarily hard coded
+        face_joint = self.face_field.text()
+
+        state = dict()
+        timings = dict()
+
+        def timed(label, function):
+            def run():
+                with profiling.timed(label, timings):
+                    return function()
+            return run
+
+        stages = [build.Stage('Checks', self.check_controls),
+                  build.Stage('Face board', self.create_face_board),
+                  # It can happen that rom won't work at all or will give really strange results, delete Maya prefs
+                  build.Stage('ROM', partial(self.iter_rom, self.compact_box.isChecked()))]
+
+        # TODO: Work on editing the drivenkeys manually
+        if self.numpy_box.isChecked() and self.regions_box.isChecked():
+            stages.append(build.Stage('Decomposition', timed('Decomposition', lambda: lib.run_skinning_solver_regions(
+                self.base_head, face_mesh, self.current_frame, self.masks, self.border_ring.value(),
+                warm_start=self.warm_box.isChecked()))))
+        elif self.numpy_box.isChecked():
+            warm_start = self.warm_box.isChecked()
+            stages += [
+                build.Stage('Solver data', timed('Solver data', lambda: state.update(solver=lib.prepare_skinning_solver(
+                    self.base_head, face_mesh, self.current_frame, warm_start=warm_start)))),
+                build.Stage('Decomposition', timed('Decomposition', lambda: lib.solve_skinning(state['solver'])),
+                            compute=True),
+                build.Stage('Solver result', timed('Solver result',
+                                                   lambda: lib.apply_skinning_solver(face_mesh, state['solver'])))]
+        else:
+            stages.append(build.Stage('Decomposition', timed('Decomposition', partial(self.decompose, face_mesh))))
+
+        if self.report_box.isChecked():
+            stages.append(build.Stage('Report', lambda: report.evaluate(
+                self.base_head, face_mesh, self.current_frame, self.masks, sum(timings.values()))))
+
+        stages += [build.Stage('Correctives', partial(self.create_correctives, state)),
+                   build.Stage('Joint curves', partial(self.read_joint_curves, face_mesh, state)),
+                   build.Stage('Driven key data', partial(self.get_face_driven_keys, state, face_joint), compute=True),
+                   build.Stage('Driven keys', self.load_face_driven_keys)]
+
+        if keep_rom:
+            stages.append(build.Stage('Clean ROM', self.clean_rom))
+        else:
+            stages += [build.Stage('Read skins', partial(self.read_skins, face_mesh, state)),
+                       build.Stage('Merge skin', lambda: state.update(merged=lib.merge_weights(*state['skins'], face_joint)),
+                                   compute=True),
+                       build.Stage('Write skin', partial(self.write_skin, face_mesh, state))]
+
+        if self.reduce_box.isChecked():
+            stages.append(build.Stage('Key reduction', lambda: keys.reduce_curves(self.get_rig_curves())))
+        return stages
+
+    def create_controls(self, keep_rom=False):
+        return build.run_blocking(self.get_build_stages(keep_rom))
+
+    def start_build(self, stages):
+        """Runs the stages from the event loop, Maya keeps redrawing but a modal progress dialog blocks the user input,
+        so cancelling the build never undoes anything the user did meanwhile"""
+        if self.current_build:
+            return
+
+        self.current_build = build.Build(stages, self)
+        self.current_build.progress.connect(self.update_progress)
+        self.current_build.finished.connect(self.finish_build)
+
+        self.progress_dialog = QtWidgets.QProgressDialog('Building the rig', 'CANCEL', 0, 100, self)
+        self.progress_dialog.setWindowModality(QtCore.Qt.ApplicationModal)
+        self.progress_dialog.setAutoClose(False)
+        self.progress_dialog.setAutoReset(False)
+        self.progress_dialog.setMinimumDuration(0)
+        self.progress_dialog.canceled.connect(self.cancel_build)
+        self.progress_dialog.show()
+
+        self.build_state = {attr: copy.copy(getattr(self, attr)) for attr in self.BUILD_STATE}
+        self.rig_button.setEnabled(False)
+        self.rom_button.setEnabled(False)
+        self.current_build.start()
+
+    def cancel_build(self):
+        if self.current_build:
+            self.current_build.cancel()
+
+    def update_progress(self, value, text):
+        self.progress_bar.setValue(value)
+        self.progress_label.setText(text)
+        if self.progress_dialog:
+            self.progress_dialog.setValue(value)
+            self.progress_dialog.setLabelText(text)
+
+    def finish_build(self, completed):
+        rolled_back = self.current_build.rolled_back
+        self.current_build = None
+        self.rig_button.setEnabled(True)
+        self.rom_button.setEnabled(True)
+
+        # Closing the dialog emits canceled, it's disconnected first
+        self.progress_dialog.canceled.disconnect(self.cancel_build)
+        self.progress_dialog.close()
+        self.progress_dialog.deleteLater()
+        self.progress_dialog = None
+
+        if completed or not rolled_back:
+            return
+
+        # The scene is back to its state before the build, so is the build data,
+        # whatever was built before, like a rig a stopped build found, is kept
+        for attr, value in self.build_state.items():
+            setattr(self, attr, value)
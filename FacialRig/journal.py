@@ -0,0 +1,59 @@
+from maya.api import OpenMayaAnim
+
+
+# Undo functions of the API edits made since start, None while nothing is recorded.
+# The API edits aren't in Maya's undo queue, a cancelled build reverts them from here.
+_steps = None
+
+
+def start():
+    global _steps
+    _steps = list()
+
+
+def stop():
+    """Stops recording
+
+    Returns:
+        list: Undo functions of the edits recorded since start, in the order they were made
+    """
+    global _steps
+    steps, _steps = _steps or list(), None
+    return steps
+
+
+def is_recording():
+    return _steps is not None
+
+
+def record(undo):
+    """Keeps the function reverting an edit, only while recording"""
+    if _steps is not None:
+        _steps.append(undo)
+
+
+def run(modifier):
+    """Applies a modifier and records its undoIt
+
+    Args:
+        modifier (OpenMaya.MDGModifier): Modifier holding the edits
+
+    Returns:
+        OpenMaya.MDGModifier: The given modifier
+    """
+    modifier.doIt()
+    record(modifier.undoIt)
+    return modifier
+
+
+def anim_change():
+    """MAnimCurveChange to pass to the MFnAnimCurve edits, reverted with the other recorded edits"""
+    change = OpenMayaAnim.MAnimCurveChange()
+    record(change.undoIt)
+    return change
+
+
+def revert(steps):
+    """Reverts the edits returned by stop, the last one first"""
+    for undo in reversed(steps):
+        undo()
@@ -0,0 +1,179 @@
+from maya.api import OpenMaya, OpenMayaAnim
+
+import math
+import numpy
+
+from . import journal
+
+
+# Largest error allowed by default, in internal units
+TOLERANCES = {'linear': 1e-3,
+              'angular': math.radians(1e-2),
+              'unitless': 1e-3}
+
+CURVE_KINDS = {OpenMayaAnim.MFnAnimCurve.kAnimCurveTL: 'linear',
+               OpenMayaAnim.MFnAnimCurve.kAnimCurveUL: 'linear',
+               OpenMayaAnim.MFnAnimCurve.kAnimCurveTA: 'angular',
+               OpenMayaAnim.MFnAnimCurve.kAnimCurveUA: 'angular'}
+
+
+def interpolate(times, values, keep, samples, spline=False):
+    """Evaluates the curve going through the kept keys
+
+    Args:
+        times (numpy.ndarray): (keys,) increasing key inputs
+        values (numpy.ndarray): (keys,) key values
+        keep (numpy.ndarray): (keys,) boolean array of the kept keys, the first and last ones included
+        samples (numpy.ndarray): Inputs to evaluate
+        spline (bool, optional): Cubic Hermite with the spline tangents, the slope between the neighbour keys,
+            instead of straight lines
+
+    Returns:
+        numpy.ndarray: Values at the samples
+    """
+    key_times, key_values = times[keep], values[keep]
+    if not spline or len(key_times) < 3:
+        return numpy.interp(samples, key_times, key_values)
+
+    slopes = numpy.empty(len(key_times))
+    slopes[1:-1] = (key_values[2:] - key_values[:-2]) / (key_times[2:] - key_times[:-2])
+    slopes[0] = (key_values[1] - key_values[0]) / (key_times[1] - key_times[0])
+    slopes[-1] = (key_values[-1] - key_values[-2]) / (key_times[-1] - key_times[-2])
+
+    segment = numpy.clip(numpy.searchsorted(key_times, samples, side='right') - 1, 0, len(key_times) - 2)
+    start, end = key_times[segment], key_times[segment + 1]
+    width = end - start
+    s = (samples - start) / width
+
+    return ((2 * s ** 3 - 3 * s ** 2 + 1) * key_values[segment] + (s ** 3 - 2 * s ** 2 + s) * width * slopes[segment] +
+            (-2 * s ** 3 + 3 * s ** 2) * key_values[segment + 1] + (s ** 3 - s ** 2) * width * slopes[segment + 1])
+
+
+def simplify(times, values, tolerance, spline=False):
+    """Picks the fewest keys keeping the curve within the tolerance of every original key.
+    It starts from the first and last keys, every pass adds the worst key of each segment still over the tolerance.
+    A spline key changes the tangents of its neighbours, the keys the refinement didn't need in the end are dropped.
+
+    Args:
+        times (numpy.ndarray): (keys,) increasing key inputs
+        values (numpy.ndarray): (keys,) key values
+        tolerance (float): Largest error allowed
+        spline (bool, optional): Fits spline keys instead of linear ones, see interpolate
+
+    Returns:
+        numpy.ndarray: (keys,) boolean array of the kept keys
+    """
+    keep = numpy.zeros(len(times), dtype=bool)
+    keep[[0, -1]] = True
+    if len(times) <= 2:
+        keep[:] = True
+        return keep
+
+    while True:
+        error = numpy.abs(interpolate(times, values, keep, times, spline) - values)
+        over = numpy.flatnonzero(error > tolerance)
+        if not len(over):
+            break
+
+        segment = (numpy.cumsum(keep) - 1)[over]
+        order = numpy.lexsort((-error[over], segment))
+        over, segment = over[order], segment[order]
+        keep[over[numpy.concatenate([[True], segment[1:] != segment[:-1]])]] = True
+
+    if spline:
+        for i in numpy.flatnonzero(keep)[1:-1]:
+            keep[i] = False
+            if numpy.abs(interpolate(times, values, keep, times, True) - values).max() > tolerance:
+                keep[i] = True
+    return keep
+
+
+def get_keys(anim_mfn):
+    """Key inputs, frames or driver values, and key values of a curve"""
+    count = anim_mfn.numKeys
+    if anim_mfn.isUnitlessInput:
+        times = [anim_mfn.unitlessInput(i) for i in range(count)]
+    else:
+        times = [anim_mfn.input(i).asUnits(OpenMaya.MTime.uiUnit()) for i in range(count)]
+    return numpy.array(times), numpy.array([anim_mfn.value(i) for i in range(count)])
+
+
+def get_input(anim_mfn, time):
+    return float(time) if anim_mfn.isUnitlessInput else OpenMaya.MTime(float(time), OpenMaya.MTime.uiUnit())
+
+
+def get_error(anim_mfn, times, values):
+    """Largest difference between the curve and the given keys, evaluated by Maya"""
+    if not len(times):
+        return 0.0
+    evaluated = numpy.array([anim_mfn.evaluate(get_input(anim_mfn, time)) for time in times])
+    return float(numpy.abs(evaluated - values).max())
+
+
+def reduce_curve(anim_mfn, tolerance=None, spline=False):
+    """Removes the keys of a curve that aren't needed to stay within the tolerance.
+    Maya's spline tangents can differ from the fitted ones, a spline fit over the tolerance is redone with linear keys,
+    which Maya interpolates exactly like the fit.
+
+    Args:
+        anim_mfn (OpenMayaAnim.MFnAnimCurve): Time or driven key curve
+        tolerance (float, optional): Largest error, from TOLERANCES by the curve output type if None
+        spline (bool, optional): Fits spline keys instead of linear ones
+
+    Returns:
+        tuple: keys before, keys after and the largest error evaluated on the original keys
+    """
+    if tolerance is None:
+        tolerance = TOLERANCES[CURVE_KINDS.get(anim_mfn.animCurveType, 'unitless')]
+
+    times, values = get_keys(anim_mfn)
+    keep = simplify(times, values, tolerance, spline)
+    removed = numpy.flatnonzero(~keep)
+    change = journal.anim_change()
+    for i in removed[::-1]:
+        anim_mfn.remove(int(i), change)
+
+    tangent = OpenMayaAnim.MFnAnimCurve.kTangentSmooth if spline else OpenMayaAnim.MFnAnimCurve.kTangentLinear
+    for i in range(anim_mfn.numKeys):
+        anim_mfn.setInTangentType(i, tangent, change)
+        anim_mfn.setOutTangentType(i, tangent, change)
+
+    error = get_error(anim_mfn, times, values)
+    if spline and error > tolerance:
+        for i in removed:
+            anim_mfn.addKey(get_input(anim_mfn, times[i]), values[i], change=change)
+        return reduce_curve(anim_mfn, tolerance, False)
+    return len(times), anim_mfn.numKeys, error
+
+
+def reduce_curves(curves, tolerances=None, spline=None):
+    """Key reduction of every given curve in one batch, the key counts and largest errors are displayed
+
+    Args:
+        curves (list): OpenMaya.MObject anim curves
+        tolerances (dict, optional): Largest error by curve kind, 'linear', 'angular' and 'unitless',
+            TOLERANCES is used for the missing ones
+        spline (bool, optional): Fits spline keys instead of linear ones. If None, driven key curves get spline keys
+            like setDrivenKeyframe makes them and time curves linear keys like the baked ROM
+
+    Returns:
+        dict: keys before, keys after and the largest error by curve kind
+    """
+    tolerances = {**TOLERANCES, **(tolerances or dict())}
+    result = {'before': 0, 'after': 0, 'error': dict()}
+
+    anim_mfn = OpenMayaAnim.MFnAnimCurve()
+    for curve in curves:
+        anim_mfn.setObject(curve)
+        kind = CURVE_KINDS.get(anim_mfn.animCurveType, 'unitless')
+        curve_spline = anim_mfn.isUnitlessInput if spline is None else spline
+        before, after, error = reduce_curve(anim_mfn, tolerances[kind], curve_spline)
+
+        result['before'] += before
+        result['after'] += after
+        result['error'][kind] = max(result['error'].get(kind, 0.0), error)
+
+    OpenMaya.MGlobal.displayInfo(f'Key reduction: {result["before"]} -> {result["after"]} keys on {len(curves)} curves')
+    for kind, error in result['error'].items():
+        OpenMaya.MGlobal.displayInfo(f'    {kind} curves: max error 0 -> {error:.6f} (tolerance {tolerances[kind]:.6f})')
+    return result
@@ -2,10 +2,9 @@ from maya.api import OpenMaya, OpenMayaAnim
 from maya import cmds
 
 import math
-import pandas as pd
+import numpy
 
-import MayaData
-import dem_bones
+from . import cache, journal, mesh, nodes, regions, skin, solver
 
 
 def create_facial_joints():
@@ -33,15 +32,14 @@ def delete_all_keys(node):
     Args:
         node (str, OpenMaya.MObject): Desired node to delete animations
     """
-    obj = OpenMaya.MSelectionList().add(node).getDependNode(0)
     mod = OpenMaya.MDagModifier()
     for attr in ['tx', 'ty', 'tz', 'rx', 'ry', 'rz', 'sx', 'sy', 'sz', 'visibility']:
-        attr_plug = OpenMaya.MFnTransform(obj).findPlug(attr, False)
+        attr_plug = nodes.get_plug(node, attr)
         anim_mfn = OpenMayaAnim.MFnAnimCurve()
         if not anim_mfn.hasObj(attr_plug.source().node()):
             continue
         mod.deleteNode(attr_plug.source().node())
-    mod.doIt()
+    journal.run(mod)
 
 
 def set_key(node, attribute, value=None, frame=None):
@@ -66,15 +64,14 @@ def set_key(node, attribute, value=None, frame=None):
     if isinstance(node, OpenMaya.MPlug):
         plug = node.elementByPhysicalIndex(attribute)
     else:
-        obj = OpenMaya.MSelectionList().add(node).getDependNode(0)
-        plug = OpenMaya.MFnTransform(obj).findPlug(attribute, False)
+        plug = nodes.get_plug(node, attribute)
 
     if value:
         if plug.partialName() in ['tx', 'ty', 'tz']:
             value *= unit_scale
         if plug.partialName() in ['rx', 'ry', 'rz']:
             value = math.radians(value)
-        plug.setDouble(value)
+        journal.run(OpenMaya.MDGModifier().newPlugValueDouble(plug, value))
     value = plug.asDouble()
     anim_obj = plug.source().node()
     anim_mfn = OpenMayaAnim.MFnAnimCurve()
@@ -84,92 +81,705 @@ def set_key(node, attribute, value=None, frame=None):
     else:
         anim_mfn.create(plug, OpenMayaAnim.MFnAnimCurve.kAnimCurveUnknown)
 
+    change = journal.anim_change()
     index = anim_mfn.find(current_time)
     if index is None:
-        index = anim_mfn.insertKey(current_time)
-        anim_mfn.setValue(index, value)
+        index = anim_mfn.insertKey(current_time, change)
+        anim_mfn.setValue(index, value, change)
         return anim_mfn
 
-    anim_mfn.remove(index)
+    anim_mfn.remove(index, change)
     if anim_mfn.numKeys:
         return anim_mfn
 
-    OpenMaya.MDagModifier().deleteNode(anim_obj).doIt()
-    plug.setDouble(value)
+    journal.run(OpenMaya.MDagModifier().deleteNode(anim_obj))
+    journal.run(OpenMaya.MDGModifier().newPlugValueDouble(plug, value))
 
 
-def merge_skin(base_mesh, result_mesh, mask_jnt):
-    """ This function gets the influences of a joint in the result mesh as a mask to subtract
-        from every joints influence in the base mesh, where:
+def set_keys(node, attribute, frames, values, tangent=OpenMayaAnim.MFnAnimCurve.kTangentGlobal):
+    """Replaces the animation of an attribute with one key per frame, added in a single call
+
+    Args:
+        node (str): Node name
+        attribute (str): Name of the attribute
+        frames (list): Frames in the current UI time unit
+        values (list): Values in internal units (centimeters, radians)
+        tangent (int, optional): OpenMayaAnim.MFnAnimCurve tangent type of the keys
+
+    Returns:
+        OpenMayaAnim.MFnAnimCurve: The new animation curve
+    """
+    plug = nodes.get_plug(node, attribute)
+
+    anim_mfn = OpenMayaAnim.MFnAnimCurve()
+    source = plug.source()
+    if not source.isNull and anim_mfn.hasObj(source.node()):
+        journal.run(OpenMaya.MDGModifier().deleteNode(source.node()))
+
+    anim_mfn.create(plug, OpenMayaAnim.MFnAnimCurve.kAnimCurveUnknown)
+    times = OpenMaya.MTimeArray([OpenMaya.MTime(frame, OpenMaya.MTime.uiUnit()) for frame in frames])
+    anim_mfn.addKeys(times, OpenMaya.MDoubleArray([float(value) for value in values]), tangent, tangent)
+    return anim_mfn
+
+
+def get_driver_nodes(plug):
+    """Anim curves, blendWeighted and unitConversion nodes feeding a plug, up to the first node of another type,
+    eg. the driven keys of a channel without their driver control
+
+    Returns:
+        list: OpenMaya.MObject nodes
+    """
+    result = list()
+    queue = [plug.source()]
+    while queue:
+        source = queue.pop()
+        if source.isNull:
+            continue
+        node = source.node()
+        if not any(node.hasFn(kind) for kind in [OpenMaya.MFn.kAnimCurve, OpenMaya.MFn.kBlendWeighted,
+                                                  OpenMaya.MFn.kUnitConversion]):
+            continue
+        if node in result:
+            continue
+        result.append(node)
+        queue.extend(connection.source() for connection in OpenMaya.MFnDependencyNode(node).getConnections()
+                     if connection.isDestination)
+    return result
+
+
+def bake_channels(channels, frames, tolerance=1e-6):
+    """Replaces what drives the given channels with one key per frame, like bakeResults,
+    sampling every channel in the same frame loop. Channels that don't change are left as a static value.
+
+    Args:
+        channels (list): 'node.attribute' names
+        frames (list): Frames in the current UI time unit
+        tolerance (float, optional): Channels changing less than this through the frames are static
+
+    Returns:
+        tuple: number of baked and static channels
+    """
+    plugs = [nodes.get_plug(*channel.split('.')) for channel in channels]
+
+    current_time = OpenMayaAnim.MAnimControl.currentTime()
+    values = numpy.zeros((len(frames), len(plugs)))
+    for i, frame in enumerate(frames):
+        OpenMayaAnim.MAnimControl.setCurrentTime(OpenMaya.MTime(frame, OpenMaya.MTime.uiUnit()))
+        values[i] = [plug.asDouble() for plug in plugs]
+    OpenMayaAnim.MAnimControl.setCurrentTime(current_time)
+
+    static = numpy.ptp(values, axis=0) <= tolerance
+
+    # The driving networks go in a single modifier, shared nodes are only deleted once
+    modifier = OpenMaya.MDGModifier()
+    deleted = set()
+    for plug in plugs:
+        for node in get_driver_nodes(plug):
+            handle = OpenMaya.MObjectHandle(node)
+            if handle.hashCode() not in deleted:
+                deleted.add(handle.hashCode())
+                modifier.deleteNode(node)
+    journal.run(modifier)
+
+    static_modifier = OpenMaya.MDGModifier()
+    for channel, plug, channel_values, is_static in zip(channels, plugs, values.T, static):
+        if is_static:
+            static_modifier.newPlugValueDouble(plug, float(channel_values[0]))
+            continue
+        set_keys(*channel.split('.'), frames, channel_values)
+    journal.run(static_modifier)
+
+    return int((~static).sum()), int(static.sum())
+
+
+def sample_points(mesh_name, frames):
+    """World positions of a mesh at every given frame
+
+    Returns:
+        numpy.ndarray: (frames, vertices, 3) float array
+    """
+    current_time = OpenMayaAnim.MAnimControl.currentTime()
+
+    samples = list()
+    for frame in frames:
+        OpenMayaAnim.MAnimControl.setCurrentTime(OpenMaya.MTime(frame, OpenMaya.MTime.uiUnit()))
+        samples.append(mesh.get_points(mesh_name, OpenMaya.MSpace.kWorld))
+
+    OpenMayaAnim.MAnimControl.setCurrentTime(current_time)
+    return numpy.stack(samples)
+
+
+# Channels of a joint in iter_samples: local translation, rotation quaternion and scale
+TRANSFORM_CHANNELS = ['tx', 'ty', 'tz', 'qx', 'qy', 'qz', 'qw', 'sx', 'sy', 'sz']
+
+
+def iter_samples(plugs, joints, frames, chunk_size=256):
+    """Values of plugs and local transforms of joints, sampled a chunk of frames at a time
+    so a long take is never held in memory. The current time is restored once the generator ends.
+
+    Args:
+        plugs (list): 'node.attribute' names, one channel each
+        joints (list): Joint names, one channel per TRANSFORM_CHANNELS each: translation, quaternion and scale
+        frames (list): Frames to sample
+        chunk_size (int, optional): Frames per chunk
+
+    Yields:
+        numpy.ndarray: (chunk frames, channels) float array, the plugs then the joints
+    """
+    plugs = [nodes.get_plug(*plug.split('.', 1)) for plug in plugs]
+    dags = [nodes.get_dag(joint) for joint in joints]
+
+    current_time = OpenMayaAnim.MAnimControl.currentTime()
+    try:
+        for start in range(0, len(frames), chunk_size):
+            chunk_frames = frames[start:start + chunk_size]
+            chunk = numpy.empty((len(chunk_frames), len(plugs) + len(dags) * len(TRANSFORM_CHANNELS)))
+            for i, frame in enumerate(chunk_frames):
+                OpenMayaAnim.MAnimControl.setCurrentTime(OpenMaya.MTime(frame, OpenMaya.MTime.uiUnit()))
+                row = [plug.asDouble() for plug in plugs]
+                for dag in dags:
+                    matrix = OpenMaya.MTransformationMatrix(dag.inclusiveMatrix() * dag.exclusiveMatrixInverse())
+                    rotation = matrix.rotation(asQuaternion=True)
+                    row += list(matrix.translation(OpenMaya.MSpace.kTransform))
+                    row += [rotation.x, rotation.y, rotation.z, rotation.w]
+                    row += matrix.scale(OpenMaya.MSpace.kTransform)
+                chunk[i] = row
+            yield chunk
+    finally:
+        OpenMayaAnim.MAnimControl.setCurrentTime(current_time)
+
+
+def get_joint_positions(joints):
+    """World positions of the given joints, in internal units"""
+    positions = list()
+    for joint in joints:
+        matrix = nodes.get_dag(joint).inclusiveMatrix()
+        positions.append(list(OpenMaya.MTransformationMatrix(matrix).translation(OpenMaya.MSpace.kWorld)))
+    return numpy.array(positions)
+
+
+def key_solver_transforms(joints, transforms, frames):
+    """Keys the joints with transforms from the solver module
+
+    Args:
+        joints (list): Joint names, in the order of the transforms
+        transforms (numpy.ndarray): (frames, joints, 3, 4) world transforms relative to the current pose
+        frames (list): Frame of each transform
+    """
+    for index, joint in enumerate(joints):
+        dag = nodes.get_dag(joint)
+        bind_matrix = dag.inclusiveMatrix()
+        parent_inverse = dag.exclusiveMatrixInverse()
+
+        orient = OpenMaya.MQuaternion()
+        if dag.hasFn(OpenMaya.MFn.kJoint):
+            orient = OpenMayaAnim.MFnIkJoint(dag).orientation()
+
+        channels = {attr: list() for attr in ['tx', 'ty', 'tz', 'rx', 'ry', 'rz']}
+        for transform in transforms[:, index]:
+            # Maya matrices use row vectors, the solver column vectors
+            offset = numpy.eye(4)
+            offset[:3, :3] = transform[:, :3].T
+            offset[3, :3] = transform[:, 3]
+
+            local = bind_matrix * OpenMaya.MMatrix(offset.ravel().tolist()) * parent_inverse
+            local = OpenMaya.MTransformationMatrix(local)
+
+            translate = local.translation(OpenMaya.MSpace.kTransform)
+            rotate = (local.rotation(asQuaternion=True) * orient.inverse()).asEulerRotation()
+
+            for attr, value in zip(channels.keys(), list(translate) + [rotate.x, rotate.y, rotate.z]):
+                channels[attr].append(value)
+
+        for attr, values in channels.items():
+            set_keys(joint, attr, frames, values)
+
+
+def merge_weights(base_weights, base_influences, result_weights, result_influences, mask_jnt):
+    """Uses the weights of a joint in the result skin as a mask to scale every influence of the base skin, where:
             - 0.0 removes the joint influence from the base mesh entirely.
             - 1.0 keeps the full joint influence from the base mesh.
-        After applying the mask, the function removes the mask joint from the result mesh, combines
-        the adjusted base mesh with the result mesh, and normalizes the combined weights so that
-        the total influence for each vertex sums to 1.0.
+        After applying the mask, the mask joint is removed from the result weights, both skins are combined
+        and the combined weights are normalized so that the total influence for each vertex sums to 1.0.
+        It only works on arrays, doesn't touch the scene.
 
     Args:
-        base_mesh (str, OpenMaya.MObject): First Mesh
-        result_mesh (str, OpenMaya.MObject): Second Mesh
-        mask_jnt (str, OpenMaya.MObject): A joint part of First Mesh influences
+        base_weights (numpy.ndarray): (vertices, influences) weights of the first mesh
+        base_influences (list): Influence names of the base weight columns
+        result_weights (numpy.ndarray): (vertices, influences) weights of the second mesh
+        result_influences (list): Influence names of the result weight columns
+        mask_jnt (str): A joint of the result influences
 
     Returns:
-        MayaData.skin.SkinData: mesh weights of mesh A (minus its given mask joint)
-        and mesh B merged together
+        tuple: merged (vertices, influences) weights and the influence names of the columns
     """
-    base_skin = pd.DataFrame(MayaData.skin.get(base_mesh))
-    result_skin = pd.DataFrame(MayaData.skin.get(result_mesh))
+    # The mask joint weights scale every base mesh weight
+    mask_column = result_influences.index(mask_jnt)
+    base_weights = base_weights * numpy.clip(result_weights[:, mask_column], 0.0, 1.0)[:, None]
 
-    # Apply the mask to result_skin in a vectorized way
-    mask = result_skin[mask_jnt].clip(0.0, 1.0)  # Get mask and clip values between 0.0 and 1.0
-    base_skin = base_skin.multiply(mask, axis=0)  # Apply mask to all rows in result_skin
+    result_weights = numpy.delete(result_weights, mask_column, axis=1)
+    result_influences = result_influences[:mask_column] + result_influences[mask_column + 1:]
 
-    result_skin.drop(columns=[mask_jnt], inplace=True)
-
-    # Merge the DataFrames horizontally
-    merged_skin = pd.concat([base_skin, result_skin], axis=1)
+    # Influences of both meshes are merged side by side, a joint in both adds its weights
+    influences = list(dict.fromkeys(base_influences + result_influences))
+    merged = numpy.zeros((len(base_weights), len(influences)))
+    merged[:, [influences.index(influence) for influence in base_influences]] += base_weights
+    merged[:, [influences.index(influence) for influence in result_influences]] += result_weights
 
     # Normalize each row, so it sums to 1.0, adjusting the last element if necessary
-    def normalize_row(row):
-        total_sum = row.sum()
-        if total_sum == 0:
-            return row  # Skip rows that sum to 0
-        normalized_row = row / total_sum  # Normalize the row
-        normalized_row.iloc[-1] += 1.0 - normalized_row.sum()  # Adjust last element to sum exactly to 1.0
-        return normalized_row.round(4)  # Round to 4 decimal places
+    total = merged.sum(axis=1)
+    valid = total != 0.0
+    merged[valid] /= total[valid, None]
+    merged[valid, -1] += 1.0 - merged[valid].sum(axis=1)
+    return merged.round(4), influences
 
-    merged_skin = merged_skin.apply(normalize_row, axis=1)
 
-    return merged_skin.to_dict(orient='list')
+def get_mask_coverage(masks, count):
+    """Vertices that any mask lets move
 
+    Args:
+        masks (dict): mask name as key and {vertex id: value} as value
+        count (int): Vertex count of the masked mesh
 
-def run_dembones(blendshape_mesh, skinned_mesh, total_frame):
-    OpenMaya.MGlobal.displayInfo('Starting Dembones')
-    dembones = dem_bones.DemBones()
-    dembones.compute(skinned_mesh, blendshape_mesh, start_frame=1, end_frame=total_frame)
+    Returns:
+        numpy.ndarray: Boolean array, True where at least one mask isn't zero
+    """
+    coverage = numpy.zeros(count, dtype=bool)
+    for values in masks.values():
+        vertices = [int(vtx) for vtx, value in values.items() if float(value)]
+        coverage[vertices] = True
+    return coverage
+
+
+def get_mask_arrays(masks, count):
+    """Converts the masks into dense arrays
+
+    Args:
+        masks (dict): mask name as key and {vertex id: value} as value
+        count (int): Vertex count of the masked mesh
+
+    Returns:
+        dict: mask name as key and (vertices,) numpy.ndarray as value
+    """
+    arrays = dict()
+    for name, values in masks.items():
+        arrays[name] = numpy.zeros(count)
+        arrays[name][[int(vtx) for vtx in values.keys()]] = [float(value) for value in values.values()]
+    return arrays
+
+
+def get_face_ranges(faces):
+    """Compacts face ids into Maya component ranges, eg. [0, 1, 2, 5] -> ['f[0:2]', 'f[5]']"""
+    faces = numpy.asarray(faces)
+    if not len(faces):
+        return list()
+    breaks = numpy.flatnonzero(numpy.diff(faces) != 1)
+    starts = numpy.concatenate([[faces[0]], faces[breaks + 1]])
+    ends = numpy.concatenate([faces[breaks], [faces[-1]]])
+    return [f'f[{a}]' if a == b else f'f[{a}:{b}]' for a, b in zip(starts, ends)]
 
-    for frame in range(dembones.start_frame, dembones.end_frame + 1):
-        for influence in dembones.influences:
-            matrix = OpenMaya.MMatrix(dembones.anim_matrix(influence, frame))
-            matrix = OpenMaya.MTransformationMatrix(matrix)
+
+def extract_submesh(mesh_name, selection, name, live=False):
+    """Duplicates a mesh keeping only the faces touching the selected vertices.
+    Maya keeps the relative order of the remaining vertices, so the sub mesh vertex i
+    is the i-th vertex of the returned ids.
+
+    Args:
+        mesh_name (str): Mesh to extract from
+        selection (numpy.ndarray): Boolean array of the vertices to keep
+        name (str): Name of the sub mesh
+        live (bool, optional): Keeps the sub mesh connected to the deformed output of the original mesh
+
+    Returns:
+        tuple: sub mesh name and numpy.ndarray of the original vertex ids it contains
+    """
+    counts, connects = mesh.get_mesh_fn(mesh_name).getVertices()
+    counts = numpy.array(counts)
+    face_ids = numpy.repeat(numpy.arange(len(counts)), counts)
+
+    keep_faces = numpy.zeros(len(counts), dtype=bool)
+    keep_faces[face_ids[selection[numpy.array(connects)]]] = True
+    vertices = numpy.unique(numpy.array(connects)[keep_faces[face_ids]])
+
+    submesh = cmds.duplicate(mesh_name, n=name, rr=True)[0]
+    for shape in cmds.listRelatives(submesh, s=True, f=True) or list():
+        if cmds.getAttr(f'{shape}.intermediateObject'):
+            cmds.delete(shape)
+
+    if live:
+        source = OpenMaya.MSelectionList().add(mesh_name).getDagPath(0).extendToShape().fullPathName()
+        shape = cmds.listRelatives(submesh, s=True, f=True)[0]
+        cmds.connectAttr(f'{source}.outMesh', f'{shape}.inMesh', f=True)
+
+    removed = get_face_ranges(numpy.flatnonzero(~keep_faces))
+    if removed:
+        cmds.delete([f'{submesh}.{faces}' for faces in removed])
+    if not live:
+        cmds.delete(submesh, ch=True)
+
+    return submesh, vertices
+
+
+def get_dembones_matrices(dembones):
+    """World matrices DemBones solved for its influences
+
+    Returns:
+        dict: influence name as key and (frames, 4, 4) numpy.ndarray as value
+    """
+    frames = range(dembones.start_frame, dembones.end_frame + 1)
+    return {influence: numpy.array([list(OpenMaya.MMatrix(dembones.anim_matrix(influence, frame))) for frame in frames]
+                                   ).reshape(-1, 4, 4)
+            for influence in dembones.influences}
+
+
+def key_matrices(matrices, frames):
+    """Replaces the animation of influences with keys of world matrices, one curve per channel
+
+    Args:
+        matrices (dict): influence name as key and (frames, 4, 4) numpy.ndarray as value
+        frames (list): Frame of each matrix
+    """
+    for influence, influence_matrices in matrices.items():
+        channels = {attr: list() for attr in ['tx', 'ty', 'tz', 'rx', 'ry', 'rz']}
+        for matrix in influence_matrices:
+            matrix = OpenMaya.MTransformationMatrix(OpenMaya.MMatrix(matrix.ravel().tolist()))
             translate = matrix.translation(OpenMaya.MSpace.kWorld)
             rotate = matrix.rotation().asVector()
 
-            set_key(influence, 'tx', translate.x, frame)
-            set_key(influence, 'ty', translate.y, frame)
-            set_key(influence, 'tz', translate.z, frame)
-            set_key(influence, 'rx', math.degrees(rotate.x), frame)
-            set_key(influence, 'ry', math.degrees(rotate.y), frame)
-            set_key(influence, 'rz', math.degrees(rotate.z), frame)
+            for attr, value in zip(channels.keys(), list(translate) + list(rotate)):
+                channels[attr].append(value)
 
-    skin_cluster_fn = OpenMayaAnim.MFnSkinCluster(MayaData.skin.get_skin_cluster(skinned_mesh))
+        # set_keys replaces the curves, keying the result over the warm start keys doesn't toggle them off
+        for attr, values in channels.items():
+            set_keys(influence, attr, frames, values)
 
-    mesh_dag = OpenMaya.MSelectionList().add(skinned_mesh).getDagPath(0)
-    mesh_dag.extendToShape()
 
-    skin_cluster_fn.setWeights(
-        mesh_dag,
-        OpenMaya.MObject(),
-        OpenMaya.MIntArray(range(len(dembones.influences))),
-        OpenMaya.MDoubleArray(dembones.weights)
-    )
+def key_dembones_transforms(dembones):
+    """Keys the influences with the DemBones result
+
+    Returns:
+        dict: get_dembones_matrices
+    """
+    matrices = get_dembones_matrices(dembones)
+    key_matrices(matrices, list(range(dembones.start_frame, dembones.end_frame + 1)))
+    return matrices
+
+
+WARM_START_SETTINGS = {'num_iterations': 10, 'tolerance': 1e-3, 'patience': 2}
+
+
+def load_warm_start(skinned_mesh, frame_count):
+    """Writes the weights of the previous solve into the skin cluster, so the next solve starts from them
+
+    Args:
+        skinned_mesh (str): Mesh skinned to the facial joints
+        frame_count (int): Number of ROM frames of the next solve
+
+    Returns:
+        tuple: True if the cache matched the mesh and its influences,
+        and the cached solver transforms if they match the number of frames, otherwise None
+    """
+    data = cache.load('dembones')
+    if not data:
+        return False, None
+
+    weights, influences = skin.get_weights(skinned_mesh)
+    if data['weights'].shape != weights.shape or data['influences'].tolist() != influences:
+        OpenMaya.MGlobal.displayInfo('Cached solve doesn\'t match the mesh, starting from scratch')
+        return False, None
+
+    skin.set_weights(skinned_mesh, data['weights'])
+    OpenMaya.MGlobal.displayInfo('Starting from the cached solve')
+
+    transforms = data['transforms']
+    if transforms.ndim != 4 or len(transforms) != frame_count:
+        return True, None
+    return True, transforms
+
+
+def save_warm_start(weights, influences, transforms=None, matrices=None):
+    """Stores the result of a solve next to the scene for the next build
+
+    Args:
+        weights (numpy.ndarray): (vertices, joints) solved weights
+        influences (list): Joint names of the weight columns
+        transforms (numpy.ndarray, optional): (frames, joints, 3, 4) transforms of the solver module
+        matrices (dict, optional): get_dembones_matrices of the DemBones solves, stored as
+            (frames, joints, 4, 4) world matrices, NaN for the joints no solve gave
+    """
+    stored = numpy.zeros(0)
+    if matrices:
+        frame_count = len(next(iter(matrices.values())))
+        stored = numpy.full((frame_count, len(influences), 4, 4), numpy.nan)
+        for i, influence in enumerate(influences):
+            if influence in matrices:
+                stored[:, i] = matrices[influence]
+
+    cache.save('dembones', weights=weights, influences=numpy.array(influences),
+               transforms=numpy.zeros(0) if transforms is None else transforms, matrices=stored)
+
+
+def warm_start_dembones(dembones, influences, frame_count):
+    """Sets up a DemBones solve to continue the previous one: fewer iterations, and the influences keyed
+    with their cached matrices. DemBones starts from the animation of the skinned mesh influences,
+    like it starts from its skin weights, which load_warm_start wrote.
+
+    Args:
+        dembones (dem_bones.DemBones): Solver before compute
+        influences (list): Influences of the solve, the others aren't keyed
+        frame_count (int): Number of ROM frames of the solve
+    """
+    dembones.num_iterations = WARM_START_SETTINGS['num_iterations']
+    dembones.tolerance = WARM_START_SETTINGS['tolerance']
+    dembones.patience = WARM_START_SETTINGS['patience']
+
+    data = cache.load('dembones')
+    stored = data.get('matrices') if data else None
+    if stored is None or stored.ndim != 4 or len(stored) != frame_count:
+        return
+
+    matrices = {influence: stored[:, i] for i, influence in enumerate(data['influences'].tolist())
+                if influence in influences and not numpy.isnan(stored[:, i]).any()}
+    key_matrices(matrices, list(range(1, frame_count + 1)))
+    OpenMaya.MGlobal.displayInfo(f'Dembones starts from the cached animation of {len(matrices)} joints')
+
+
+def run_dembones(blendshape_mesh, skinned_mesh, total_frame, region=None, border=2, warm_start=False):
+    """Decomposes the blendshape animation into joint transforms and skin weights of the skinned mesh
+
+    Args:
+        blendshape_mesh (str): Mesh deformed by the blendshapes through the ROM
+        skinned_mesh (str): Mesh skinned to the facial joints receiving the result
+        total_frame (int): Last frame of the ROM
+        region (numpy.ndarray, optional): Boolean array of the vertices that can move, eg. from get_mask_coverage.
+            Only those, plus the border ring, are given to DemBones. The whole mesh is solved if None.
+        border (int, optional): Rings of vertices added around the region as context for the solve
+        warm_start (bool, optional): Starts from the weights and joint animation of the previous solve,
+            with fewer iterations
+    """
+    import dem_bones
+
+    OpenMaya.MGlobal.displayInfo('Starting Dembones')
+    dembones = dem_bones.DemBones()
+
+    if warm_start and load_warm_start(skinned_mesh, total_frame)[0]:
+        warm_start_dembones(dembones, skin.get_influences(skinned_mesh), total_frame)
+
+    if region is None:
+        dembones.compute(skinned_mesh, blendshape_mesh, start_frame=1, end_frame=total_frame)
+        matrices = key_dembones_transforms(dembones)
+
+        weights = numpy.array(dembones.weights).reshape(-1, len(dembones.influences))
+        skin.set_weights(skinned_mesh, weights, True)
+        save_warm_start(weights, dembones.influences, matrices=matrices)
+        OpenMaya.MGlobal.displayInfo('Dembones Finished')
+        return
+
+    weights, influences = skin.get_weights(skinned_mesh)
+    selection = mesh.grow_vertices(region, mesh.get_edges(skinned_mesh), border)
+
+    sub_blendshape, vertices = extract_submesh(blendshape_mesh, selection, f'{blendshape_mesh}_region', live=True)
+    sub_skinned, _ = extract_submesh(skinned_mesh, selection, f'{skinned_mesh}_region')
+    OpenMaya.MGlobal.displayInfo(f'Dembones region: {len(vertices)} of {len(weights)} vertices')
+
+    # The sub mesh starts from the current weights of the vertices it holds
+    skin.load_weights(sub_skinned, weights[vertices], influences)
+
+    dembones.compute(sub_skinned, sub_blendshape, start_frame=1, end_frame=total_frame)
+    matrices = key_dembones_transforms(dembones)
+
+    solved = numpy.array(dembones.weights).reshape(len(vertices), len(dembones.influences))
+    columns = [influences.index(influence) for influence in dembones.influences]
+
+    # Only the region is written back, the border ring is there to stabilise the solve
+    inside = region[vertices]
+    weights[vertices[inside]] = 0.0
+    weights[numpy.ix_(vertices[inside], columns)] = solved[inside]
+    skin.set_weights(skinned_mesh, weights, True)
+    save_warm_start(weights, influences, matrices=matrices)
+
+    cmds.delete(sub_blendshape, sub_skinned)
     OpenMaya.MGlobal.displayInfo('Dembones Finished')
+
+
+def run_dembones_regions(blendshape_mesh, skinned_mesh, total_frame, masks, border=2, warm_start=False):
+    """Decomposes each face region (brows, eyelids, nose, cheeks, lips and mouth) with its own DemBones solve
+    and merges the weights back into the skinned mesh, normalized where the regions overlap.
+    dem_bones only works on meshes of the Maya session, so the regions are solved one after the other.
+
+    Args:
+        blendshape_mesh (str): Mesh deformed by the blendshapes through the ROM
+        skinned_mesh (str): Mesh skinned to the facial joints receiving the result
+        total_frame (int): Last frame of the ROM
+        masks (dict): mask name as key and {vertex id: value} as value
+        border (int, optional): Rings of vertices shared between neighbour regions
+        warm_start (bool, optional): Starts from the weights and joint animation of the previous solve,
+            with fewer iterations
+    """
+    import dem_bones
+
+    OpenMaya.MGlobal.displayInfo('Starting regional Dembones')
+    warm = warm_start and load_warm_start(skinned_mesh, total_frame)[0]
+
+    weights, influences = skin.get_weights(skinned_mesh)
+    rest = sample_points(skinned_mesh, [1])[0]
+    joint_positions = get_joint_positions(influences)
+    edges = mesh.get_edges(skinned_mesh)
+
+    region_values = regions.get_region_values(get_mask_arrays(masks, len(weights)))
+    names, vertex_regions, joint_regions = regions.partition(region_values, weights, rest, joint_positions)
+
+    results = list()
+    matrices = dict()
+    for index, name in enumerate(names):
+        joints = numpy.flatnonzero(joint_regions == index)
+        if not len(joints):
+            continue
+        selection = mesh.grow_vertices(vertex_regions == index, edges, border)
+
+        sub_blendshape, vertices = extract_submesh(blendshape_mesh, selection, f'{blendshape_mesh}_{name}', live=True)
+        sub_skinned, _ = extract_submesh(skinned_mesh, selection, f'{skinned_mesh}_{name}')
+        OpenMaya.MGlobal.displayInfo(f'Dembones {name}: {len(vertices)} vertices, {len(joints)} joints')
+
+        # Border vertices weighted to other regions only start bound to their closest joint of this one
+        region_weights = weights[numpy.ix_(vertices, joints)]
+        empty = numpy.flatnonzero(region_weights.sum(axis=1) == 0.0)
+        closest = numpy.linalg.norm(rest[vertices[empty], None] - joint_positions[joints][None], axis=2).argmin(axis=1)
+        region_weights[empty, closest] = 1.0
+        region_influences = [influences[joint] for joint in joints]
+        skin.load_weights(sub_skinned, region_weights / region_weights.sum(axis=1, keepdims=True), region_influences)
+
+        dembones = dem_bones.DemBones()
+        if warm:
+            warm_start_dembones(dembones, region_influences, total_frame)
+        dembones.compute(sub_skinned, sub_blendshape, start_frame=1, end_frame=total_frame)
+        matrices.update(key_dembones_transforms(dembones))
+
+        solved = numpy.array(dembones.weights).reshape(len(vertices), len(dembones.influences))
+        columns = [influences.index(influence) for influence in dembones.influences]
+        results.append((vertices, numpy.array(columns), solved))
+        cmds.delete(sub_blendshape, sub_skinned)
+
+    weights = regions.merge(weights, results)
+    skin.set_weights(skinned_mesh, weights, True)
+    save_warm_start(weights, influences, matrices=matrices)
+    OpenMaya.MGlobal.displayInfo('Regional Dembones finished')
+
+
+def run_skinning_solver_regions(blendshape_mesh, skinned_mesh, total_frame, masks, border=2, processes=None,
+                                warm_start=False):
+    """Same as run_dembones_regions with the NumPy solver, every region is solved at the same time in a process pool
+
+    Args:
+        blendshape_mesh (str): Mesh deformed by the blendshapes through the ROM
+        skinned_mesh (str): Mesh skinned to the facial joints receiving the result
+        total_frame (int): Last frame of the ROM
+        masks (dict): mask name as key and {vertex id: value} as value
+        border (int, optional): Rings of vertices shared between neighbour regions
+        processes (int, optional): Worker processes, all cores if None
+        warm_start (bool, optional): Starts from the weights and transforms of the previous solve,
+            with fewer iterations
+    """
+    OpenMaya.MGlobal.displayInfo('Starting regional decomposition')
+    frames = list(range(1, total_frame + 1))
+
+    warm, transforms = load_warm_start(skinned_mesh, total_frame) if warm_start else (False, None)
+    iterations = WARM_START_SETTINGS['num_iterations'] if warm else 20
+
+    weights, influences = skin.get_weights(skinned_mesh)
+    rest = sample_points(skinned_mesh, frames[:1])[0]
+    poses = sample_points(blendshape_mesh, frames)
+
+    region_values = regions.get_region_values(get_mask_arrays(masks, len(weights)))
+    weights, transforms = regions.solve_regions(rest, poses, weights, get_joint_positions(influences),
+                                                region_values, mesh.get_edges(skinned_mesh), border, processes,
+                                                iterations, transforms=transforms)
+
+    key_solver_transforms(influences, transforms, frames)
+    skin.set_weights(skinned_mesh, weights, True)
+    save_warm_start(weights, influences, transforms)
+    OpenMaya.MGlobal.displayInfo('Regional decomposition finished')
+
+
+def get_solver_data(blendshape_mesh, skinned_mesh, total_frame):
+    """Samples the same inputs DemBones reads from the scene
+
+    Returns:
+        dict: rest (vertices, 3), poses (frames, vertices, 3), weights (vertices, joints),
+        joint_positions (joints, 3), influences and frames
+    """
+    frames = list(range(1, total_frame + 1))
+    weights, influences = skin.get_weights(skinned_mesh)
+
+    return {'rest': sample_points(skinned_mesh, frames[:1])[0],
+            'poses': sample_points(blendshape_mesh, frames),
+            'weights': weights,
+            'joint_positions': get_joint_positions(influences),
+            'influences': influences,
+            'frames': frames}
+
+
+def export_solver_data(blendshape_mesh, skinned_mesh, total_frame, file_path):
+    """Writes the solver inputs to an npz archive, to tune and benchmark the solver outside of Maya"""
+    numpy.savez(file_path, **get_solver_data(blendshape_mesh, skinned_mesh, total_frame))
+
+
+def run_skinning_solver(blendshape_mesh, skinned_mesh, total_frame, iterations=20, max_influences=4,
+                        method='gradient', threads=None, warm_start=False):
+    """Same as run_dembones with the NumPy solver of the solver module instead of the dem_bones extension
+
+    Args:
+        blendshape_mesh (str): Mesh deformed by the blendshapes through the ROM
+        skinned_mesh (str): Mesh skinned to the facial joints receiving the result
+        total_frame (int): Last frame of the ROM
+        iterations (int, optional): Maximum solver iterations
+        max_influences (int, optional): Maximum joints per vertex
+        method (str, optional): Weight solver, 'gradient' or 'nnls'
+        threads (int, optional): BLAS threads, library default if None
+        warm_start (bool, optional): Starts from the weights and transforms of the previous solve,
+            with fewer iterations
+    """
+    OpenMaya.MGlobal.displayInfo('Starting skinning decomposition')
+    data = prepare_skinning_solver(blendshape_mesh, skinned_mesh, total_frame, iterations, max_influences, warm_start)
+    solve_skinning(data, max_influences, method, threads)
+    apply_skinning_solver(skinned_mesh, data)
+
+
+def prepare_skinning_solver(blendshape_mesh, skinned_mesh, total_frame, iterations=20, max_influences=4,
+                            warm_start=False):
+    """Scene part of run_skinning_solver before the solve: warm start and solver inputs
+
+    Returns:
+        dict: get_solver_data with the starting weights and transforms and the number of iterations
+    """
+    warm, transforms = load_warm_start(skinned_mesh, total_frame) if warm_start else (False, None)
+    data = get_solver_data(blendshape_mesh, skinned_mesh, total_frame)
+
+    if not warm and numpy.count_nonzero(data['weights'].max(axis=0)) < min(2, data['weights'].shape[1]):
+        data['weights'] = solver.initial_weights(data['rest'], data['joint_positions'], max_influences)
+    if warm:
+        iterations = min(iterations, WARM_START_SETTINGS['num_iterations'])
+
+    data['transforms'] = transforms
+    data['iterations'] = iterations
+    return data
+
+
+def solve_skinning(data, max_influences=4, method='gradient', threads=None):
+    """Runs the solver on the inputs of prepare_skinning_solver and stores its result in them.
+    It doesn't touch the scene, so it can run on a worker thread."""
+    data['history'] = list()
+    data['weights'], data['transforms'] = solver.decompose(
+        data['rest'], data['poses'], data['weights'], data['transforms'], data['iterations'], max_influences,
+        WARM_START_SETTINGS['tolerance'], WARM_START_SETTINGS['patience'], method, threads, data['history'])
+
+
+def apply_skinning_solver(skinned_mesh, data):
+    """Scene part of run_skinning_solver after the solve: keys the joints and writes the weights"""
+    for i, entry in enumerate(data['history']):
+        OpenMaya.MGlobal.displayInfo(f'Iteration {i + 1}: error {entry["error"]:.6f} time {entry["time"]:.3f}s')
+
+    key_solver_transforms(data['influences'], data['transforms'], data['frames'])
+    skin.set_weights(skinned_mesh, data['weights'], True)
+    save_warm_start(data['weights'], data['influences'], data['transforms'])
+    OpenMaya.MGlobal.displayInfo('Skinning decomposition finished')
@@ -0,0 +1,187 @@
+from maya.api import OpenMaya
+from maya import cmds
+
+import numpy
+
+from .blendshapes import BlendShape, get_blendshape, get_target_deltas, set_target_deltas
+from .rom import get_target_masks
+from . import cache, lib, mesh, nodes, skin
+
+
+def get_fingerprint(source_mesh, lod_mesh):
+    """Vertex counts and rest positions summary of both meshes, a cached correspondence is reused while it matches"""
+    source_points = mesh.get_points(source_mesh, OpenMaya.MSpace.kWorld)
+    lod_points = mesh.get_points(lod_mesh, OpenMaya.MSpace.kWorld)
+    return numpy.concatenate([[len(source_points), len(lod_points)],
+                              source_points.sum(axis=0), lod_points.sum(axis=0)]).round(4)
+
+
+def get_correspondence(source_mesh, lod_mesh):
+    """Closest point of every LOD vertex on the source triangles, as barycentric weights.
+    It's a sparse (lod vertices, source vertices) matrix with three entries per row,
+    cached as the 'lod_<mesh>' stage.
+
+    Args:
+        source_mesh (str): Hero mesh
+        lod_mesh (str): Decimated mesh, placed over the hero mesh
+
+    Returns:
+        tuple: (lod vertices, 3) source vertex indices and (lod vertices, 3) weights
+    """
+    stage = f'lod_{lod_mesh}'
+    fingerprint = get_fingerprint(source_mesh, lod_mesh)
+
+    data = cache.load(stage)
+    if data and numpy.array_equal(data['fingerprint'], fingerprint):
+        return data['indices'], data['weights']
+
+    source_dag = nodes.get_dag(source_mesh)
+    source_dag.extendToShape()
+    source_fn = OpenMaya.MFnMesh(source_dag)
+
+    intersector = OpenMaya.MMeshIntersector()
+    intersector.create(source_dag.node(), source_dag.inclusiveMatrix())
+
+    points = mesh.get_points(lod_mesh, OpenMaya.MSpace.kWorld)
+    indices = numpy.zeros((len(points), 3), dtype=numpy.int64)
+    weights = numpy.zeros((len(points), 3))
+
+    triangles = dict()
+    for i, point in enumerate(points):
+        point_on_mesh = intersector.getClosestPoint(OpenMaya.MPoint(point))
+        key = (point_on_mesh.face, point_on_mesh.triangle)
+        if key not in triangles:
+            triangles[key] = list(source_fn.getPolygonTriangleVertices(*key))
+
+        u, v = point_on_mesh.barycentricCoords
+        indices[i] = triangles[key]
+        weights[i] = u, v, 1.0 - u - v
+
+    weights = numpy.clip(weights, 0.0, 1.0)
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    cache.save(stage, indices=indices, weights=weights, fingerprint=fingerprint)
+    return indices, weights
+
+
+def transfer(values, indices, weights):
+    """Interpolates per vertex values of the source mesh onto the LOD vertices
+
+    Args:
+        values (numpy.ndarray): (source vertices, ...) values
+        indices (numpy.ndarray): (lod vertices, 3) from get_correspondence
+        weights (numpy.ndarray): (lod vertices, 3) from get_correspondence
+
+    Returns:
+        numpy.ndarray: (lod vertices, ...) values
+    """
+    return numpy.einsum('lk,lk...->l...', weights, values[indices])
+
+
+def transfer_masks(masks, count, indices, weights):
+    """Masks in the painted layout, {vertex id: value}, transferred onto a LOD"""
+    result = dict()
+    for name, values in lib.get_mask_arrays(masks, count).items():
+        values = transfer(values, indices, weights).round(4)
+        result[name] = {int(vtx): float(values[vtx]) for vtx in numpy.flatnonzero(values)}
+    return result
+
+
+def transfer_skin(hero_weights, influences, lod_mesh, indices, weights):
+    """Binds the LOD to the hero influences and writes the interpolated weights"""
+    lod_weights = transfer(hero_weights, indices, weights)
+    lod_weights /= numpy.maximum(lod_weights.sum(axis=1, keepdims=True), 1e-12)
+
+    skin.load_weights(lod_mesh, lod_weights, influences)
+
+
+def get_targets(blend_node, count):
+    """Weight plug, alias and (vertices, 3) deltas of every target of the hero blendShape, by target index"""
+    weight_plug = nodes.get_plug(blend_node, 'weight')
+
+    targets = dict()
+    for j in range(weight_plug.numElements()):
+        plug = weight_plug.elementByPhysicalIndex(j)
+        targets[plug.logicalIndex()] = (plug, plug.partialName(useAlias=True),
+                                        get_target_deltas(blend_node, plug.logicalIndex(), count))
+    return targets
+
+
+def transfer_blendshapes(targets, lod_mesh, masks, target_masks, indices, weights, modifier):
+    """Creates the LOD blendShape with the hero targets, deltas and masks transferred.
+    The LOD target weights are connected to the hero ones, so the hero driven keys
+    and combination shapes drive every LOD without any network of their own.
+
+    Args:
+        targets (dict): Hero targets from get_targets
+        lod_mesh (str): Decimated mesh
+        masks (dict): LOD masks from transfer_masks
+        target_masks (dict): target alias as key and mask name as value
+        indices (numpy.ndarray): (lod vertices, 3) from get_correspondence
+        weights (numpy.ndarray): (lod vertices, 3) from get_correspondence
+        modifier (OpenMaya.MDGModifier): Collects the weight connections of every LOD
+
+    Returns:
+        str: The LOD blendShape node
+    """
+    lod_blend = get_blendshape(lod_mesh) or cmds.blendShape(lod_mesh, n=f'{lod_mesh}_blendshapes', foc=True)[0]
+    lod_shape = BlendShape(lod_mesh, masks)
+
+    lod_weight = nodes.get_plug(lod_blend, 'weight')
+
+    for index, (plug, alias, deltas) in targets.items():
+        deltas = transfer(deltas, indices, weights)
+        mask = target_masks.get(alias)
+
+        # Only the masked vertices store deltas, like the hero sparse targets
+        if mask in masks:
+            deltas[lod_shape.get_mask_values(mask) == 0.0] = 0.0
+        set_target_deltas(lod_blend, index, deltas)
+
+        target = lod_weight.elementByLogicalIndex(index)
+        cmds.aliasAttr(alias, f'{lod_blend}.{target.partialName()}')
+        if mask in masks:
+            lod_shape.set_mask(mask, index, sparse=True)
+
+        if not target.isDestination:
+            modifier.connect(plug, target)
+
+    return lod_blend
+
+
+def build(hero_mesh, lod_meshes, masks, blendshape_mesh=None):
+    """Generates the LOD rigs in one batch, every LOD is skinned to the hero joints
+    and its blendshape weights follow the hero ones
+
+    Args:
+        hero_mesh (str): Skinned hero mesh
+        lod_meshes (list): Decimated meshes, placed over the hero mesh
+        masks (dict): Hero masks, mask name as key and {vertex id: value} as value
+        blendshape_mesh (str, optional): Mesh holding the hero blendShape, same topology as the hero mesh
+
+    Returns:
+        dict: LOD mesh as key and its transferred masks as value
+    """
+    # The hero data is read once and shared by every LOD
+    hero_weights, influences = skin.get_weights(hero_mesh)
+    count = len(hero_weights)
+
+    blend_node = get_blendshape(blendshape_mesh) if blendshape_mesh else None
+    targets = get_targets(blend_node, count) if blend_node else dict()
+    target_masks = get_target_masks()
+
+    modifier = OpenMaya.MDGModifier()
+    result = dict()
+    for lod_mesh in lod_meshes:
+        indices, weights = get_correspondence(hero_mesh, lod_mesh)
+        result[lod_mesh] = transfer_masks(masks, count, indices, weights)
+
+        # The blendShape goes first so it's evaluated before the skin cluster
+        if targets:
+            transfer_blendshapes(targets, lod_mesh, result[lod_mesh], target_masks, indices, weights, modifier)
+        transfer_skin(hero_weights, influences, lod_mesh, indices, weights)
+
+        OpenMaya.MGlobal.displayInfo(f'LOD {lod_mesh}: {len(indices)} of {count} vertices')
+
+    modifier.doIt()
+    return result
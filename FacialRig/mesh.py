@@ -0,0 +1,193 @@
+from maya.api import OpenMaya
+
+import hashlib
+import numpy
+import functools
+
+from . import journal, nodes
+
+
+def get_mesh_fn(mesh):
+    """Gets the mesh function set of a given mesh
+
+    Args:
+        mesh (str, OpenMaya.MDagPath): Transform node or shape node name of the mesh
+
+    Returns:
+        OpenMaya.MFnMesh: Function set attached to the mesh shape
+    """
+    if not isinstance(mesh, OpenMaya.MDagPath):
+        mesh = nodes.get_dag(mesh)
+    return OpenMaya.MFnMesh(mesh)
+
+
+def get_points(mesh, space=OpenMaya.MSpace.kObject):
+    """Reads every vertex position of a mesh in a single call
+
+    Args:
+        mesh (str, OpenMaya.MDagPath, OpenMaya.MFnMesh): Mesh to read
+        space (int, optional): OpenMaya.MSpace constant. Defaults to object space.
+
+    Returns:
+        numpy.ndarray: (vertices, 3) float array ordered by vertex id
+    """
+    if not isinstance(mesh, OpenMaya.MFnMesh):
+        mesh = get_mesh_fn(mesh)
+    return numpy.array(mesh.getPoints(space), dtype=numpy.float64)[:, :3]
+
+
+def set_points(mesh, points, space=OpenMaya.MSpace.kObject):
+    """Writes every vertex position of a mesh in a single call
+
+    Args:
+        mesh (str, OpenMaya.MDagPath, OpenMaya.MFnMesh): Mesh to write
+        points (numpy.ndarray): (vertices, 3) float array ordered by vertex id
+        space (int, optional): OpenMaya.MSpace constant. Defaults to object space.
+    """
+    if not isinstance(mesh, OpenMaya.MFnMesh):
+        mesh = get_mesh_fn(mesh)
+    if journal.is_recording():
+        journal.record(functools.partial(mesh.setPoints, mesh.getPoints(space), space))
+    mesh.setPoints(OpenMaya.MPointArray(points.tolist()), space)
+
+
+def get_edges(mesh):
+    """Builds the unique edge list of a mesh from its polygon connects
+
+    Args:
+        mesh (str, OpenMaya.MDagPath, OpenMaya.MFnMesh): Mesh to read
+
+    Returns:
+        numpy.ndarray: (edges, 2) int array, each row sorted as (lower id, higher id)
+    """
+    if not isinstance(mesh, OpenMaya.MFnMesh):
+        mesh = get_mesh_fn(mesh)
+    counts, connects = mesh.getVertices()
+    counts = numpy.array(counts, dtype=numpy.int64)
+    connects = numpy.array(connects, dtype=numpy.int64)
+
+    # Every face vertex connects to the next one, the last one wraps back to the first
+    starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    ends = numpy.repeat(numpy.cumsum(counts) - 1, counts)
+    current = numpy.arange(len(connects))
+    following = numpy.where(current == ends, starts, current + 1)
+
+    edges = numpy.stack([connects, connects[following]], axis=1)
+    edges.sort(axis=1)
+    return numpy.unique(edges, axis=0)
+
+
+def get_fingerprint(mesh):
+    """Topology summary of a mesh, two meshes with the same fingerprint can share deltas vertex by vertex.
+    The counts don't depend on the vertex order, the hash of the polygon connects does.
+
+    Args:
+        mesh (str, OpenMaya.MDagPath, OpenMaya.MFnMesh): Mesh to read
+
+    Returns:
+        tuple: vertex, face and face vertex counts and the connects hash
+    """
+    if not isinstance(mesh, OpenMaya.MFnMesh):
+        mesh = get_mesh_fn(mesh)
+    counts, connects = mesh.getVertices()
+    digest = hashlib.blake2b(numpy.array(counts, dtype=numpy.int32).tobytes(), digest_size=16)
+    digest.update(numpy.array(connects, dtype=numpy.int32).tobytes())
+    return mesh.numVertices, len(counts), len(connects), digest.hexdigest()
+
+
+def nearest_vertices(points, queries, chunk=1024):
+    """Finds the closest point index for every query position
+
+    Args:
+        points (numpy.ndarray): (n, 3) searched positions
+        queries (numpy.ndarray): (m, 3) positions to match
+        chunk (int, optional): Rows per brute force block when scipy isn't available
+
+    Returns:
+        numpy.ndarray: (m,) int array with the index of the closest point
+    """
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        cKDTree = None
+
+    if cKDTree:
+        return cKDTree(points).query(queries)[1]
+
+    result = numpy.empty(len(queries), dtype=numpy.int64)
+    squared = numpy.einsum('ij,ij->i', points, points)
+    for start in range(0, len(queries), chunk):
+        block = queries[start:start + chunk]
+        distance = squared[None, :] - 2.0 * block @ points.T
+        result[start:start + chunk] = distance.argmin(axis=1)
+    return result
+
+
+def get_symmetry_map(points, axis=0):
+    """Matches every vertex with its mirrored counterpart
+
+    Args:
+        points (numpy.ndarray): (vertices, 3) rest positions
+        axis (int, optional): Mirror axis, X by default
+
+    Returns:
+        numpy.ndarray: (vertices,) int array where map[i] is the mirrored vertex of i
+    """
+    mirrored = points.copy()
+    mirrored[:, axis] *= -1
+    return nearest_vertices(points, mirrored)
+
+
+def smooth_weights(values, edges, iterations=2, factor=0.5):
+    """Laplacian smoothing of per vertex values along the mesh edges
+
+    Args:
+        values (numpy.ndarray): (vertices,) or (n, vertices) values to smooth
+        edges (numpy.ndarray): (edges, 2) int array from get_edges
+        iterations (int, optional): Number of smoothing passes
+        factor (float, optional): How much each pass moves toward the neighbours average
+
+    Returns:
+        numpy.ndarray: Smoothed copy of the given values
+    """
+    values = numpy.array(values, dtype=numpy.float64)
+    shape = values.shape
+    count = shape[-1]
+    # Vertices on the first axis so every edge accumulates whole rows at once
+    values = values.reshape(-1, count).T.copy()
+    first, second = edges[:, 0], edges[:, 1]
+
+    degree = numpy.bincount(first, minlength=count) + numpy.bincount(second, minlength=count)
+    degree = numpy.maximum(degree, 1)[:, None]
+
+    for _ in range(iterations):
+        neighbours = numpy.zeros_like(values)
+        numpy.add.at(neighbours, first, values[second])
+        numpy.add.at(neighbours, second, values[first])
+        values += factor * (neighbours / degree - values)
+    return values.T.reshape(shape)
+
+
+def grow_vertices(vertices, edges, rings=1, count=None):
+    """Expands a vertex selection by a number of edge rings
+
+    Args:
+        vertices (numpy.ndarray): Vertex ids or a boolean selection
+        edges (numpy.ndarray): (edges, 2) int array from get_edges
+        rings (int, optional): Number of rings to add around the selection
+        count (int, optional): Total vertex count, needed when ids are given
+
+    Returns:
+        numpy.ndarray: Boolean selection of the grown region
+    """
+    vertices = numpy.asarray(vertices)
+    if vertices.dtype != bool:
+        selection = numpy.zeros(count if count else edges.max() + 1, dtype=bool)
+        selection[vertices] = True
+    else:
+        selection = vertices.copy()
+
+    for _ in range(rings):
+        touched = selection[edges[:, 0]] | selection[edges[:, 1]]
+        selection[edges[touched].ravel()] = True
+    return selection
@@ -0,0 +1,129 @@
+from maya.api import OpenMaya
+
+
+# Cache key as key and (MObjectHandle list, value) as value
+_cache = dict()
+# MObjectHandle hash code as key and the cache keys depending on that node as value
+_keys = dict()
+_callbacks = list()
+
+
+def install():
+    """Registers the scene callbacks keeping the cache right, done on the first lookup"""
+    if _callbacks:
+        return
+    _callbacks.extend([
+        OpenMaya.MNodeMessage.addNameChangedCallback(OpenMaya.MObject(), node_changed),
+        OpenMaya.MDGMessage.addNodeRemovedCallback(node_changed, 'dependNode'),
+        OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kBeforeNew, clear),
+        OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kBeforeOpen, clear),
+        # An undo can take attributes away from nodes that are still valid
+        OpenMaya.MEventMessage.addEventCallback('Undo', clear),
+        OpenMaya.MEventMessage.addEventCallback('Redo', clear)])
+
+
+def uninstall():
+    OpenMaya.MMessage.removeCallbacks(_callbacks)
+    del _callbacks[:]
+    clear()
+
+
+def clear(*args):
+    _cache.clear()
+    _keys.clear()
+
+
+def node_changed(node, *args):
+    # Renamed or deleted, every entry found through the node is dropped
+    for key in _keys.pop(OpenMaya.MObjectHandle(node).hashCode(), ()):
+        _cache.pop(key, None)
+
+
+def store(key, objects, value):
+    install()
+    handles = [OpenMaya.MObjectHandle(obj) for obj in objects]
+    _cache[key] = (handles, value)
+    for handle in handles:
+        _keys.setdefault(handle.hashCode(), set()).add(key)
+    return value
+
+
+def lookup(key):
+    entry = _cache.get(key)
+    if entry and all(handle.isValid() for handle in entry[0]):
+        return entry[1]
+    return None
+
+
+def get_node(name):
+    """Same as OpenMaya.MSelectionList().add(name).getDependNode(0), resolved once while the node keeps its name
+
+    Args:
+        name (str, OpenMaya.MObject): Node name, an MObject is given back as is
+
+    Returns:
+        OpenMaya.MObject: The node
+    """
+    if isinstance(name, OpenMaya.MObject):
+        return name
+
+    handle = lookup(('node', name))
+    if handle is None:
+        obj = OpenMaya.MSelectionList().add(name).getDependNode(0)
+        handle = store(('node', name), [obj], OpenMaya.MObjectHandle(obj))
+    return handle.object()
+
+
+def get_dag(name):
+    """Same as OpenMaya.MSelectionList().add(name).getDagPath(0), the caller gets its own copy to extend"""
+    if isinstance(name, OpenMaya.MDagPath):
+        return OpenMaya.MDagPath(name)
+
+    dag = lookup(('dag', name))
+    if dag is None or not dag.isValid():
+        dag = OpenMaya.MSelectionList().add(name).getDagPath(0)
+        store(('dag', name), [dag.node()], dag)
+    return OpenMaya.MDagPath(dag)
+
+
+def get_plug(name, attribute):
+    """Plug of a node attribute, the findPlug result is kept while the node keeps its name
+
+    Args:
+        name (str, OpenMaya.MObject): Node name
+        attribute (str): Attribute name
+
+    Returns:
+        OpenMaya.MPlug: A copy of the cached plug
+    """
+    if isinstance(name, OpenMaya.MObject):
+        return OpenMaya.MFnDependencyNode(name).findPlug(attribute, False)
+
+    plug = lookup(('plug', name, attribute))
+    if plug is None or plug.isNull:
+        obj = get_node(name)
+        plug = store(('plug', name, attribute), [obj], OpenMaya.MFnDependencyNode(obj).findPlug(attribute, False))
+    return OpenMaya.MPlug(plug)
+
+
+def get_linked(name, kind, find):
+    """Node found from another one through a graph search, eg. the blendShape of a mesh.
+    The search only runs again once one of both nodes is renamed or deleted.
+
+    Args:
+        name (str): Node the search starts from
+        kind (str): Name of the search, part of the cache key
+        find (callable): Called with name, returns the found MObject or None. None isn't cached.
+
+    Returns:
+        OpenMaya.MObject: The found node, None if there isn't any
+    """
+    handle = lookup(('link', name, kind))
+    if handle is not None:
+        return handle.object()
+
+    obj = find(name)
+    if obj is None:
+        return None
+    store(('link', name, kind), [get_node(name), obj], OpenMaya.MObjectHandle(obj))
+    return obj
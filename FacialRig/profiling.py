@@ -0,0 +1,172 @@
+from maya.api import OpenMaya
+from maya import cmds
+
+import os
+import sys
+import time
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+
+from . import mesh, nodes
+
+
+@contextmanager
+def timed(label, results=None):
+    """Measures the wall time of the enclosed block
+
+    Args:
+        label (str): Name displayed and stored for the measured block
+        results (dict, optional): If given, the elapsed seconds are stored under the label
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if results is not None:
+            results[label] = elapsed
+        OpenMaya.MGlobal.displayInfo(f'{label}: {elapsed:.3f}s')
+
+
+def blendshape_footprint(blend_node):
+    """Counts the data a blendShape node stores for its targets
+
+    Args:
+        blend_node (str): Name of the blendShape node
+
+    Returns:
+        dict: number of targets, stored delta points, stored per vertex target weights and an estimate in bytes
+    """
+    blend_obj = nodes.get_node(blend_node)
+    blend_fn = OpenMaya.MFnDependencyNode(blend_obj)
+
+    points_attr = blend_fn.attribute('inputPointsTarget')
+    components_attr = blend_fn.attribute('inputComponentsTarget')
+    weights_attr = blend_fn.attribute('targetWeights')
+    items_attr = blend_fn.attribute('inputTargetItem')
+
+    groups_plug = nodes.get_plug(blend_node, 'inputTarget').elementByLogicalIndex(0).child(0)
+
+    footprint = {'targets': groups_plug.numElements(), 'points': 0, 'components': 0, 'weights': 0}
+    for i in range(groups_plug.numElements()):
+        group_plug = groups_plug.elementByPhysicalIndex(i)
+        footprint['weights'] += group_plug.child(weights_attr).numElements()
+
+        items_plug = group_plug.child(items_attr)
+        for j in range(items_plug.numElements()):
+            item_plug = items_plug.elementByPhysicalIndex(j)
+
+            points_obj = item_plug.child(points_attr).asMObject()
+            if not points_obj.isNull():
+                footprint['points'] += len(OpenMaya.MFnPointArrayData(points_obj).array())
+
+            components_obj = item_plug.child(components_attr).asMObject()
+            if components_obj.isNull():
+                continue
+            components_fn = OpenMaya.MFnComponentListData(components_obj)
+            for k in range(components_fn.length()):
+                footprint['components'] += OpenMaya.MFnSingleIndexedComponent(components_fn.get(k)).elementCount
+
+    # MPoint holds 4 doubles, component ids are ints and every target weight is a double
+    footprint['bytes'] = footprint['points'] * 32 + footprint['components'] * 4 + footprint['weights'] * 8
+    return footprint
+
+
+def evaluation_time(mesh_name, plugs, samples=20):
+    """Average time to evaluate a mesh while the given plugs change every sample
+
+    Args:
+        mesh_name (str): Deformed mesh pulled after every change
+        plugs (list): OpenMaya.MPlug list toggled between 0.5 and 1.0
+        samples (int, optional): Number of evaluations
+
+    Returns:
+        float: Seconds per evaluation
+    """
+    values = [plug.asFloat() for plug in plugs]
+
+    start = time.perf_counter()
+    for i in range(samples):
+        for plug in plugs:
+            plug.setFloat(1.0 - 0.5 * (i % 2))
+        mesh.get_points(mesh_name)
+    elapsed = (time.perf_counter() - start) / samples
+
+    for plug, value in zip(plugs, values):
+        plug.setFloat(value)
+    return elapsed
+
+
+def playback_fps(start=None, end=None, loops=3, mode='parallel'):
+    """Frames per second evaluated stepping through the time range, the viewport isn't drawn
+
+    Args:
+        start (int, optional): First frame, the playback start if None
+        end (int, optional): Last frame, the playback end if None
+        loops (int, optional): Times the range is played
+        mode (str, optional): Evaluation manager mode used while measuring
+
+    Returns:
+        float: Evaluated frames per second
+    """
+    start = int(cmds.playbackOptions(q=True, min=True) if start is None else start)
+    end = int(cmds.playbackOptions(q=True, max=True) if end is None else end)
+
+    current_time = cmds.currentTime(q=True)
+    previous_mode = cmds.evaluationManager(q=True, mode=True)[0]
+    cmds.evaluationManager(mode=mode)
+
+    begin = time.perf_counter()
+    for _ in range(loops):
+        for frame in range(start, end + 1):
+            cmds.currentTime(frame, update=True)
+    elapsed = time.perf_counter() - begin
+
+    cmds.currentTime(current_time)
+    cmds.evaluationManager(mode=previous_mode)
+    return loops * (end - start + 1) / max(elapsed, 1e-9)
+
+
+def display_comparison(label, before, after):
+    """Prints the before and after values of every shared key"""
+    OpenMaya.MGlobal.displayInfo(label)
+    for key in before:
+        ratio = after[key] / before[key] if before[key] else 0.0
+        OpenMaya.MGlobal.displayInfo(f'    {key}: {before[key]} -> {after[key]} ({ratio:.1%})')
+
+
+IMPORT_SCRIPT = """
+import sys, time, importlib
+sys.path.insert(0, sys.argv[1])
+import maya.cmds, maya.api.OpenMaya
+start = time.perf_counter()
+importlib.import_module(sys.argv[2])
+print(time.perf_counter() - start)
+"""
+
+
+def import_time(modules=('FacialRig', 'FacialRig.lib', 'FacialRig.face_ui'), repeats=3):
+    """Seconds each module takes to import in a fresh interpreter, Maya's own modules are already loaded.
+    The best of a few runs is kept, the first run also writes the compiled table caches.
+
+    Args:
+        modules (list, optional): Module names to import
+        repeats (int, optional): Fresh interpreters started per module
+
+    Returns:
+        dict: module name as key and seconds as value
+    """
+    executable = sys.executable
+    if 'MAYA_LOCATION' in os.environ:
+        executable = os.path.join(os.environ['MAYA_LOCATION'], 'bin', 'mayapy.exe' if os.name == 'nt' else 'mayapy')
+
+    root = str(Path(__file__).parent.parent)
+    result = dict()
+    for module in modules:
+        samples = [float(subprocess.run([executable, '-c', IMPORT_SCRIPT, root, module], check=True,
+                                        capture_output=True, text=True).stdout.split()[-1])
+                   for _ in range(repeats)]
+        result[module] = min(samples)
+        OpenMaya.MGlobal.displayInfo(f'import {module}: {result[module] * 1000.0:.1f}ms')
+    return result
@@ -0,0 +1,164 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from . import mesh, solver
+
+
+REGIONS = ['brows', 'eyelid', 'nose', 'cheek', 'lips', 'mouth']
+
+
+def get_region_name(mask):
+    """Face region of a mask name from blendshapes.json, eg. l_brows_inner -> brows"""
+    tokens = mask.split('_')
+    if tokens[0] in ['l', 'r']:
+        tokens = tokens[1:]
+    return tokens[0]
+
+
+def get_region_values(masks):
+    """Combines the masks of every region
+
+    Args:
+        masks (dict): mask name as key and (vertices,) numpy.ndarray as value
+
+    Returns:
+        dict: region name as key and the highest mask value of each vertex as value
+    """
+    regions = dict()
+    for mask, values in masks.items():
+        region = get_region_name(mask)
+        regions[region] = numpy.maximum(regions[region], values) if region in regions else values.copy()
+    return {region: regions[region] for region in REGIONS if region in regions}
+
+
+def partition(region_values, weights, rest, joint_positions):
+    """Assigns every vertex and every joint to one region
+
+    Args:
+        region_values (dict): region name as key and (vertices,) mask values as value
+        weights (numpy.ndarray): (vertices, joints) current skin weights
+        rest (numpy.ndarray): (vertices, 3) rest positions
+        joint_positions (numpy.ndarray): (joints, 3) rest positions of the joints
+
+    Returns:
+        tuple: region names, (vertices,) region index per vertex (-1 outside every region)
+        and (joints,) region index per joint
+    """
+    names = list(region_values.keys())
+    values = numpy.stack([region_values[name] for name in names])
+
+    vertex_regions = values.argmax(axis=0)
+    vertex_regions[values.max(axis=0) == 0.0] = -1
+
+    # Joints follow the region holding most of their weights, or the closest one if they have none
+    membership = numpy.zeros((len(names), len(vertex_regions)))
+    inside = vertex_regions >= 0
+    membership[vertex_regions[inside], numpy.flatnonzero(inside)] = 1.0
+    mass = membership @ weights
+
+    centers = numpy.full((len(names), 3), numpy.inf)
+    for i in range(len(names)):
+        if numpy.any(vertex_regions == i):
+            centers[i] = rest[vertex_regions == i].mean(axis=0)
+    closest = numpy.linalg.norm(joint_positions[:, None] - centers[None], axis=2).argmin(axis=1)
+
+    joint_regions = numpy.where(mass.max(axis=0) > 0.0, mass.argmax(axis=0), closest)
+    return names, vertex_regions, joint_regions
+
+
+def solve_region(rest, poses, weights, transforms, iterations, max_influences, threads):
+    return solver.decompose(rest, poses, weights, transforms, iterations, max_influences, threads=threads)
+
+
+def get_pool_context():
+    """Inside Maya the worker processes have to be started with mayapy, not the Maya executable"""
+    context = multiprocessing.get_context('spawn')
+    if 'MAYA_LOCATION' in os.environ:
+        executable = 'mayapy.exe' if os.name == 'nt' else 'mayapy'
+        context.set_executable(os.path.join(os.environ['MAYA_LOCATION'], 'bin', executable))
+    return context
+
+
+def solve_regions(rest, poses, weights, joint_positions, region_values, edges,
+                  border=2, processes=None, iterations=20, max_influences=4, transforms=None):
+    """Decomposes every face region at the same time in a process pool and merges the results.
+    Each region solves its own vertices plus a border ring with the joints it owns,
+    vertices shared by several regions blend their results and are normalized.
+
+    Args:
+        rest (numpy.ndarray): (vertices, 3) rest positions
+        poses (numpy.ndarray): (frames, vertices, 3) target positions
+        weights (numpy.ndarray): (vertices, joints) initial skin weights
+        joint_positions (numpy.ndarray): (joints, 3) rest positions of the joints
+        region_values (dict): region name as key and (vertices,) mask values as value
+        edges (numpy.ndarray): (edges, 2) mesh edges used to grow the border rings
+        border (int, optional): Rings of vertices shared with the neighbour regions
+        processes (int, optional): Worker processes, all cores if None
+        iterations (int, optional): Solver iterations per region
+        max_influences (int, optional): Maximum joints per vertex
+        transforms (numpy.ndarray, optional): (frames, joints, 3, 4) initial transforms, identity if None
+
+    Returns:
+        tuple: (vertices, joints) merged weights and (frames, joints, 3, 4) merged transforms
+    """
+    names, vertex_regions, joint_regions = partition(region_values, weights, rest, joint_positions)
+
+    initial = transforms
+    transforms = solver.identity_transforms(len(poses), weights.shape[1])
+
+    processes = processes or os.cpu_count()
+    # Every worker gets its share of the cores for BLAS, so the pool doesn't oversubscribe them
+    threads = max(1, os.cpu_count() // processes)
+
+    tasks = list()
+    for index in range(len(names)):
+        joints = numpy.flatnonzero(joint_regions == index)
+        if not len(joints):
+            continue
+        vertices = numpy.flatnonzero(mesh.grow_vertices(vertex_regions == index, edges, border))
+
+        # A fresh bind usually gives every vertex to one joint, that's no starting point for a solve
+        region_weights = weights[numpy.ix_(vertices, joints)]
+        spread = numpy.count_nonzero(region_weights.max(axis=0))
+        if not region_weights.sum(axis=1).all() or spread < min(2, len(joints)):
+            region_weights = solver.initial_weights(rest[vertices], joint_positions[joints], max_influences)
+
+        region_transforms = None if initial is None else initial[:, joints]
+        tasks.append([vertices, joints, (rest[vertices], poses[:, vertices], region_weights,
+                                         region_transforms, iterations, max_influences, threads)])
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=get_pool_context()) as pool:
+        futures = [pool.submit(solve_region, *arguments) for _, _, arguments in tasks]
+        results = [future.result() for future in futures]
+
+    merged = merge(weights, [(vertices, joints, region_weights)
+                             for (vertices, joints, _), (region_weights, _) in zip(tasks, results)])
+    for (vertices, joints, _), (_, region_transforms) in zip(tasks, results):
+        transforms[:, joints] = region_transforms
+    return merged, transforms
+
+
+def merge(weights, results):
+    """Writes the weights solved per region back into the whole mesh
+
+    Args:
+        weights (numpy.ndarray): (vertices, joints) weights before the solve
+        results (list): (vertices, joints, (region vertices, region joints) weights) of every region
+
+    Returns:
+        numpy.ndarray: (vertices, joints) merged weights
+    """
+    merged = numpy.zeros_like(weights)
+    solved = numpy.zeros(len(weights), dtype=bool)
+    for vertices, joints, region_weights in results:
+        merged[numpy.ix_(vertices, joints)] += region_weights
+        solved[vertices] = True
+
+    # Vertices outside every region keep their weights, border vertices are normalized across regions
+    merged[~solved] = weights[~solved]
+    total = merged[solved].sum(axis=1, keepdims=True)
+    merged[solved] /= numpy.maximum(total, 1e-12)
+    return merged
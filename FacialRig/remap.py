@@ -0,0 +1,189 @@
+from maya.api import OpenMaya
+
+import numpy
+
+from . import cache, mesh
+
+
+def get_faces(mesh_fn):
+    """Vertex loops of every face and the face and position of every directed edge
+
+    Returns:
+        tuple: list of face vertex lists and {(vertex, next vertex): (face, position)}
+    """
+    counts, connects = mesh_fn.getVertices()
+    connects = list(connects)
+
+    faces = list()
+    half_edges = dict()
+    start = 0
+    for count in counts:
+        face = connects[start:start + count]
+        for i in range(count):
+            half_edges[(face[i], face[(i + 1) % count])] = (len(faces), i)
+        faces.append(face)
+        start += count
+    return faces, half_edges
+
+
+def propagate(base, target, base_edge, target_edge, order, base_done, target_done):
+    """Walks a shell face by face from a pair of matching directed edges, filling the vertex order
+
+    Args:
+        base (tuple): get_faces of the base mesh
+        target (tuple): get_faces of the target mesh
+        base_edge (tuple): Directed edge of the base mesh
+        target_edge (tuple): Matching directed edge of the target mesh
+        order (list): Target vertex of every base vertex, -1 if not found yet
+        base_done (list): Base faces already walked
+        target_done (list): Target faces already walked
+
+    Returns:
+        bool: False if the topologies don't match
+    """
+    base_faces, base_half_edges = base
+    target_faces, target_half_edges = target
+
+    queue = [(base_edge, target_edge)]
+    while queue:
+        base_edge, target_edge = queue.pop()
+
+        # A border on one side only
+        if (base_edge in base_half_edges) != (target_edge in target_half_edges):
+            return False
+        if base_edge not in base_half_edges:
+            continue
+
+        base_face, base_start = base_half_edges[base_edge]
+        target_face, target_start = target_half_edges[target_edge]
+        if base_done[base_face] != target_done[target_face]:
+            return False
+        if base_done[base_face]:
+            continue
+
+        base_loop, target_loop = base_faces[base_face], target_faces[target_face]
+        count = len(base_loop)
+        if count != len(target_loop):
+            return False
+        base_done[base_face] = target_done[target_face] = True
+
+        for k in range(count):
+            base_vtx = base_loop[(base_start + k) % count]
+            target_vtx = target_loop[(target_start + k) % count]
+            if order[base_vtx] == -1:
+                order[base_vtx] = target_vtx
+            elif order[base_vtx] != target_vtx:
+                return False
+
+            # The opposite edge leads to the neighbour face
+            base_next = base_loop[(base_start + k + 1) % count]
+            target_next = target_loop[(target_start + k + 1) % count]
+            queue.append(((base_next, base_vtx), (target_next, target_vtx)))
+    return True
+
+
+def find_order(base_mesh, target_mesh, tolerance=1e-4):
+    """Matches the vertices of a target whose vertex ids were shuffled, eg. by an FBX round trip.
+    The vertices the target doesn't move are matched by position, they seed a walk along the faces
+    that matches the moved vertices from the topology alone.
+
+    Args:
+        base_mesh (str, OpenMaya.MDagPath, OpenMaya.MFnMesh): Neutral mesh
+        target_mesh (str, OpenMaya.MDagPath, OpenMaya.MFnMesh): Target with the same topology in another order
+        tolerance (float, optional): Distance under which a vertex counts as not moved
+
+    Returns:
+        numpy.ndarray: (vertices,) target vertex id of every base vertex, None if they can't be matched
+    """
+    base_fn = mesh.get_mesh_fn(base_mesh) if not isinstance(base_mesh, OpenMaya.MFnMesh) else base_mesh
+    target_fn = mesh.get_mesh_fn(target_mesh) if not isinstance(target_mesh, OpenMaya.MFnMesh) else target_mesh
+    if base_fn.numVertices != target_fn.numVertices:
+        return None
+
+    base_points = mesh.get_points(base_fn)
+    target_points = mesh.get_points(target_fn)
+    nearest = mesh.nearest_vertices(target_points, base_points)
+    still = numpy.linalg.norm(target_points[nearest] - base_points, axis=1) <= tolerance
+    nearest = nearest.tolist()
+
+    base = get_faces(base_fn)
+    target = get_faces(target_fn)
+    order = [-1] * base_fn.numVertices
+    base_done = [False] * len(base[0])
+    target_done = [False] * len(target[0])
+
+    # Every shell needs a seed edge, both of its vertices left where they were
+    for face_id, face in enumerate(base[0]):
+        if base_done[face_id]:
+            continue
+        for i in range(len(face)):
+            base_edge = (face[i], face[(i + 1) % len(face)])
+            target_edge = (nearest[base_edge[0]], nearest[base_edge[1]])
+            if still[base_edge[0]] and still[base_edge[1]] and target_edge in target[1]:
+                if not propagate(base, target, base_edge, target_edge, order, base_done, target_done):
+                    return None
+                break
+
+    order = numpy.array(order, dtype=numpy.int64)
+    if (order < 0).any() or len(numpy.unique(order)) != len(order):
+        return None
+    return order
+
+
+def get_order(base_mesh, target_mesh, name=None):
+    """Vertex order of a target in base vertex ids, cached per target as the 'remap_<name>' stage
+
+    Args:
+        base_mesh (str, OpenMaya.MFnMesh): Neutral mesh
+        target_mesh (str, OpenMaya.MFnMesh): Target mesh
+        name (str, optional): Cache name of the target, the target mesh name if None
+
+    Returns:
+        numpy.ndarray: (vertices,) gather indices, None if the vertex ids already match
+
+    Raises:
+        ValueError: The target topology isn't the base one
+    """
+    base_fingerprint = mesh.get_fingerprint(base_mesh)
+    target_fingerprint = mesh.get_fingerprint(target_mesh)
+    if target_fingerprint == base_fingerprint:
+        return None
+
+    target_name = target_mesh.name() if isinstance(target_mesh, OpenMaya.MFnMesh) else target_mesh
+    if base_fingerprint[:3] != target_fingerprint[:3]:
+        raise ValueError(f'{target_name} doesn\'t have the topology of the base mesh')
+
+    stage = f'remap_{name or target_name}'
+    fingerprint = numpy.array([base_fingerprint[-1], target_fingerprint[-1]])
+
+    data = cache.load(stage)
+    if data and numpy.array_equal(data['fingerprint'], fingerprint):
+        return data['order']
+
+    order = find_order(base_mesh, target_mesh)
+    if order is None:
+        raise ValueError(f'The vertices of {target_name} couldn\'t be matched to the base mesh')
+
+    OpenMaya.MGlobal.displayInfo(f'{target_name}: vertex order remapped')
+    cache.save(stage, order=order, fingerprint=fingerprint)
+    return order
+
+
+def get_points(base_mesh, target_mesh, name=None):
+    """Target positions in base vertex order, ready for delta extraction"""
+    points = mesh.get_points(target_mesh)
+    order = get_order(base_mesh, target_mesh, name)
+    return points if order is None else points[order]
+
+
+def apply(base_mesh, target_mesh, name=None):
+    """Moves the target points into base vertex order, so a blendShape reads them vertex by vertex
+
+    Returns:
+        bool: True if the target was reordered
+    """
+    order = get_order(base_mesh, target_mesh, name)
+    if order is None:
+        return False
+    mesh.set_points(target_mesh, mesh.get_points(target_mesh)[order])
+    return True
@@ -0,0 +1,167 @@
+from maya.api import OpenMaya
+
+import time
+import json
+import numpy
+
+from . import cache, lib, regions, skin, solver
+
+
+def get_errors(reference, result, region_values):
+    """Distances between the blendshape result and the skinned approximation
+
+    Args:
+        reference (numpy.ndarray): (frames, vertices, 3) blendshape positions
+        result (numpy.ndarray): (frames, vertices, 3) skinned positions
+        region_values (dict): region name as key and (vertices,) mask values as value
+
+    Returns:
+        dict: global rms and max error, per vertex rms error and per region rms and max errors
+    """
+    distance = numpy.linalg.norm(reference - result, axis=2)
+    vertex_rms = numpy.sqrt(numpy.mean(distance ** 2, axis=0))
+
+    data = {'rms': float(numpy.sqrt(numpy.mean(distance ** 2))),
+            'max': float(distance.max()),
+            'vertex_rms': vertex_rms,
+            'regions': dict()}
+
+    for region, values in region_values.items():
+        if not values.any():
+            continue
+        data['regions'][region] = {
+            'rms': float(numpy.sqrt(numpy.average(vertex_rms ** 2, weights=values))),
+            'max': float(distance[:, values > 0.0].max())}
+    return data
+
+
+def get_runtime_cost(weights, frames=50):
+    """Skinning cost of a weight set: average influences per vertex and NumPy skinning time per frame"""
+    influences = numpy.count_nonzero(weights, axis=1)
+
+    transforms = solver.identity_transforms(frames, weights.shape[1])
+    rest = numpy.zeros((len(weights), 3))
+    start = time.perf_counter()
+    solver.skin_points(rest, transforms, weights)
+    elapsed = (time.perf_counter() - start) / frames
+
+    return {'influences': float(influences.mean()), 'max_influences': int(influences.max()), 'frame_time': elapsed}
+
+
+def evaluate(blendshape_mesh, skinned_mesh, total_frame, masks, solve_time=None):
+    """Samples every ROM frame of both meshes, stores the errors with the solve time and joint count.
+    The samples are cached as the 'rom' stage so sweep can reuse them.
+
+    Args:
+        blendshape_mesh (str): Mesh deformed by the blendshapes through the ROM
+        skinned_mesh (str): Mesh skinned to the facial joints
+        total_frame (int): Last frame of the ROM
+        masks (dict): mask name as key and {vertex id: value} as value
+        solve_time (float, optional): Seconds the decomposition took
+
+    Returns:
+        dict: The report entry
+    """
+    frames = list(range(1, total_frame + 1))
+    reference = lib.sample_points(blendshape_mesh, frames)
+    result = lib.sample_points(skinned_mesh, frames)
+
+    weights, influences = skin.get_weights(skinned_mesh)
+    region_values = regions.get_region_values(lib.get_mask_arrays(masks, len(weights)))
+
+    errors = get_errors(reference, result, region_values)
+    vertex_rms = errors.pop('vertex_rms')
+
+    entry = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+             'solve_time': solve_time,
+             'frames': len(frames),
+             'joints': int(numpy.count_nonzero(weights.max(axis=0))),
+             **errors,
+             **get_runtime_cost(weights)}
+
+    cache.save('rom', rest=result[0], poses=reference, weights=weights, influences=numpy.array(influences),
+               joint_positions=lib.get_joint_positions(influences), vertex_rms=vertex_rms,
+               **{f'region_{region}': values for region, values in region_values.items()})
+    save_entry('report', entry)
+    display([entry])
+    return entry
+
+
+def save_entry(name, entry):
+    path = cache.get_cache_dir() / f'{name}.json'
+    history = json.loads(path.read_text()) if path.exists() else list()
+    history.append(entry)
+    path.write_text(json.dumps(history, indent=4))
+
+
+def select_joints(joint_positions, count):
+    """Farthest point sampling of the joints, so smaller rigs still cover the whole face"""
+    selected = [int(numpy.argmin(joint_positions[:, 1]))]
+    distance = numpy.linalg.norm(joint_positions - joint_positions[selected[0]], axis=1)
+    for _ in range(min(count, len(joint_positions)) - 1):
+        selected.append(int(numpy.argmax(distance)))
+        distance = numpy.minimum(distance, numpy.linalg.norm(joint_positions - joint_positions[selected[-1]], axis=1))
+    return sorted(selected)
+
+
+def sweep(joint_counts, max_influences=(4, 8), iterations=20, threads=None):
+    """Solves the cached ROM for every joint count and influence limit to chart error against cost.
+    Needs the 'rom' stage written by evaluate, the scene isn't touched.
+
+    Args:
+        joint_counts (list): Number of joints of every tested rig
+        max_influences (list, optional): Influence limits tested for every joint count
+        iterations (int, optional): Solver iterations
+        threads (int, optional): BLAS threads
+
+    Returns:
+        list: One entry per configuration with its error, build time and runtime cost
+    """
+    data = cache.load('rom')
+    if not data:
+        OpenMaya.MGlobal.displayWarning('No cached ROM, run a build with the accuracy report first')
+        return list()
+
+    region_values = {key[len('region_'):]: values for key, values in data.items() if key.startswith('region_')}
+
+    entries = list()
+    for count in joint_counts:
+        joints = select_joints(data['joint_positions'], count)
+        for limit in max_influences:
+            weights = solver.initial_weights(data['rest'], data['joint_positions'][joints], limit)
+
+            start = time.perf_counter()
+            weights, transforms = solver.decompose(data['rest'], data['poses'], weights, None, iterations, limit,
+                                                   threads=threads)
+            solve_time = time.perf_counter() - start
+
+            result = solver.skin_points(data['rest'], transforms, weights)
+            errors = get_errors(data['poses'], result, region_values)
+            errors.pop('vertex_rms')
+
+            entries.append({'joints': len(joints), 'limit': limit, 'solve_time': solve_time,
+                            **errors, **get_runtime_cost(weights)})
+
+    save_entry('sweep', {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'entries': entries})
+    write_csv(entries, cache.get_cache_dir() / 'sweep.csv')
+    display(entries)
+    return entries
+
+
+def write_csv(entries, file_path):
+    columns = ['joints', 'limit', 'solve_time', 'rms', 'max', 'influences', 'frame_time']
+    lines = [','.join(columns)]
+    for entry in entries:
+        lines.append(','.join(str(entry.get(column, '')) for column in columns))
+    file_path.write_text('\n'.join(lines))
+
+
+def display(entries):
+    """Prints the entries as a table with a bar of the rms error"""
+    worst = max(entry['rms'] for entry in entries) or 1.0
+    OpenMaya.MGlobal.displayInfo(f'{"joints":>7} {"limit":>6} {"solve":>9} {"rms":>10} {"max":>10} {"infl":>6}')
+    for entry in entries:
+        bar = '#' * int(round(30 * entry['rms'] / worst))
+        OpenMaya.MGlobal.displayInfo(
+            f'{entry["joints"]:>7} {entry.get("limit", "-"):>6} {entry["solve_time"] or 0.0:>8.2f}s '
+            f'{entry["rms"]:>10.5f} {entry["max"]:>10.5f} {entry["influences"]:>6.2f} {bar}')
@@ -0,0 +1,110 @@
+from .blendshapes import BlendShapeData
+from .driven_keys import DrivenKeysData
+
+import numpy
+
+
+def get_target_masks():
+    """Maps every blendshape target name to the mask applied to it
+
+    Returns:
+        dict: target name as key and mask name as value
+    """
+    target_masks = dict()
+    for shape in BlendShapeData.BLENDSHAPES.values():
+        for name, values in shape.items():
+            target_masks[name] = BlendShapeData.MASKS[values[0]]
+    return target_masks
+
+
+def get_pose_region(ctr, attr, value, masks):
+    """Vertices a control can move when posed at the given value, following the driven keys
+
+    Args:
+        ctr (str): Board control name
+        attr (str): Control attribute
+        value (float): Posed value, only its sign matters
+        masks (dict): mask name as key and (vertices,) numpy.ndarray as value
+
+    Returns:
+        numpy.ndarray: Boolean array of the vertices, None if the pose drives anything but masked blendshapes
+    """
+    pose = DrivenKeysData.POSES.get(f'{ctr}.{attr}', {}).get(str(int(numpy.sign(value))))
+    if not pose:
+        return None
+
+    target_masks = get_target_masks()
+    region = None
+    for driven in pose:
+        node, target = driven.split('.')
+        if node != BlendShapeData.NAME or target_masks.get(target) not in masks:
+            return None
+
+        values = masks[target_masks[target]] > 0.0
+        region = values if region is None else region | values
+    return region
+
+
+def schedule(poses, masks):
+    """Packs the poses whose vertex regions don't intersect into shared frames, first fit in the given order.
+    Poses that can't be traced back to masked blendshapes get a frame of their own.
+
+    Args:
+        poses (list): [control, attribute, neutral value, target value] of every pose
+        masks (dict): mask name as key and (vertices,) numpy.ndarray as value
+
+    Returns:
+        tuple: list of pose groups sharing a frame,
+        and dict with (control.attribute, target value) as key and the vertices it owns as value
+    """
+    groups = list()
+    owners = dict()
+
+    for pose in poses:
+        ctr, attr, neutral_value, target_value = pose
+        region = get_pose_region(ctr, attr, target_value, masks)
+
+        if region is not None:
+            owners[(f'{ctr}.{attr}', target_value)] = region
+
+            for group in groups:
+                if group['region'] is None or ctr in group['controls']:
+                    continue
+                if numpy.any(group['region'] & region):
+                    continue
+                group['poses'].append(pose)
+                group['controls'].add(ctr)
+                group['region'] = group['region'] | region
+                break
+            else:
+                groups.append({'poses': [pose], 'controls': {ctr}, 'region': region})
+            continue
+
+        groups.append({'poses': [pose], 'controls': {ctr}, 'region': None})
+
+    return [group['poses'] for group in groups], owners
+
+
+def get_owner(drivers, owners, joint_weights):
+    """Picks the driver of a shared frame that moved a joint, from the joint skin weights over each driver region
+
+    Args:
+        drivers (list): {'node', 'attribute', 'value'} of every control posed on the frame
+        owners (dict): Vertices owned by each pose, from schedule
+        joint_weights (numpy.ndarray): (vertices,) skin weights of the joint, None if it isn't an influence
+
+    Returns:
+        dict: The driver owning the joint, None if the joint doesn't influence any of the regions
+    """
+    if len(drivers) == 1:
+        return drivers[0]
+    if joint_weights is None:
+        return None
+
+    mass = [joint_weights[owners[(f"{driver['node']}.{driver['attribute']}", driver['value'])]].sum()
+            if (f"{driver['node']}.{driver['attribute']}", driver['value']) in owners else 0.0
+            for driver in drivers]
+
+    if max(mass) <= 0.0:
+        return None
+    return drivers[int(numpy.argmax(mass))]
@@ -0,0 +1,112 @@
+from maya import cmds
+
+import os
+import json
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_session_dir():
+    """Folder of the autosaved FaceUI session, in the user app dir so it's found whatever scene is open"""
+    path = Path(cmds.internalVar(userAppDir=True)) / 'FacialRig' / 'session'
+    (path / 'masks').mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def write_json(path, data):
+    """Compact JSON, the previous file is replaced only once the new one is complete"""
+    temp_path = path.with_suffix('.tmp')
+    with open(str(temp_path), 'w') as f:
+        f.write(json.dumps(data, separators=(',', ':')))
+    os.replace(str(temp_path), str(path))
+
+
+class SessionStore:
+    def __init__(self, path=None):
+        """Autosave of the masks and fields of FaceUI.
+        Every mask is its own file and only the masks marked dirty since the last save are written again.
+        The writes happen on a worker thread, the caller only copies the dirty masks.
+
+        Args:
+            path (pathlib.Path, optional): Session folder, get_session_dir if None
+        """
+        self.path = path or get_session_dir()
+        self.dirty = set()
+        self.meta_dirty = False
+        self.future = None
+        self.pending = set()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def mark(self, mask=None):
+        """Flags a mask to be written by the next save, the session data if mask is None"""
+        if mask is None:
+            self.meta_dirty = True
+        else:
+            self.dirty.add(mask)
+
+    def save(self, masks, meta):
+        """Starts writing the dirty masks, nothing happens while the previous save is still writing
+
+        Args:
+            masks (dict): mask name as key and {vertex id: value} as value
+            meta (dict): JSON serializable session data, eg. the base head and the joint fields
+
+        Returns:
+            bool: True if a save was started
+        """
+        if self.future and not self.future.done():
+            return False
+        # A failed write is tried again, the worker only reports it so the dirty flags stay on this thread
+        if self.future and self.future.exception():
+            self.dirty.update(self.pending)
+            self.meta_dirty = True
+        self.future = None
+
+        if not self.dirty and not self.meta_dirty:
+            return False
+
+        # Copies made now, the artist can keep painting while they're written
+        names = set(self.dirty)
+        snapshot = {name: {int(vtx): float(value) for vtx, value in masks[name].items()}
+                    for name in names if name in masks}
+        meta = dict(meta, masks=sorted(masks.keys()))
+
+        self.dirty.clear()
+        self.meta_dirty = False
+        self.pending = names
+        self.future = self.executor.submit(self.write, snapshot, meta)
+        return True
+
+    def write(self, snapshot, meta):
+        for name, values in snapshot.items():
+            write_json(self.path / 'masks' / f'{name}.json', values)
+
+        # The session file goes last, it only lists masks already on disk
+        write_json(self.path / 'session.json', meta)
+
+    def flush(self, masks, meta):
+        """Writes whatever is dirty and waits for it, eg. when the UI closes"""
+        if self.future:
+            # Waits without raising, save queues a failed write again
+            self.future.exception()
+        if self.save(masks, meta):
+            self.future.result()
+
+    def restore(self):
+        """Reads the last saved session
+
+        Returns:
+            tuple: session data dict and masks dict, (None, None) if there's no session
+        """
+        session_path = self.path / 'session.json'
+        if not session_path.exists():
+            return None, None
+
+        meta = json.loads(session_path.read_text())
+        masks = dict()
+        for name in meta.get('masks', list()):
+            mask_path = self.path / 'masks' / f'{name}.json'
+            if mask_path.exists():
+                # JSON keys are strings, the painted masks use int vertex ids
+                masks[name] = {int(vtx): float(value) for vtx, value in json.loads(mask_path.read_text()).items()}
+        return meta, masks
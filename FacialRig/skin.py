@@ -0,0 +1,296 @@
+from maya.api import OpenMaya, OpenMayaAnim
+from maya import cmds
+
+import numpy
+import functools
+
+from . import journal, nodes, profiling, solver
+
+
+def get_skin_cluster(mesh):
+    """Finds the skin cluster deforming a mesh
+
+    Args:
+        mesh (str): Transform node or shape node name of the mesh
+
+    Returns:
+        OpenMaya.MObject: The skin cluster node, None if the mesh isn't skinned
+    """
+    return nodes.get_linked(mesh, 'skinCluster', find_skin_cluster)
+
+
+def find_skin_cluster(mesh):
+    dag = nodes.get_dag(mesh)
+    dag.extendToShape()
+
+    dag_iter = OpenMaya.MItDependencyGraph(dag.node(),
+                                           OpenMaya.MFn.kSkinClusterFilter,
+                                           OpenMaya.MItDependencyGraph.kUpstream)
+    if dag_iter.isDone():
+        return None
+    return dag_iter.currentNode()
+
+
+def get_complete_component(count):
+    component_fn = OpenMaya.MFnSingleIndexedComponent()
+    component = component_fn.create(OpenMaya.MFn.kMeshVertComponent)
+    component_fn.setCompleteData(count)
+    return component
+
+
+def get_influences(mesh):
+    """Influence names of a skinned mesh, in the order the skin cluster stores them"""
+    skin_fn = OpenMayaAnim.MFnSkinCluster(get_skin_cluster(mesh))
+    return [dag.partialPathName() for dag in skin_fn.influenceObjects()]
+
+
+def get_weights(mesh, sparse=False):
+    """Reads every skin weight of a mesh through a single getWeights call
+
+    Args:
+        mesh (str): Skinned mesh
+        sparse (bool, optional): Returns the weights in CSR form, see to_csr
+
+    Returns:
+        tuple: (vertices, influences) numpy.ndarray, or its CSR form, and the list of influence names
+    """
+    skin_fn = OpenMayaAnim.MFnSkinCluster(get_skin_cluster(mesh))
+    dag = nodes.get_dag(mesh)
+    dag.extendToShape()
+
+    count = OpenMaya.MFnMesh(dag).numVertices
+    weights, influence_count = skin_fn.getWeights(dag, get_complete_component(count))
+
+    influences = [influence.partialPathName() for influence in skin_fn.influenceObjects()]
+    weights = numpy.array(weights).reshape(count, influence_count)
+    return (to_csr(weights) if sparse else weights), influences
+
+
+def set_weights(mesh, weights, normalize=False):
+    """Writes every skin weight of a mesh through a single setWeights call
+
+    Args:
+        mesh (str): Skinned mesh
+        weights (numpy.ndarray, tuple): (vertices, influences) array ordered as the skin cluster influences,
+            or its CSR form
+        normalize (bool, optional): Lets the skin cluster normalize the weights
+    """
+    skin_fn = OpenMayaAnim.MFnSkinCluster(get_skin_cluster(mesh))
+    dag = nodes.get_dag(mesh)
+    dag.extendToShape()
+
+    if isinstance(weights, tuple):
+        weights = from_csr(*weights, len(skin_fn.influenceObjects()))
+
+    component = get_complete_component(weights.shape[0])
+    influence_indices = OpenMaya.MIntArray(range(weights.shape[1]))
+    old_weights = skin_fn.setWeights(
+        dag,
+        component,
+        influence_indices,
+        OpenMaya.MDoubleArray(numpy.ascontiguousarray(weights, dtype=numpy.float64).ravel().tolist()),
+        normalize,
+        returnOldWeights=journal.is_recording()
+    )
+    if journal.is_recording():
+        journal.record(functools.partial(skin_fn.setWeights, dag, component, influence_indices, old_weights, False))
+
+
+def load_weights(mesh, weights, influences, normalize=False):
+    """Writes weights of named influences, whatever the skin cluster influence order is.
+    The mesh is bound if it isn't skinned and missing influences are added with no weight first.
+
+    Args:
+        mesh (str): Mesh to skin
+        weights (numpy.ndarray, tuple): (vertices, influences) array, or its CSR form, ordered as influences
+        influences (list): Influence names of the weight columns
+        normalize (bool, optional): Lets the skin cluster normalize the weights
+    """
+    if isinstance(weights, tuple):
+        weights = from_csr(*weights, len(influences))
+
+    skin_obj = get_skin_cluster(mesh)
+    if not skin_obj:
+        cmds.skinCluster(influences, mesh, tsb=True, n=f'{mesh}_skin')
+    else:
+        current = get_influences(mesh)
+        missing = [influence for influence in influences if influence not in current]
+        if missing:
+            cmds.skinCluster(OpenMaya.MFnDependencyNode(skin_obj).name(), e=True, ai=missing, lw=True, wt=0.0)
+
+    current = get_influences(mesh)
+    result = numpy.zeros((len(weights), len(current)))
+    result[:, [current.index(influence) for influence in influences]] = weights
+    set_weights(mesh, result, normalize)
+
+
+def to_csr(weights, tolerance=0.0):
+    """Compressed rows of a dense weight matrix
+
+    Returns:
+        tuple: (vertices + 1,) row pointers, column indices and values
+    """
+    rows, columns = numpy.nonzero(numpy.abs(weights) > tolerance)
+    indptr = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(rows, minlength=len(weights)))])
+    return indptr.astype(numpy.int64), columns.astype(numpy.int32), weights[rows, columns]
+
+
+def from_csr(indptr, indices, values, columns):
+    weights = numpy.zeros((len(indptr) - 1, columns), dtype=values.dtype)
+    rows = numpy.repeat(numpy.arange(len(indptr) - 1), numpy.diff(indptr))
+    weights[rows, indices] = values
+    return weights
+
+
+def get_rest_points(mesh):
+    """Positions of the mesh before the skin cluster deforms it, as the skin cluster receives them"""
+    skin_fn = OpenMaya.MFnDependencyNode(get_skin_cluster(mesh))
+    geometry_plug = skin_fn.findPlug('input', False).elementByLogicalIndex(0).child(0)
+    return numpy.array(OpenMaya.MFnMesh(geometry_plug.asMObject()).getPoints())[:, :3]
+
+
+def sample_transforms(mesh, frames):
+    """Skinning transforms of every influence at every frame, bindPreMatrix times worldMatrix
+
+    Args:
+        mesh (str): Skinned mesh
+        frames (list): Frames to sample
+
+    Returns:
+        numpy.ndarray: (frames, influences, 3, 4) transforms, column vector convention like the solver module
+    """
+    skin_obj = get_skin_cluster(mesh)
+    skin_fn = OpenMayaAnim.MFnSkinCluster(skin_obj)
+    bind_plug = skin_fn.findPlug('bindPreMatrix', False)
+
+    influences = list(skin_fn.influenceObjects())
+    bind_matrices = [OpenMaya.MFnMatrixData(
+        bind_plug.elementByLogicalIndex(skin_fn.indexForInfluenceObject(dag)).asMObject()).matrix()
+        for dag in influences]
+
+    current_time = OpenMayaAnim.MAnimControl.currentTime()
+    transforms = numpy.zeros((len(frames), len(influences), 3, 4))
+    for i, frame in enumerate(frames):
+        OpenMayaAnim.MAnimControl.setCurrentTime(OpenMaya.MTime(frame, OpenMaya.MTime.uiUnit()))
+        for j, (dag, bind_matrix) in enumerate(zip(influences, bind_matrices)):
+            # Maya matrices use row vectors, transposing gives the column vector form
+            matrix = numpy.array(list(bind_matrix * dag.inclusiveMatrix())).reshape(4, 4)
+            transforms[i, j] = matrix.T[:3]
+    OpenMayaAnim.MAnimControl.setCurrentTime(current_time)
+    return transforms
+
+
+def prune(weights, max_influences=4):
+    """Keeps the strongest influences of every vertex, in a fixed width sparse form
+
+    Args:
+        weights (numpy.ndarray): (vertices, influences) dense weights
+        max_influences (int, optional): Influences kept per vertex
+
+    Returns:
+        tuple: (vertices, max_influences) influence indices and normalized values, strongest first
+    """
+    max_influences = min(max_influences, weights.shape[1])
+    indices = numpy.argpartition(-weights, max_influences - 1, axis=1)[:, :max_influences]
+    values = numpy.take_along_axis(weights, indices, axis=1)
+
+    order = numpy.argsort(-values, axis=1)
+    indices = numpy.take_along_axis(indices, order, axis=1)
+    values = numpy.take_along_axis(values, order, axis=1)
+
+    total = values.sum(axis=1, keepdims=True)
+    values = numpy.divide(values, total, out=numpy.zeros_like(values), where=total > 0.0)
+    return indices, values
+
+
+def quantize(values, bits=8):
+    """Quantizes normalized weights so every vertex sums exactly to the largest integer,
+    the rounding leftovers go to the weights with the largest remainders
+
+    Args:
+        values (numpy.ndarray): (vertices, n) normalized weights
+        bits (int, optional): 8 or 16
+
+    Returns:
+        numpy.ndarray: (vertices, n) unsigned integer weights
+    """
+    levels = (1 << bits) - 1
+    scaled = values * levels
+    quantized = numpy.floor(scaled)
+
+    leftover = numpy.rint(levels - quantized.sum(axis=1)).astype(int)
+    leftover[values.sum(axis=1) == 0.0] = 0
+
+    order = numpy.argsort(quantized - scaled, axis=1)
+    ranks = numpy.empty_like(order)
+    numpy.put_along_axis(ranks, order, numpy.arange(values.shape[1])[None].repeat(len(values), axis=0), axis=1)
+    quantized += ranks < leftover[:, None]
+
+    return quantized.astype(numpy.uint8 if bits <= 8 else numpy.uint16)
+
+
+def dequantize(quantized, bits=8):
+    return quantized.astype(numpy.float64) / ((1 << bits) - 1)
+
+
+def to_dense(indices, values, influence_count):
+    weights = numpy.zeros((len(indices), influence_count))
+    numpy.put_along_axis(weights, indices, values, axis=1)
+    return weights
+
+
+def skin_sparse(rest, transforms, indices, values):
+    """Linear blend skinning from the fixed width sparse form of prune
+
+    Returns:
+        numpy.ndarray: (frames, vertices, 3) skinned positions
+    """
+    homogeneous = numpy.concatenate([rest, numpy.ones((len(rest), 1))], axis=1)
+    blended = numpy.einsum('vk,fvkab->fvab', values, transforms[:, indices])
+    return numpy.einsum('fvab,vb->fva', blended, homogeneous)
+
+
+def optimize(mesh, max_influences=4, bits=8, frames=None):
+    """Limits the influences per vertex, quantizes the weights and writes them back in one call.
+    Displays the playback rate of the scene before and after, which includes the skin cluster evaluation,
+    and the deformation error against the original weights.
+
+    Args:
+        mesh (str): Skinned mesh
+        max_influences (int, optional): Influences kept per vertex, eg. 4 or 8
+        bits (int, optional): Weight precision, 8 or 16 bits
+        frames (list, optional): Frames used to measure the deformation error, the playback range if None
+
+    Returns:
+        dict: influences and playback frames per second before and after, and the deformation errors
+    """
+    weights, influences = get_weights(mesh)
+    indices, values = prune(weights, max_influences)
+    values = dequantize(quantize(values, bits), bits)
+
+    if frames is None:
+        start = int(OpenMayaAnim.MAnimControl.minTime().asUnits(OpenMaya.MTime.uiUnit()))
+        end = int(OpenMayaAnim.MAnimControl.maxTime().asUnits(OpenMaya.MTime.uiUnit()))
+        frames = list(range(start, end + 1))
+
+    rest = get_rest_points(mesh)
+    transforms = sample_transforms(mesh, frames)
+    error = numpy.linalg.norm(solver.skin_points(rest, transforms, weights) -
+                              skin_sparse(rest, transforms, indices, values), axis=2)
+
+    # Maya's own evaluation of the skin cluster, with the original and the optimized weights
+    fps_before = profiling.playback_fps(frames[0], frames[-1])
+    set_weights(mesh, to_dense(indices, values, len(influences)))
+    fps_after = profiling.playback_fps(frames[0], frames[-1])
+
+    data = {'influences': [float(numpy.count_nonzero(weights, axis=1).mean()),
+                           float(numpy.count_nonzero(values, axis=1).mean())],
+            'fps': [fps_before, fps_after],
+            'rms_error': float(numpy.sqrt(numpy.mean(error ** 2))),
+            'max_error': float(error.max())}
+
+    OpenMaya.MGlobal.displayInfo(f'Skin optimized to {max_influences} influences, {bits} bits')
+    OpenMaya.MGlobal.displayInfo('    influences per vertex: {:.2f} -> {:.2f}'.format(*data['influences']))
+    OpenMaya.MGlobal.displayInfo('    playback fps: {:.1f} -> {:.1f}'.format(*data['fps']))
+    OpenMaya.MGlobal.displayInfo(f'    deformation error: rms {data["rms_error"]:.6f} max {data["max_error"]:.6f}')
+    return data
@@ -0,0 +1,338 @@
+"""
+Smooth skinning decomposition in NumPy, it doesn't import Maya so it can run headless or in worker processes.
+Transforms are (frames, joints, 3, 4) matrices mapping rest positions into each frame, column vector convention.
+
+Headless usage, with an archive written by lib.export_solver_data:
+    mayapy -m FacialRig.solver rom.npz result.npz --iterations 30 --max-influences 4 --threads 8
+"""
+import sys
+import time
+import argparse
+from contextlib import contextmanager
+
+import numpy
+
+
+@contextmanager
+def blas_threads(threads=None):
+    """Limits the threads used by the BLAS library numpy is linked with, if threadpoolctl is available"""
+    if not threads:
+        yield
+        return
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        yield
+        return
+    with threadpool_limits(limits=threads, user_api='blas'):
+        yield
+
+
+def to_homogeneous(points):
+    return numpy.concatenate([points, numpy.ones((len(points), 1))], axis=1)
+
+
+def identity_transforms(frames, joints):
+    transforms = numpy.zeros((frames, joints, 3, 4))
+    transforms[:, :, :, :3] = numpy.eye(3)
+    return transforms
+
+
+def skin_points(rest, transforms, weights):
+    """Linear blend skinning of the rest points
+
+    Args:
+        rest (numpy.ndarray): (vertices, 3) rest positions
+        transforms (numpy.ndarray): (frames, joints, 3, 4) joint transforms
+        weights (numpy.ndarray): (vertices, joints) skin weights
+
+    Returns:
+        numpy.ndarray: (frames, vertices, 3) skinned positions
+    """
+    frames, joints = transforms.shape[:2]
+    blended = weights @ transforms.transpose(1, 0, 2, 3).reshape(joints, -1)
+    blended = blended.reshape(len(rest), frames, 3, 4)
+    return numpy.einsum('vfab,vb->fva', blended, to_homogeneous(rest))
+
+
+def get_error(rest, poses, transforms, weights):
+    """Root mean square distance between the skinned and target positions"""
+    return float(numpy.sqrt(numpy.mean(numpy.sum((skin_points(rest, transforms, weights) - poses) ** 2, axis=2))))
+
+
+def initial_weights(rest, joint_positions, max_influences=4):
+    """Inverse distance weights to the closest joints, used when there's no skin to start from"""
+    distance = numpy.linalg.norm(rest[:, None] - joint_positions[None], axis=2)
+    max_influences = min(max_influences, len(joint_positions))
+
+    closest = numpy.argpartition(distance, max_influences - 1, axis=1)[:, :max_influences]
+    values = 1.0 / numpy.maximum(numpy.take_along_axis(distance, closest, axis=1), 1e-6) ** 2
+
+    weights = numpy.zeros_like(distance)
+    numpy.put_along_axis(weights, closest, values, axis=1)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def fit_rigid(sources, targets, weights):
+    """Weighted Kabsch solved for every frame at once, minimizing sum(||w * (R @ s + t) - q||^2)
+
+    Args:
+        sources (numpy.ndarray): (vertices, 3) rest positions
+        targets (numpy.ndarray): (frames, vertices, 3) positions to match
+        weights (numpy.ndarray): (vertices,) weights of the bone being fitted
+
+    Returns:
+        numpy.ndarray: (frames, 3, 4) rigid transforms
+    """
+    squared = weights * weights
+    total = max(squared.sum(), 1e-12)
+
+    source_center = squared @ sources / total
+    target_center = numpy.einsum('v,fva->fa', weights, targets) / total
+
+    centered_sources = weights[:, None] * (sources - source_center)
+    centered_targets = targets - weights[None, :, None] * target_center[:, None]
+    covariance = numpy.einsum('va,fvb->fab', centered_sources, centered_targets)
+
+    u, _, vt = numpy.linalg.svd(covariance)
+    correction = numpy.ones((len(covariance), 3))
+    correction[:, -1] = numpy.sign(numpy.linalg.det(vt.transpose(0, 2, 1) @ u.transpose(0, 2, 1)))
+    rotation = vt.transpose(0, 2, 1) @ (correction[:, :, None] * u.transpose(0, 2, 1))
+
+    translation = target_center - rotation @ source_center
+    return numpy.concatenate([rotation, translation[:, :, None]], axis=2)
+
+
+def fit_transforms(rest, poses, weights, transforms):
+    """Updates every joint transform in turn while the other joints stay fixed
+
+    Args:
+        rest (numpy.ndarray): (vertices, 3) rest positions
+        poses (numpy.ndarray): (frames, vertices, 3) target positions
+        weights (numpy.ndarray): (vertices, joints) skin weights
+        transforms (numpy.ndarray): (frames, joints, 3, 4) current transforms, updated in place
+
+    Returns:
+        numpy.ndarray: The updated transforms
+    """
+    homogeneous = to_homogeneous(rest)
+    skinned = skin_points(rest, transforms, weights)
+
+    for joint in range(weights.shape[1]):
+        vertices = numpy.flatnonzero(weights[:, joint])
+        if not len(vertices):
+            continue
+        joint_weights = weights[vertices, joint]
+
+        # What's left for this joint to explain once the other joints are removed
+        current = numpy.einsum('fab,vb->fva', transforms[:, joint], homogeneous[vertices])
+        residual = poses[:, vertices] - skinned[:, vertices] + joint_weights[None, :, None] * current
+
+        transforms[:, joint] = fit_rigid(rest[vertices], residual, joint_weights)
+
+        updated = numpy.einsum('fab,vb->fva', transforms[:, joint], homogeneous[vertices])
+        skinned[:, vertices] += joint_weights[None, :, None] * (updated - current)
+
+    return transforms
+
+
+def get_candidates(rest, poses, transforms, count):
+    """The joints that best explain each vertex trajectory on their own
+
+    Returns:
+        numpy.ndarray: (vertices, count) joint indices
+    """
+    homogeneous = to_homogeneous(rest)
+    joints = transforms.shape[1]
+    count = min(count, joints)
+
+    error = numpy.empty((len(rest), joints))
+    for joint in range(joints):
+        rigid = numpy.einsum('fab,vb->fva', transforms[:, joint], homogeneous)
+        error[:, joint] = numpy.sum((rigid - poses) ** 2, axis=(0, 2))
+
+    if count == joints:
+        return numpy.broadcast_to(numpy.arange(joints), (len(rest), joints)).copy()
+    return numpy.argpartition(error, count - 1, axis=1)[:, :count]
+
+
+def solve_nonnegative(normal, target, initial, iterations=100):
+    """Batched projected gradient for min(w.T @ G @ w - 2 * g.T @ w) with w >= 0
+
+    Args:
+        normal (numpy.ndarray): (vertices, n, n) G matrices
+        target (numpy.ndarray): (vertices, n) g vectors
+        initial (numpy.ndarray): (vertices, n) starting weights
+        iterations (int, optional): Gradient steps
+
+    Returns:
+        numpy.ndarray: (vertices, n) non-negative solution
+    """
+    # The trace bounds the largest eigenvalue, so the step is always stable
+    step = 1.0 / numpy.maximum(numpy.trace(normal, axis1=1, axis2=2), 1e-12)[:, None]
+    weights = initial.copy()
+    previous = weights.copy()
+    momentum = 1.0
+
+    for _ in range(iterations):
+        gradient = numpy.einsum('vij,vj->vi', normal, weights) - target
+        current = numpy.maximum(weights - step * gradient, 0.0)
+
+        next_momentum = (1.0 + numpy.sqrt(1.0 + 4.0 * momentum * momentum)) / 2.0
+        weights = current + ((momentum - 1.0) / next_momentum) * (current - previous)
+        weights = numpy.maximum(weights, 0.0)
+        previous, momentum = current, next_momentum
+
+    return previous
+
+
+def solve_nnls(normal, target):
+    """Exact non-negative least squares per vertex through scipy"""
+    from scipy.optimize import nnls
+
+    result = numpy.zeros_like(target)
+    for i in range(len(normal)):
+        # Cholesky of G gives back an A with A.T @ A = G and A.T @ b = g
+        factor = numpy.linalg.cholesky(normal[i] + numpy.eye(len(target[i])) * 1e-10).T
+        result[i] = nnls(factor, numpy.linalg.solve(factor.T, target[i]))[0]
+    return result
+
+
+def fit_weights(rest, poses, transforms, weights=None, max_influences=4, candidates=8,
+                affinity=10.0, method='gradient', chunk=256):
+    """Non-negative, sum to one and top-k sparse weights per vertex
+
+    Args:
+        rest (numpy.ndarray): (vertices, 3) rest positions
+        poses (numpy.ndarray): (frames, vertices, 3) target positions
+        transforms (numpy.ndarray): (frames, joints, 3, 4) joint transforms
+        weights (numpy.ndarray, optional): (vertices, joints) current weights used as starting point
+        max_influences (int, optional): Maximum joints per vertex
+        candidates (int, optional): Joints considered per vertex before the top-k selection
+        affinity (float, optional): Strength of the sum to one constraint, relative to the data term
+        method (str, optional): 'gradient' batched through BLAS, or 'nnls' exact per vertex (needs scipy)
+        chunk (int, optional): Vertices solved per batch
+
+    Returns:
+        numpy.ndarray: (vertices, joints) normalized weights
+    """
+    homogeneous = to_homogeneous(rest)
+    count, joints = len(rest), transforms.shape[1]
+    selected = get_candidates(rest, poses, transforms, max(candidates, max_influences))
+    result = numpy.zeros((count, joints))
+
+    for start in range(0, count, chunk):
+        block = slice(start, start + chunk)
+        block_candidates = selected[block]
+
+        # (vertices, frames * 3, candidates) position of every vertex if it was fully bound to each candidate
+        columns = numpy.einsum('fvcab,vb->vfac', transforms[:, block_candidates], homogeneous[block])
+        columns = columns.reshape(len(block_candidates), -1, block_candidates.shape[1])
+        targets = poses[:, block].transpose(1, 0, 2).reshape(len(columns), -1)
+
+        normal = columns.transpose(0, 2, 1) @ columns
+        target = numpy.einsum('vfc,vf->vc', columns, targets)
+
+        # The sum to one constraint is added as a weighted row of ones
+        scale = affinity * numpy.trace(normal, axis1=1, axis2=2)[:, None, None] / normal.shape[1]
+        normal = normal + scale
+        target = target + scale[:, :, 0]
+
+        if weights is None:
+            initial = numpy.full(target.shape, 1.0 / target.shape[1])
+        else:
+            initial = numpy.take_along_axis(weights[block], block_candidates, axis=1)
+
+        if method == 'nnls':
+            solved = solve_nnls(normal, target)
+        else:
+            solved = solve_nonnegative(normal, target, initial)
+        numpy.put_along_axis(result[block], block_candidates, solved, axis=1)
+
+    return limit_influences(result, max_influences)
+
+
+def limit_influences(weights, max_influences):
+    """Keeps the strongest influences of each vertex and normalizes them"""
+    if weights.shape[1] > max_influences:
+        weakest = numpy.argpartition(weights, -max_influences, axis=1)[:, :-max_influences]
+        numpy.put_along_axis(weights, weakest, 0.0, axis=1)
+
+    total = weights.sum(axis=1, keepdims=True)
+    empty = total[:, 0] == 0.0
+    weights[empty] = 1.0 / weights.shape[1]
+    total[empty] = 1.0
+    return weights / total
+
+
+def decompose(rest, poses, weights, transforms=None, iterations=20, max_influences=4,
+              tolerance=1e-3, patience=2, method='gradient', threads=None, history=None):
+    """Alternates transform and weight fitting until the error stops improving
+
+    Args:
+        rest (numpy.ndarray): (vertices, 3) rest positions
+        poses (numpy.ndarray): (frames, vertices, 3) target positions
+        weights (numpy.ndarray): (vertices, joints) initial weights
+        transforms (numpy.ndarray, optional): (frames, joints, 3, 4) initial transforms, identity if None
+        iterations (int, optional): Maximum number of transform and weight updates
+        max_influences (int, optional): Maximum joints per vertex
+        tolerance (float, optional): Relative error improvement under which an iteration counts as stalled
+        patience (int, optional): Stalled iterations allowed before stopping
+        method (str, optional): Weight solver, see fit_weights
+        threads (int, optional): BLAS threads, library default if None
+        history (list, optional): If given, the error and time of every iteration are appended to it
+
+    Returns:
+        tuple: (vertices, joints) weights and (frames, joints, 3, 4) transforms
+    """
+    if transforms is None:
+        transforms = identity_transforms(len(poses), weights.shape[1])
+    transforms = transforms.copy()
+    weights = limit_influences(weights.copy(), max_influences)
+
+    with blas_threads(threads):
+        best = numpy.inf
+        stalled = 0
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fit_transforms(rest, poses, weights, transforms)
+            weights = fit_weights(rest, poses, transforms, weights, max_influences, method=method)
+
+            error = get_error(rest, poses, transforms, weights)
+            if history is not None:
+                history.append({'error': error, 'time': time.perf_counter() - start})
+
+            stalled = stalled + 1 if best - error < tolerance * best else 0
+            best = min(best, error)
+            if stalled >= patience:
+                break
+
+    return weights, transforms
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Smooth skinning decomposition of a ROM archive')
+    parser.add_argument('source', help='npz archive with rest, poses, weights and optionally transforms')
+    parser.add_argument('result', help='npz archive receiving the weights and transforms')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--max-influences', type=int, default=4)
+    parser.add_argument('--tolerance', type=float, default=1e-3)
+    parser.add_argument('--method', choices=['gradient', 'nnls'], default='gradient')
+    parser.add_argument('--threads', type=int, default=None)
+    arguments = parser.parse_args(arguments)
+
+    data = numpy.load(arguments.source)
+    history = list()
+    weights, transforms = decompose(data['rest'], data['poses'], data['weights'],
+                                    data['transforms'] if 'transforms' in data else None,
+                                    arguments.iterations, arguments.max_influences, arguments.tolerance,
+                                    method=arguments.method, threads=arguments.threads, history=history)
+
+    numpy.savez(arguments.result, weights=weights, transforms=transforms,
+                error=[entry['error'] for entry in history], time=[entry['time'] for entry in history])
+    for i, entry in enumerate(history):
+        print(f'iteration {i + 1}: error {entry["error"]:.6f} time {entry["time"]:.3f}s')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+import os
+import json
+import struct
+import numpy
+from pathlib import Path
+
+
+MAGIC = b'FRIGANIM'
+VERSION = 1
+ALIGNMENT = 64
+CHUNK_SIZE = 256
+# Magic, version, offset and byte size of the table of contents, written once the stream is complete
+HEADER = struct.Struct('<8sIQQ')
+LEVELS = numpy.iinfo(numpy.uint16).max
+
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def get_layout(channel_count, chunk_size, quantize):
+    """Byte offsets inside a chunk block. A block holds chunk_size frames column by column,
+    every channel is contiguous. Quantized blocks start with the minimum and step of every channel.
+
+    Returns:
+        tuple: dict of (offset, dtype) by array name and the aligned block size
+    """
+    layout = dict()
+    offset = 0
+    if quantize:
+        for name in ['minimum', 'step']:
+            layout[name] = (offset, '<f4')
+            offset += channel_count * 4
+    value_dtype = '<u2' if quantize else '<f4'
+    layout['values'] = (offset, value_dtype)
+    offset += channel_count * chunk_size * numpy.dtype(value_dtype).itemsize
+    return layout, align(offset)
+
+
+def encode(chunk, chunk_size, quantize):
+    """Block bytes of a (frames, channels) chunk, the missing frames of the last chunk are left at zero
+
+    Returns:
+        tuple: block bytes and the largest quantization error
+    """
+    frame_count, channel_count = chunk.shape
+    layout, block_size = get_layout(channel_count, chunk_size, quantize)
+    block = numpy.zeros(block_size, dtype=numpy.uint8)
+
+    values = numpy.zeros((channel_count, chunk_size), dtype=layout['values'][1])
+    error = 0.0
+    if quantize:
+        minimum = chunk.min(axis=0)
+        step = (chunk.max(axis=0) - minimum) / LEVELS
+        # Constant channels decode to their minimum whatever the step
+        step[step == 0] = 1.0
+        minimum, step = minimum.astype(numpy.float32), step.astype(numpy.float32)
+        quantized = numpy.clip(numpy.rint((chunk - minimum) / step), 0, LEVELS)
+        values[:, :frame_count] = quantized.T
+        error = float(numpy.abs(quantized * step + minimum - chunk).max())
+
+        for name, array in [('minimum', minimum), ('step', step)]:
+            start = layout[name][0]
+            block[start:start + array.nbytes] = numpy.frombuffer(array.tobytes(), dtype=numpy.uint8)
+    else:
+        values[:, :frame_count] = chunk.T
+        error = float(numpy.abs(values[:, :frame_count].T - chunk).max())
+
+    start = layout['values'][0]
+    block[start:start + values.nbytes] = numpy.frombuffer(values.tobytes(), dtype=numpy.uint8)
+    return block.tobytes(), error
+
+
+def write(file_path, channels, chunks, chunk_size=CHUNK_SIZE, quantize=False, meta=None):
+    """Writes an animation stream chunk by chunk, only one chunk is ever held in memory.
+    The blocks follow the header one after the other and the table of contents ends the file.
+    The file is replaced only once it's complete, stopping the generator early leaves nothing behind.
+
+    Args:
+        file_path (str, pathlib.Path): Stream file
+        channels (list): Channel names, the column order of the chunks
+        chunks (iterable): (frames, channels) arrays, all of chunk_size frames but the last one
+        chunk_size (int, optional): Frames per block
+        quantize (bool, optional): Stores 16 bit values scaled per chunk and channel instead of 32 bit floats
+        meta (dict, optional): JSON serializable data stored in the table of contents
+
+    Yields:
+        int: Frames written so far
+    """
+    file_path = Path(file_path)
+    temp_path = file_path.with_suffix('.tmp')
+    data_start = align(HEADER.size)
+
+    frame_count = 0
+    error = 0.0
+    completed = False
+    try:
+        with open(str(temp_path), 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+            f.seek(data_start)
+            for chunk in chunks:
+                chunk = numpy.asarray(chunk, dtype=numpy.float64)
+                if chunk.shape[1] != len(channels) or chunk.shape[0] > chunk_size:
+                    raise ValueError(f'Chunks need {len(channels)} channels and at most {chunk_size} frames, '
+                                     f'got {chunk.shape}')
+                if frame_count % chunk_size:
+                    raise ValueError('Only the last chunk can be shorter than the chunk size')
+
+                block, chunk_error = encode(chunk, chunk_size, quantize)
+                f.write(block)
+                frame_count += len(chunk)
+                error = max(error, chunk_error)
+                yield frame_count
+
+            toc = json.dumps({'channels': list(channels), 'frame_count': frame_count, 'chunk_size': chunk_size,
+                              'quantize': quantize, 'error': error, 'meta': meta or dict()}).encode('utf-8')
+            toc_offset = f.tell()
+            f.write(toc)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, toc_offset, len(toc)))
+        os.replace(str(temp_path), str(file_path))
+        completed = True
+    finally:
+        if not completed and temp_path.exists():
+            temp_path.unlink()
+
+
+class Reader:
+    def __init__(self, file_path):
+        """Maps an animation stream in memory, a frame only reads its own block from disk
+
+        Args:
+            file_path (str, pathlib.Path): Stream file
+        """
+        with open(str(file_path), 'rb') as f:
+            magic, version, toc_offset, toc_size = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f'{file_path} isn\'t a FacialRig animation stream')
+            if version > VERSION:
+                raise ValueError(f'{file_path} was written by a newer version ({version}) than supported ({VERSION})')
+            if not toc_offset:
+                raise ValueError(f'{file_path} wasn\'t completely written')
+            f.seek(toc_offset)
+            toc = json.loads(f.read(toc_size).decode('utf-8'))
+
+        self.channels = toc['channels']
+        self.frame_count = toc['frame_count']
+        self.chunk_size = toc['chunk_size']
+        self.quantize = toc['quantize']
+        self.error = toc['error']
+        self.meta = toc['meta']
+        self.indices = {name: i for i, name in enumerate(self.channels)}
+
+        buffer = numpy.memmap(str(file_path), dtype=numpy.uint8, mode='r')
+        layout, block_size = get_layout(len(self.channels), self.chunk_size, self.quantize)
+        chunk_count = -(-self.frame_count // self.chunk_size)
+        data_start = align(HEADER.size)
+
+        # Strided views over the blocks, nothing is read until indexed
+        def view(name, shape, strides):
+            offset, dtype = layout[name]
+            return numpy.ndarray(shape, dtype=dtype, buffer=buffer, offset=data_start + offset, strides=strides)
+
+        channel_count = len(self.channels)
+        item_size = numpy.dtype(layout['values'][1]).itemsize
+        self.values = view('values', (chunk_count, channel_count, self.chunk_size),
+                           (block_size, self.chunk_size * item_size, item_size))
+        if self.quantize:
+            self.minimum = view('minimum', (chunk_count, channel_count), (block_size, 4))
+            self.step = view('step', (chunk_count, channel_count), (block_size, 4))
+
+    def __len__(self):
+        return self.frame_count
+
+    def decode(self, chunk, values):
+        """Float values of a (channels, frames) slice of a block"""
+        if not self.quantize:
+            return values.astype(numpy.float32)
+        return values * self.step[chunk][:, None] + self.minimum[chunk][:, None]
+
+    def frame(self, index):
+        """Values of every channel at a frame index, counted from the first exported frame
+
+        Returns:
+            numpy.ndarray: (channels,) float array
+        """
+        if not -self.frame_count <= index < self.frame_count:
+            raise IndexError(f'Frame {index} out of the {self.frame_count} frames of the stream')
+        chunk, position = divmod(index % self.frame_count, self.chunk_size)
+        return self.decode(chunk, self.values[chunk, :, position:position + 1])[:, 0]
+
+    def frames(self, start, stop):
+        """Values of every channel from start to stop, reading only the blocks in between
+
+        Returns:
+            numpy.ndarray: (frames, channels) float array
+        """
+        start, stop, _ = slice(start, stop).indices(self.frame_count)
+        result = list()
+        for chunk in range(start // self.chunk_size, -(-stop // self.chunk_size)):
+            first = max(start - chunk * self.chunk_size, 0)
+            last = min(stop - chunk * self.chunk_size, self.chunk_size)
+            result.append(self.decode(chunk, self.values[chunk, :, first:last]).T)
+        if not result:
+            return numpy.zeros((0, len(self.channels)), dtype=numpy.float32)
+        return numpy.concatenate(result)
+
+    def channel(self, name):
+        """Values of a channel over every frame
+
+        Returns:
+            numpy.ndarray: (frames,) float array
+        """
+        index = self.indices[name]
+        values = self.values[:, index, :]
+        if self.quantize:
+            values = values * self.step[:, index, None] + self.minimum[:, index, None]
+        return values.astype(numpy.float32).reshape(-1)[:self.frame_count]
@@ -0,0 +1,61 @@
+import os
+import json
+import pickle
+import functools
+from pathlib import Path
+
+
+ROOT = Path(__file__).parent
+
+
+@functools.lru_cache(maxsize=None)
+def load(name):
+    """Reads a JSON table of the package the first time it's needed.
+    A pickled copy is kept in __pycache__ and used while the JSON file doesn't change.
+
+    Args:
+        name (str): File name without extension, eg. 'blendshapes'
+
+    Returns:
+        dict: The table, shared by every caller
+    """
+    source = ROOT / f'{name}.json'
+    compiled = ROOT / '__pycache__' / f'{name}.pickle'
+    stamp = (source.stat().st_mtime_ns, source.stat().st_size)
+
+    try:
+        with open(str(compiled), 'rb') as f:
+            compiled_stamp, data = pickle.load(f)
+        if compiled_stamp == stamp:
+            return data
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+
+    data = json.loads(source.read_text())
+
+    # A read only install still works, it just parses the JSON every session
+    try:
+        compiled.parent.mkdir(exist_ok=True)
+        temp_path = compiled.with_suffix('.tmp')
+        with open(str(temp_path), 'wb') as f:
+            pickle.dump((stamp, data), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(str(temp_path), str(compiled))
+    except OSError:
+        pass
+    return data
+
+
+class Table:
+    def __init__(self, name, key=None):
+        """Class attribute holding a data table, or one of its keys, loaded on first access
+
+        Args:
+            name (str): Table file name without extension
+            key (str, optional): Key of the table returned instead of the whole table
+        """
+        self.name = name
+        self.key = key
+
+    def __get__(self, instance, owner):
+        data = load(self.name)
+        return data[self.key] if self.key else data
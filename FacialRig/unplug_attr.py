@@ -1,5 +1,7 @@
 from maya.api import OpenMaya
 
+from . import nodes
+
 
 class Unplugged(object):
     def __init__(self, node, attrs, plug=None):
@@ -23,11 +25,10 @@ class Unplugged(object):
 
         self.attrs = list()
         for n in node:
-            n = OpenMaya.MSelectionList().add(n).getDependNode(0)
             if plug:
                 self.attrs.extend([plug.elementByPhysicalIndex(x) for x in attrs])
                 continue
-            self.attrs.extend([OpenMaya.MFnDependencyNode(n).findPlug(x, False) for x in attrs])
+            self.attrs.extend([nodes.get_plug(n, x) for x in attrs])
 
         self.locked_attrs = [x for x in self.attrs if x.isLocked]
         self.connection_table = list()
@@ -39,20 +40,28 @@ class Unplugged(object):
         self.disconnect()
 
     def __exit__(self, typ, value, traceback):
+        # Everything is restored through a single modifier
+        modifier = OpenMaya.MDGModifier()
         for attr in self.attrs:
             inputs = attr.source()
             if not inputs.isNull:
-                OpenMaya.MDGModifier().disconnect(inputs, attr).doIt()
-        self.reconnect()
+                modifier.disconnect(inputs, attr)
+        self.reconnect(modifier)
+        modifier.deleteNode(self._temp_node)
+        modifier.doIt()
+
         for x in self.locked_attrs:
             x.isLocked = True
-        OpenMaya.MDGModifier().deleteNode(self._temp_node).doIt()
 
     def disconnect(self):
+        """Moves every input connection to a temp node, the temp attributes are added
+        by one modifier and the connections are swapped by another one"""
         modifier = OpenMaya.MDagModifier()
         self._temp_node = modifier.createNode("transform", OpenMaya.MObject.kNullObj)
         modifier.doIt()
 
+        modifier = OpenMaya.MDGModifier()
+        connected = list()
         for i, attr in enumerate(self.attrs):
             inputs = attr.source()
             if inputs.isNull:
@@ -61,18 +70,22 @@ class Unplugged(object):
             attr_obj = num_attr.create("attr%d" % i, "attr%d" % i, OpenMaya.MFnNumericData.kFloat, 0.0)
             num_attr.keyable = True
 
-            mod = OpenMaya.MDGModifier()
-            mod.addAttribute(self._temp_node, attr_obj)
-            mod.doIt()
+            modifier.addAttribute(self._temp_node, attr_obj)
+            connected.append([inputs, attr, attr_obj])
+        modifier.doIt()
 
-            plug = OpenMaya.MFnTransform(self._temp_node).findPlug(attr_obj, False)
+        modifier = OpenMaya.MDGModifier()
+        temp_node = OpenMaya.MFnDependencyNode(self._temp_node)
+        for inputs, attr, attr_obj in connected:
+            plug = temp_node.findPlug(attr_obj, False)
 
-            OpenMaya.MDGModifier().connect(inputs, plug).doIt()
-            OpenMaya.MDGModifier().disconnect(inputs, attr).doIt()
+            modifier.connect(inputs, plug)
+            modifier.disconnect(inputs, attr)
 
             self.connection_table.append([inputs, attr, plug])
+        modifier.doIt()
 
-    def reconnect(self):
+    def reconnect(self, modifier):
         for source, destination, temp_attr in self.connection_table:
-            OpenMaya.MDGModifier().connect(source, destination).doIt()
-            OpenMaya.MDGModifier().disconnect(source, temp_attr).doIt()
+            modifier.disconnect(source, temp_attr)
+            modifier.connect(source, destination)
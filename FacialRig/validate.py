@@ -0,0 +1,132 @@
+from maya.api import OpenMaya
+from maya import cmds
+
+import hashlib
+import numpy
+
+from .blendshapes import BlendShapeData
+from .driven_keys import DrivenKeysData
+from . import mesh, profiling, remap
+
+
+def resolve(names):
+    """Dag paths of the names found in the scene, all resolved through a single selection list
+
+    Returns:
+        dict: name as key and OpenMaya.MDagPath as value, missing names are left out
+    """
+    sel_list = OpenMaya.MSelectionList()
+    paths = dict()
+    for name in names:
+        try:
+            sel_list.add(name)
+        except RuntimeError:
+            continue
+        paths[name] = sel_list.getDagPath(sel_list.length() - 1)
+    return paths
+
+
+def get_driven_nodes():
+    """Scene nodes the driven keys tables expect, the blendShape node is made by the build"""
+    nodes = set()
+    for data in [DrivenKeysData.POSES, DrivenKeysData.JOINTS]:
+        for pose_data in data.values():
+            for driven_list in pose_data.values():
+                nodes.update(driven.split('.')[0] for driven in driven_list)
+    nodes.discard(BlendShapeData.NAME)
+    return sorted(nodes)
+
+
+def run(base_mesh, targets, joints=None, tolerance=1e-5):
+    """Checks the scene inputs of a build in one pass, before anything is created:
+        - every target exists and is a mesh, resolved in one batch.
+        - every target has the topology fingerprint of the base mesh, not only its vertex count.
+          A target with its vertices in another order is matched through remap instead.
+        - no target is a copy of the base mesh or of another target, from the vectorized deltas.
+        - every joint, and every node the driven keys tables drive, exists.
+
+    Args:
+        base_mesh (str): Neutral head mesh
+        targets (list): Shape and corrective mesh names
+        joints (list, optional): Joint names given in the UI
+        tolerance (float, optional): Deltas shorter than this count as zero
+
+    Returns:
+        dict: problem name as key and the list of names with that problem as value
+    """
+    problems = {'missing': list(), 'not_mesh': list(), 'topology': list(), 'zero_delta': list(),
+                'duplicate': list(), 'missing_joints': list()}
+
+    with profiling.timed('Pre-flight checks'):
+        base_fn = mesh.get_mesh_fn(base_mesh)
+        base_points = mesh.get_points(base_fn)
+
+        paths = resolve(targets)
+        names = list()
+        deltas = list()
+        for name in targets:
+            if name not in paths:
+                problems['missing'].append(name)
+                continue
+
+            dag = paths[name]
+            try:
+                dag.extendToShape()
+            except RuntimeError:
+                pass
+            if not dag.hasFn(OpenMaya.MFn.kMesh):
+                problems['not_mesh'].append(name)
+                continue
+
+            try:
+                points = remap.get_points(base_fn, OpenMaya.MFnMesh(dag), name)
+            except ValueError:
+                problems['topology'].append(name)
+                continue
+
+            names.append(name)
+            deltas.append(points - base_points)
+
+        if names:
+            deltas = numpy.stack(deltas)
+            zero = numpy.linalg.norm(deltas, axis=2).max(axis=1) <= tolerance
+
+            # Deltas snapped to the tolerance, equal targets hash the same
+            first = dict()
+            for name, target_deltas, is_zero in zip(names, numpy.rint(deltas / tolerance).astype(numpy.int64), zero):
+                if is_zero:
+                    problems['zero_delta'].append(name)
+                    continue
+                digest = hashlib.blake2b(target_deltas.tobytes(), digest_size=16).digest()
+                if digest in first:
+                    problems['duplicate'].append(f'{name} ({first[digest]})')
+                    continue
+                first[digest] = name
+
+        nodes = list(joints or list()) + get_driven_nodes()
+        existing = set(cmds.ls(nodes))
+        problems['missing_joints'] = [node for node in dict.fromkeys(nodes) if node not in existing]
+    return problems
+
+
+def report(problems):
+    """Prints the problems found by run
+
+    Returns:
+        bool: True if the build can't go on
+    """
+    messages = {'missing': 'The following shapes weren\'t found in the scene:',
+                'not_mesh': 'The following shapes aren\'t meshes:',
+                'topology': 'The following shapes don\'t match the topology of the base head:',
+                'zero_delta': 'The following shapes don\'t move any vertex:',
+                'duplicate': 'The following shapes are copies of another shape:',
+                'missing_joints': 'The following joints weren\'t found in the scene:'}
+
+    failed = False
+    for problem, names in problems.items():
+        if not names:
+            continue
+        print(messages[problem])
+        print(names)
+        failed = True
+    return failed